@@ -11,3 +11,74 @@ if django.VERSION < (1, 7):
     from django.db.models.signals import post_syncdb as post_migrate
 else:
     from django.db.models.signals import post_migrate
+
+
+if django.VERSION < (1, 9):
+    from django.db import DEFAULT_DB_ALIAS, connections
+
+    def on_commit(func, using=None):
+        """
+        Backport of the transaction hooks of Django 1.9: `func` runs after the outermost
+        atomic block commits, right away outside atomic blocks. It's discarded when the
+        transaction, or the savepoint it has been registered in, is rolled back.
+        """
+        connection = connections[using or DEFAULT_DB_ALIAS]
+        if connection.in_atomic_block:
+            _install_commit_hooks(connection)
+            connection.run_on_commit.append((set(connection.savepoint_ids), func))
+        else:
+            func()
+
+    def _install_commit_hooks(connection):
+        # hooks are kept in the same attribute used by Django 1.9
+        if hasattr(connection, "run_on_commit"):
+            return
+
+        connection.run_on_commit = []
+        connection.run_commit_hooks_on_set_autocommit_on = False
+        commit, rollback, savepoint_rollback, close, set_autocommit = (
+            connection.commit, connection.rollback, connection.savepoint_rollback, connection.close,
+            connection.set_autocommit)
+
+        def run_and_clear_commit_hooks():
+            hooks, connection.run_on_commit = connection.run_on_commit, []
+            for sids, func in hooks:
+                func()
+
+        def commit_with_hooks():
+            commit()
+            if not connection.run_on_commit:
+                return
+            if connection.features.autocommits_when_autocommit_is_off:
+                # atomic blocks turn autocommit back on without calling set_autocommit
+                connection.autocommit = True
+                run_and_clear_commit_hooks()
+            else:
+                connection.run_commit_hooks_on_set_autocommit_on = True
+
+        def set_autocommit_with_hooks(autocommit):
+            set_autocommit(autocommit)
+            if autocommit and connection.run_commit_hooks_on_set_autocommit_on:
+                connection.run_commit_hooks_on_set_autocommit_on = False
+                run_and_clear_commit_hooks()
+
+        def rollback_without_hooks():
+            connection.run_on_commit = []
+            connection.run_commit_hooks_on_set_autocommit_on = False
+            rollback()
+
+        def savepoint_rollback_without_hooks(sid):
+            savepoint_rollback(sid)
+            connection.run_on_commit = [(sids, func) for sids, func in connection.run_on_commit if sid not in sids]
+
+        def close_without_hooks():
+            connection.run_on_commit = []
+            close()
+
+        connection.commit = commit_with_hooks
+        connection.set_autocommit = set_autocommit_with_hooks
+        connection.rollback = rollback_without_hooks
+        connection.savepoint_rollback = savepoint_rollback_without_hooks
+        connection.close = close_without_hooks
+else:
+    from django.db.transaction import on_commit
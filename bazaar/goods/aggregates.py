@@ -0,0 +1,111 @@
+"""
+Conditional aggregates over the stocks of the products.
+
+Every aggregate sums the stocks of a set of locations with a CASE expression, so
+that any number of them share a single join of the stock table, and being regular
+annotations they can be filtered, ordered and paginated like any other.
+"""
+
+from __future__ import unicode_literals
+
+from django.db import models
+from django.db.models.sql import aggregates
+
+
+def _location_ids(location_ids):
+    if isinstance(location_ids, (list, tuple, set)):
+        return list(location_ids)
+    return [location_ids]
+
+
+class SQLStockAggregate(aggregates.Aggregate):
+    sql_template = "COALESCE(SUM(CASE WHEN %(condition)s THEN %(field)s END), %(default)s)"
+    positive_only = False
+
+    def as_sql(self, qn, connection):
+        table, column = self.col
+        field = "%s.%s" % (qn(table), qn(column))
+
+        condition = "%s.%s IN (%s)" % (qn(table), qn("location_id"), ", ".join(["%s"] * len(self.location_ids)))
+        if self.positive_only:
+            condition += " AND %s > 0" % field
+
+        substitutions = {
+            "table": qn(table),
+            "field": field,
+            "condition": condition,
+            "default": self.default,
+        }
+        substitutions.update(self.extra)
+
+        # the condition is repeated by templates using more than one sum
+        params = list(self.location_ids) * self.sql_template.count("%(condition)s")
+        sql = self.sql_template % substitutions
+        if connection.vendor == "sqlite":
+            # decimals are compared as text by sqlite, unless the expression has a numeric affinity
+            sql = "CAST(%s AS NUMERIC)" % sql
+        return sql, params
+
+
+class SQLStockQuantity(SQLStockAggregate):
+    pass
+
+
+class SQLStockAverageCost(SQLStockAggregate):
+    sql_template = ("SUM(CASE WHEN %(condition)s THEN %(table)s.unit_price * %(field)s END) / "
+                    "SUM(CASE WHEN %(condition)s THEN %(field)s END)")
+    positive_only = True
+
+
+class SQLStockAveragePriceDelta(SQLStockAggregate):
+    sql_template = ("%(product)s.price - GREATEST(%(lower_fixed_store_fee)s, %(product)s.price * %(store_fee)s) - "
+                    "SUM(CASE WHEN %(condition)s THEN %(table)s.unit_price * %(field)s END) / "
+                    "SUM(CASE WHEN %(condition)s THEN %(field)s END)")
+    positive_only = True
+
+
+class StockAggregate(models.Aggregate):
+    sql_class = None
+
+    def __init__(self, location_ids, default=None, lookup="stocks__quantity", **extra):
+        super(StockAggregate, self).__init__(lookup, **extra)
+        self.location_ids = _location_ids(location_ids)
+        self.default = "NULL" if default is None else int(default)
+
+    def add_to_query(self, query, alias, col, source, is_summary):
+        aggregate = self.sql_class(col, source=source, is_summary=is_summary, **self.extra)
+        aggregate.location_ids = self.location_ids
+        aggregate.default = self.default
+        query.aggregates[alias] = aggregate
+
+
+class StockQuantity(StockAggregate):
+    """
+    Quantity of the products in the given locations, `default` when they have no stock there
+    """
+    name = "StockQuantity"
+    sql_class = SQLStockQuantity
+
+
+class StockAverageCost(StockAggregate):
+    """
+    Average unit price of the products in the given locations, counting positive stocks only
+    """
+    name = "StockAverageCost"
+    sql_class = SQLStockAverageCost
+
+
+class StockAveragePriceDelta(StockAggregate):
+    """
+    Price of the products net of the store fees of `reference`, less their average cost
+    in the given locations
+    """
+    name = "StockAveragePriceDelta"
+    sql_class = SQLStockAveragePriceDelta
+
+    def __init__(self, location_ids, reference, **extra):
+        from .models import Product
+
+        super(StockAveragePriceDelta, self).__init__(
+            location_ids, product=Product._meta.db_table, lower_fixed_store_fee=reference.lower_fixed_store_fee,
+            store_fee=reference.store_fee / 100, **extra)
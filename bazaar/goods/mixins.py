@@ -4,6 +4,7 @@ from __future__ import unicode_literals
 from django.db import transaction
 
 from ..warehouse import api
+from ..warehouse.dispatch import coalesce_changed_signals
 
 
 class MovableMixin(object):
@@ -19,6 +20,7 @@ class MovableMixin(object):
 
 class MovableProductMixin(MovableMixin):
 
+    @coalesce_changed_signals()
     @transaction.atomic
     def move(self, from_location, to_location, quantity=1, price_multiplier=1, **kwargs):
         """
@@ -32,51 +34,22 @@ class MovableProductMixin(MovableMixin):
 
         api.move(from_location, to_location, self, quantity, price, agent=agent, note=note)
 
-        for ps in self.sets.all():
-            to_location_quantities = []
-            from_location_quantities = []
+        self.update_composite_stocks(from_location, to_location)
+        self.clear_stock_cache()
 
-            to_location_unit_cost = 0
-            from_location_unit_cost = 0
-
-            composite = ps.composite
-
-            for cps in composite.product_sets.all():
-                to_location_product_quantity = api.get_stock_quantity(cps.product, location_type=to_location.type)
-                to_location_product_price = api.get_stock_price(cps.product, location_type=to_location.type)
-                to_location_quantities.append(to_location_product_quantity // cps.quantity)
-                to_location_unit_cost += (to_location_product_price.amount * cps.quantity)
-
-                from_location_product_quantity = api.get_stock_quantity(cps.product, location_type=from_location.type)
-                from_location_product_price = api.get_stock_price(cps.product, location_type=from_location.type)
-                from_location_quantities.append(from_location_product_quantity // cps.quantity)
-                from_location_unit_cost += (from_location_product_price.amount * cps.quantity)
-            from ..warehouse.models import Stock
-
-            stock_outgoing, created = Stock.objects.get_or_create(product=composite, location=to_location)
-            stock_incoming, created = Stock.objects.get_or_create(product=composite, location=from_location)
-
-            stock_incoming.unit_price = from_location_unit_cost
-            stock_outgoing.unit_price = to_location_unit_cost
-            # Update from_location quantity and price
-
-            new_incoming_quantity = min(from_location_quantities)
-            stock_incoming.quantity = 0 if new_incoming_quantity < 0 else new_incoming_quantity
-            stock_incoming.save()
-
-            # Update to_location quantity and price
-
-            new_outgoing_quantity = min(to_location_quantities)
-            stock_outgoing.quantity = 0 if new_outgoing_quantity < 0 else new_outgoing_quantity
-            stock_outgoing.save()
+    def update_composite_stocks(self, from_location, to_location):
+        """
+        Updates the stocks in `from_location` and `to_location` of the composite products
+        containing this product, after it has been moved between them.
+        """
+        from ..warehouse.composites import update_composite_stocks
 
-            from bazaar.warehouse.stocks import _send_changed_location
-            _send_changed_location(stock_incoming)
-            _send_changed_location(stock_outgoing)
+        update_composite_stocks([self], [from_location, to_location])
 
 
 class MovableCompositeProductMixin(MovableMixin):
 
+    @coalesce_changed_signals()
     @transaction.atomic
     def move(self, from_location, to_location, quantity=1, price_multiplier=1, **kwargs):
         """
@@ -100,3 +73,4 @@ class MovableCompositeProductMixin(MovableMixin):
                 product_quantity = product_set.quantity * quantity
                 product.move(from_location, to_location, quantity=product_quantity,
                              price_multiplier=price_multiplier, **kwargs)
+            self.clear_stock_cache()
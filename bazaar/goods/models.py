@@ -12,7 +12,7 @@ from .mixins import MovableProductMixin, MovableCompositeProductMixin
 from .querysets import ProductsQuerySet
 from ..fields import MoneyField
 from ..settings import bazaar_settings
-from ..warehouse import api
+from ..warehouse.signals import storage_changed
 
 
 @python_2_unicode_compatible
@@ -43,15 +43,40 @@ class Product(MovableProductMixin, models.Model):
         Defines the cost of the good
         """
         from ..warehouse.api import get_storage_price
+        from ..warehouse.models import Location
 
+        summary = self.get_stock_summary(Location.LOCATION_STORAGE)
+        if summary is not None:
+            return summary.get_price(self, Location.LOCATION_STORAGE)
         return get_storage_price(self)
 
     @property
     def quantity(self):
         from ..warehouse.api import get_storage_quantity
+        from ..warehouse.models import Location
 
+        summary = self.get_stock_summary(Location.LOCATION_STORAGE)
+        if summary is not None:
+            return summary.get_quantity(self, Location.LOCATION_STORAGE)
         return get_storage_quantity(self)
 
+    def get_stock_summary(self, location_type):
+        """
+        Returns the stock summary attached by `ProductsQuerySet.with_stock_cache`, when it
+        covers `location_type`
+        """
+        summary = getattr(self, "_stock_summary", None)
+        if summary is not None and location_type in summary.location_types:
+            return summary
+        return None
+
+    def clear_stock_cache(self):
+        """
+        Forgets the stock summary attached by `ProductsQuerySet.with_stock_cache`, so that
+        `cost` and `quantity` query the stocks again
+        """
+        self._stock_summary = None
+
     def __str__(self):
         return self.name
 
@@ -72,40 +97,14 @@ class ProductSet(models.Model):
 
 @receiver(post_save, sender=ProductSet)
 def create_stock_and_set_price(sender, instance, *args, **kwargs):
-    composite = instance.composite
-
-    composite_price = 0
-    for cps in composite.product_sets.all():
-        composite_price += (cps.product.price.amount * cps.quantity)
-    composite.price = composite_price
-    composite.save()
-
-    from bazaar.warehouse.locations import get_storage
-    from bazaar.warehouse.models import Stock
-
-    location = get_storage()
-    stock, created = Stock.objects.get_or_create(product=composite, location=location)
-    if created:
-        product_quantity = api.get_storage_quantity(instance.product)
-        product_price = api.get_storage_price(instance.product)
-        composite_quantity = product_quantity // instance.quantity
-        composite_price = product_price * instance.quantity
-        stock.quantity = composite_quantity
-        stock.unit_price = composite_price
-        stock.save()
-    else:
-        quantities = []
-        unit_price = 0
-        for ps in composite.product_sets.all():
-            product_quantity = api.get_storage_quantity(ps.product)
-            product_price = api.get_storage_price(ps.product)
-            quantities.append(product_quantity // ps.quantity)
-            unit_price = unit_price + (product_price.amount * ps.quantity)
-        if stock.unit_price != unit_price:
-            stock.unit_price = unit_price
-        if min(quantities) != api.get_storage_quantity(composite):
-            stock.quantity = min(quantities)
-        stock.save()
+    from bazaar.warehouse.composites import schedule_composite_refresh
+
+    schedule_composite_refresh(instance.composite_id)
+
+
+@receiver(storage_changed)
+def clear_stock_cache_on_storage_change(sender, product, **kwargs):
+    product.clear_stock_cache()
 
 
 class ProductMarketPrice(models.Model):
@@ -2,16 +2,63 @@ from __future__ import unicode_literals
 
 from django.db import models
 import collections
+from datetime import timedelta
 
 from django.utils.datastructures import SortedDict
 
 from django.utils import timezone
 from model_utils.managers import InheritanceQuerySetMixin
 
+from ..warehouse.api.stock import WEIGHTED_PRICE_SQL
+from .aggregates import StockQuantity, StockAverageCost, StockAveragePriceDelta
+
 FORCED_LOWER = -999999
 
 
-class ProductsQuerySet(InheritanceQuerySetMixin, models.QuerySet):
+class StockCacheQuerySetMixin(object):
+    """
+    Queryset mixin caching the stocks of the fetched products, `get_cached_product`
+    returns the product of a fetched object
+    """
+    _stock_cache_types = None
+
+    def with_stock_cache(self, location_types=None):
+        """
+        Attaches to the fetched products the stock summary of all of them in `location_types`
+        (the storage by default), read by `Product.cost` and `Product.quantity` instead of
+        querying the stocks of every product
+        """
+        from ..warehouse.models import Location
+
+        if location_types is None:
+            location_types = [Location.LOCATION_STORAGE]
+        elif not isinstance(location_types, collections.Sequence):
+            location_types = [location_types]
+        return self._clone(_stock_cache_types=list(location_types))
+
+    def get_cached_product(self, obj):
+        return obj
+
+    def _clone(self, klass=None, setup=False, **kwargs):
+        kwargs.setdefault("_stock_cache_types", self._stock_cache_types)
+        return super(StockCacheQuerySetMixin, self)._clone(klass, setup, **kwargs)
+
+    def _fetch_all(self):
+        fetched = self._result_cache is None
+        super(StockCacheQuerySetMixin, self)._fetch_all()
+
+        if fetched and self._stock_cache_types is not None:
+            from ..warehouse.api import cache_stock_summary
+
+            # values querysets are not cached
+            products = [self.get_cached_product(obj) for obj in self._result_cache
+                        if isinstance(obj, models.Model)]
+            products = [product for product in products if product is not None]
+            if products:
+                cache_stock_summary(products, self._stock_cache_types)
+
+
+class ProductsQuerySet(StockCacheQuerySetMixin, InheritanceQuerySetMixin, models.QuerySet):
     def with_availability(self, location_id):
         return self.extra(
             select=SortedDict([
@@ -43,6 +90,28 @@ class ProductsQuerySet(InheritanceQuerySetMixin, models.QuerySet):
             select_params=location_ids
         )
 
+    def with_stock_price(self, location_types):
+        """
+        Annotates `stock_price`, the average unit price of the products in the given
+        location types computed like `bazaar.warehouse.api.get_stock_price` does.
+        """
+        if not isinstance(location_types, collections.Sequence):
+            location_types = [location_types]
+        dynamic_quantity = ', '.join(['%s'] * len(location_types))
+
+        return self.extra(
+            select=SortedDict([
+                ("stock_price",
+                 "SELECT COALESCE({}, 0) "
+                 "FROM warehouse_stock "
+                 "INNER JOIN warehouse_location ON warehouse_stock.location_id = warehouse_location.id "
+                 "WHERE warehouse_stock.product_id = goods_product.id "
+                 "AND warehouse_location.type IN ({})".format(WEIGHTED_PRICE_SQL.format(table="warehouse_stock"),
+                                                              dynamic_quantity)),
+            ]),
+            select_params=location_types
+        )
+
     def with_stock_quantity(self, location_storage_id, location_output_id):
         return self.extra(
             select=SortedDict([
@@ -70,7 +139,10 @@ class ProductsQuerySet(InheritanceQuerySetMixin, models.QuerySet):
             )
         )
 
-    def with_last_sold(self, location_customer_id, time_ago, present=timezone.now()):
+    def with_last_sold(self, location_customer_id, time_ago, present=None):
+        if present is None:
+            present = timezone.now()
+
         return self.extra(
             select=SortedDict([
                 ("last_sold",
@@ -85,6 +157,28 @@ class ProductsQuerySet(InheritanceQuerySetMixin, models.QuerySet):
             )
         )
 
+    def with_sales_velocity(self, days=30, present=None):
+        """
+        Annotates `sales_velocity`, the average quantity sold per day in the `days` days
+        until `present` (today by default), read from the daily sales.
+        """
+        from ..warehouse.sales import get_sales_day
+
+        last_day = get_sales_day(present or timezone.now())
+
+        return self.extra(
+            select=SortedDict([
+                ("sales_velocity",
+                 "SELECT COALESCE(1.0 * SUM(warehouse_dailysales.quantity), 0) / %s "
+                 "FROM warehouse_dailysales WHERE "
+                 "warehouse_dailysales.product_id = goods_product.id "
+                 "AND warehouse_dailysales.date > %s AND warehouse_dailysales.date <= %s"),
+            ]),
+            select_params=(
+                days, last_day - timedelta(days=days), last_day
+            )
+        )
+
     def with_net_price_and_avr_price_delta(self, reference, location_ids):
         if not isinstance(location_ids, collections.Sequence):
             location_ids = [location_ids]
@@ -126,6 +220,31 @@ class ProductsQuerySet(InheritanceQuerySetMixin, models.QuerySet):
             select_params=(location_ids)
         )
 
+    def with_stock_metrics(self, availability=None, stock_quantity=None, sold=None, total_avr_cost=None,
+                           avr_price_delta=None, reference=None):
+        """
+        Annotates the requested stock metrics, each computed over the stocks of the given
+        location ids (a single id or a list of them). Unlike `with_availability`,
+        `with_stock_quantity`, `with_sold`, `with_total_avr_cost` and `with_avr_price_delta`
+        the stock table is joined once for all of them, and the annotations can be used
+        in `filter` and `order_by`. `avr_price_delta` needs the `reference` store fees.
+        """
+        metrics = {}
+        if availability is not None:
+            metrics["availability"] = StockQuantity(availability, default=FORCED_LOWER)
+        if stock_quantity is not None:
+            metrics["stock_quantity"] = StockQuantity(stock_quantity, default=FORCED_LOWER)
+        if sold is not None:
+            metrics["sold"] = StockQuantity(sold, default=FORCED_LOWER)
+        if total_avr_cost is not None:
+            metrics["total_avr_cost"] = StockAverageCost(total_avr_cost)
+        if avr_price_delta is not None:
+            if reference is None:
+                raise ValueError("avr_price_delta requires a reference")
+            metrics["avr_price_delta"] = StockAveragePriceDelta(avr_price_delta, reference)
+
+        return self.annotate(**metrics) if metrics else self
+
     def with_net_price(self, reference):
         return self.extra(
             select={
@@ -2,6 +2,7 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 from django.core.urlresolvers import reverse_lazy
+from django.db import transaction
 from django.http.response import HttpResponseForbidden
 from django.shortcuts import render_to_response, get_object_or_404, redirect
 from django.template import RequestContext
@@ -12,7 +13,9 @@ from django.utils.translation import ugettext as _
 
 from braces.views import LoginRequiredMixin
 from bazaar.listings.models import Publishing
-from bazaar.warehouse.locations import get_storage
+from bazaar.warehouse.api import cache_stock_summary
+from bazaar.warehouse.models import Location
+from bazaar.warehouse.composites import defer_composite_refresh
 from .filters import ProductFilter, ProductBrandFormFilter
 from .forms import ProductForm, ProductSetFormSet, CompositeProductForm, ProductBrandForm
 from .models import Product, ProductSet, CompositeProduct, ProductBrand, ProductMarketPrice
@@ -27,24 +30,12 @@ class ProductListView(LoginRequiredMixin, BazaarPrefixMixin, FilterSortableListV
 
     def get_queryset(self):
         qs = super(ProductListView, self).get_queryset()
-        location_storage = get_storage()
-        qs = qs.extra(
+        # stock columns come from the storage summary, so that sorting them needs no aggregation
+        qs = qs.select_related("storage_summary").extra(
             select=SortedDict([
-                ("stock",
-                 "SELECT SUM(quantity) "
-                 "FROM warehouse_stock "
-                 "WHERE warehouse_stock.product_id = goods_product.id "
-                 "AND warehouse_stock.location_id = %s"),
-                ("purchase_price",
-                 "SELECT SUM(unit_price) "
-                 "FROM warehouse_stock "
-                 "WHERE warehouse_stock.product_id = goods_product.id "
-                 "AND warehouse_stock.location_id = %s"),
-            ]),
-            select_params=(
-                location_storage.id,
-                location_storage.id,
-            )
+                ("stock", "warehouse_storagesummary.quantity"),
+                ("purchase_price", "warehouse_storagesummary.unit_price"),
+            ])
         )
         return qs
 
@@ -57,12 +48,18 @@ class ProductDetailView(LoginRequiredMixin, BazaarPrefixMixin, generic.DetailVie
         context = super(ProductDetailView, self).get_context_data(**kwargs)
 
         # Check if this product was ever published
-        product = self.get_object()
+        product = self.object
         ps = ProductSet.objects.filter(product=product)
         has_publishings = Publishing.objects.filter(listing__product=product).exists() or \
-            Publishing.objects.filter(listing__product__in=[pset.composite for pset in ps]).exists()
+            Publishing.objects.filter(listing__product__in=ps.values("composite")).exists()
         context['deletable'] = not has_publishings
 
+        # stocks of the product and of all its components are read at once
+        product_sets = list(ProductSet.objects.filter(composite=product).select_related("product"))
+        cache_stock_summary([product] + [product_set.product for product_set in product_sets],
+                            [Location.LOCATION_STORAGE])
+        context['product_sets'] = product_sets
+
         return context
 
 
@@ -127,6 +124,8 @@ class ProductUpdateView(LoginRequiredMixin, BazaarPrefixMixin, generic.UpdateVie
 #         return reverse_lazy("bazaar:product-detail", kwargs={'pk': self.object.id})
 
 
+@defer_composite_refresh()
+@transaction.atomic
 def CompositeCreateView(request):
     if request.method == 'POST':
         form = CompositeProductForm(request.POST)
@@ -167,6 +166,8 @@ def CompositeCreateView(request):
 #         return reverse_lazy("bazaar:product-detail", kwargs={'pk': self.object.id})
 
 
+@defer_composite_refresh()
+@transaction.atomic
 def CompositeUpdateView(request, pk):
     the_object = get_object_or_404(CompositeProduct, pk=pk)
     products = ProductSet.objects.filter(composite=the_object)
@@ -32,8 +32,10 @@ class OrderGrabber(object):
         self.get_processor().run(order)
 
     def run(self, *args, **kwargs):
-        for order in self.grab_orders(*args, **kwargs):
-            self.process(order)
+        orders = list(self.grab_orders(*args, **kwargs))
+        with self.get_processor().batch(orders):
+            for order in orders:
+                self.process(order)
 
         self._notify_errors()
 
@@ -0,0 +1,53 @@
+from __future__ import division
+from __future__ import unicode_literals
+
+import logging
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from ....warehouse.outbox import MAX_ATTEMPTS, RETRY_DELAY, drain
+from ...stores import stores_loader
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Pass the stock changes saved in the outbox to the store strategies"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--batch-size", action="store", type="int", dest="batch_size", default=500,
+                    help="Number of events consumed in a single transaction"),
+        make_option("--interval", action="store", type="float", dest="interval", default=None,
+                    help="Keep draining the outbox every INTERVAL seconds"),
+        make_option("--max-attempts", action="store", type="int", dest="max_attempts", default=MAX_ATTEMPTS,
+                    help="Number of times events are passed to a failing store before dropping them"),
+        make_option("--retry-delay", action="store", type="float", dest="retry_delay", default=RETRY_DELAY,
+                    help="Seconds before passing failed events again, doubled at every attempt"),
+    )
+
+    def handle(self, *args, **options):
+        consumers = list(stores_loader.get_all_store_managers())
+
+        while True:
+            start = time.time()
+            try:
+                count = drain(consumers, batch_size=options["batch_size"], max_attempts=options["max_attempts"],
+                              retry_delay=options["retry_delay"])
+            except Exception:
+                if options["interval"] is None:
+                    raise
+                # e.g. the database is not reachable, the worker keeps polling
+                logger.exception("Draining stock events failed")
+                count = 0
+
+            if count or options["interval"] is None:
+                elapsed = time.time() - start
+                self.stdout.write("%d stock events drained (%d events/s)" % (count, count / (elapsed or 1)))
+
+            if options["interval"] is None:
+                break
+
+            time.sleep(options["interval"])
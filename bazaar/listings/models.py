@@ -10,7 +10,7 @@ from django.utils.translation import ugettext_lazy as _
 from model_utils.managers import InheritanceManager
 
 from bazaar.listings.managers import PublishingsManager
-from bazaar.listings.querysets import PublishingsQuerySet
+from bazaar.listings.querysets import ListingsQuerySet, PublishingsQuerySet
 from bazaar.warehouse import api
 
 from ..fields import MoneyField, SKUField, create_sku
@@ -33,7 +33,7 @@ class Listing(models.Model):
     product = models.ForeignKey(Product, related_name="listings", null=True)
     sku = SKUField(default=create_sku)
 
-    objects = ListingManager()
+    objects = ListingManager.from_queryset(ListingsQuerySet)()
 
     class Meta:
         ordering = ["product__name"]
@@ -69,8 +69,16 @@ class Listing(models.Model):
     @property
     def available_units(self):
         """
-        Returns available units of the whole listing in the storage
+        Returns available units of the whole listing in the storage, not held by reservations
         """
+        from ..warehouse.models import Location
+
+        if self.product is not None:
+            # stocks could be cached by `prefetch_stock`
+            summary = self.product.get_stock_summary(Location.LOCATION_STORAGE)
+            if summary is None:
+                summary = api.get_stock_summary([self.product], Location.LOCATION_STORAGE)
+            return summary.get_available(self.product, Location.LOCATION_STORAGE)
         return api.get_storage_quantity(self.product)
 
     @property
@@ -78,6 +86,8 @@ class Listing(models.Model):
         """
         Returns global cost for the listing
         """
+        if self.product is not None:
+            return self.product.cost
         return api.get_storage_price(self.product)
 
     def is_unavailable(self):
@@ -85,7 +95,7 @@ class Listing(models.Model):
         Returns True when products stock cannot satisfy published listings
         """
         try:
-            product_quantity = api.get_storage_quantity(self.product)
+            product_quantity = self.available_units
         except models.ObjectDoesNotExist:
             product_quantity = 0
         for publishing in self.publishings.all():
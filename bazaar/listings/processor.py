@@ -1,8 +1,13 @@
 from __future__ import unicode_literals
 
+from contextlib import contextmanager
+
 from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
 from bazaar.goods.models import Product
 
+from ..utils import resolve_subclasses
+from ..warehouse.exceptions import ReservedStockException
 from .models import Order, Publishing, Listing
 
 
@@ -15,6 +20,8 @@ class OrderProcessor(object):
 
     def __init__(self):
         self._messages = []
+        # subclass instances of the products of the orders processed in a batch, by product id
+        self._product_subclasses = None
 
     def get_order_model(self):
         if self.order_model is None:
@@ -41,7 +48,64 @@ class OrderProcessor(object):
         return self.publishing_lookup_id
 
     def _get_product_subclass(self, product, id):
-        return product.__class__.objects.get_subclass(id=id)
+        if self._product_subclasses is None:
+            return resolve_subclasses([product])[0]
+
+        # products sold by many orders of the batch are resolved once
+        if id not in self._product_subclasses:
+            self.resolve_products([product])
+        return self._product_subclasses[id]
+
+    def resolve_products(self, products):
+        """
+        Resolves the subclasses of many products at once, caching them until the end of
+        the running batch
+        """
+        if self._product_subclasses is None:
+            return
+
+        products = [product for product in products if product.pk not in self._product_subclasses]
+        for product, subclass in zip(products, resolve_subclasses(products)):
+            self._product_subclasses[product.pk] = subclass
+
+    def get_products(self, incoming_orders):
+        """
+        Returns the products sold by the orders and publishings of `incoming_orders`
+        """
+        order_ids = set(getattr(incoming, self.get_order_lookup_id()) for incoming in incoming_orders)
+        publishing_ids = set(getattr(incoming, self.get_publishing_lookup_id()) for incoming in incoming_orders)
+
+        orders = self.get_order_model().objects.filter(external_id__in=order_ids) \
+            .select_related("publishing__listing__product")
+        publishings = [order.publishing for order in orders if order.publishing is not None]
+        publishings.extend(self.get_publishing_model().objects.filter(external_id__in=publishing_ids)
+                           .select_related("listing__product"))
+
+        return [publishing.listing.product for publishing in publishings
+                if publishing.listing is not None and publishing.listing.product is not None]
+
+    @contextmanager
+    def batch(self, incoming_orders):
+        """
+        Returns a context manager resolving at once the products sold by `incoming_orders`,
+        to be processed inside it. Resolved products are forgotten when the block exits,
+        so that a processor running many times never uses stale ones.
+        """
+        self._product_subclasses = {}
+        try:
+            self.resolve_products(self.get_products(incoming_orders))
+            yield
+        finally:
+            self._product_subclasses = None
+
+    def run_many(self, incoming_orders):
+        """
+        Runs the processor on every incoming order, resolving their products at once
+        """
+        incoming_orders = list(incoming_orders)
+        with self.batch(incoming_orders):
+            for incoming in incoming_orders:
+                self.run(incoming)
 
     def get_order(self, incoming):
         external_id = getattr(incoming, self.get_order_lookup_id())
@@ -117,7 +181,12 @@ class OrderProcessor(object):
         # get the related publishing
         publishing = self.get_publishing(incoming)
 
-        self.action(publishing, incoming, order)
+        try:
+            with transaction.atomic():
+                self.action(publishing, incoming, order)
+        except ReservedStockException as e:
+            # the order cannot take units held by reservations, the other orders go on
+            self._add_message("Order %s not processed: %s" % (incoming, e))
 
     def action(self, listing_item, incoming, order):
         """
@@ -3,6 +3,43 @@ from __future__ import unicode_literals
 from django.db import models
 from model_utils.managers import InheritanceQuerySetMixin
 
+from ..goods.querysets import StockCacheQuerySetMixin
+
 
 class PublishingsQuerySet(InheritanceQuerySetMixin, models.QuerySet):
     pass
+
+
+class ListingsQuerySet(StockCacheQuerySetMixin, models.QuerySet):
+    _resolve_product_subclasses = False
+
+    def prefetch_stock(self, location_types=None):
+        """
+        Fetches the products of the listings and caches their stocks with a single query,
+        so that `Listing.available_units` and `Listing.cost` do not query
+        """
+        return self.select_related("product").with_stock_cache(location_types)
+
+    def get_cached_product(self, obj):
+        return obj.product
+
+    def resolve_product_subclasses(self):
+        """
+        Fetches the products of the listings and resolves their subclasses in bulk, so that
+        `get_url` does not query for every listing
+        """
+        return self.select_related("product")._clone(_resolve_product_subclasses=True)
+
+    def _clone(self, klass=None, setup=False, **kwargs):
+        kwargs.setdefault("_resolve_product_subclasses", self._resolve_product_subclasses)
+        return super(ListingsQuerySet, self)._clone(klass, setup, **kwargs)
+
+    def _fetch_all(self):
+        fetched = self._result_cache is None
+        super(ListingsQuerySet, self)._fetch_all()
+
+        if fetched and self._resolve_product_subclasses:
+            from ..utils import resolve_subclasses
+
+            resolve_subclasses(listing.product for listing in self._result_cache
+                               if isinstance(listing, models.Model))
@@ -1,8 +1,49 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
 from ..compat import post_migrate
+from ..warehouse.availability import invalidate_availability
+from ..warehouse.models import Stock
+from ..warehouse.signals import storage_changed
+from .models import Listing, Order
 from .stores.config import create_stores
 
 
 post_migrate.connect(create_stores)
+
+
+def _invalidate_publishing_availability(publishing_ids):
+    products = Listing.objects.filter(publishings__in=publishing_ids).values_list("product", flat=True)
+    invalidate_availability(set(product for product in products if product is not None))
+
+
+@receiver(post_init, sender=Order)
+def remember_order_publishing(sender, instance, **kwargs):
+    # deferred publishings are not loaded just to remember them
+    instance._loaded_publishing_id = instance.__dict__.get("publishing_id")
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def invalidate_availability_on_order_change(sender, instance, **kwargs):
+    # the products of the publishing the order is moved from are available again
+    publishing_ids = set([instance.publishing_id, getattr(instance, "_loaded_publishing_id", None)])
+    publishing_ids.discard(None)
+    if publishing_ids:
+        _invalidate_publishing_availability(publishing_ids)
+    instance._loaded_publishing_id = instance.publishing_id
+
+
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+def invalidate_availability_on_stock_change(sender, instance, **kwargs):
+    invalidate_availability([instance.product_id])
+
+
+@receiver(storage_changed)
+def invalidate_availability_on_storage_change(sender, product, **kwargs):
+    # stocks computed by view backends are never saved
+    invalidate_availability([product])
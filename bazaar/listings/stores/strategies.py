@@ -3,10 +3,11 @@ from ..models import Publishing
 
 from django_filters import FilterSet
 
+from ...warehouse.outbox import StockEventConsumer
 from ..forms import PublishingForm
 
 
-class DefaultStoreStrategy(object):
+class DefaultStoreStrategy(StockEventConsumer):
     """
     Mandatory overrides: get_store_name, get_publishing_template
     """
@@ -59,3 +60,13 @@ class DefaultStoreStrategy(object):
 
     def get_publishing_discounted_price(self, price):
         return price
+
+    def get_consumer_name(self):
+        return self.get_store_name()
+
+    def consume_stock_events(self, events):
+        """
+        Called by the `drain_stock_events` command with the stock changes, override it
+        to push availabilities to the store
+        """
+        pass
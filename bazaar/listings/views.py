@@ -39,7 +39,8 @@ class ListingListView(LoginRequiredMixin, BazaarPrefixMixin, FilterMixin, generi
         prefetch_list = ["publishings__store"]
         for manager in stores_loader.get_all_store_managers():
             prefetch_list.extend(manager.get_store_extra("prefetch_list"))
-        return qs.prefetch_related(*prefetch_list)
+        # availability, cost and product url of every listing are resolved in bulk
+        return qs.prefetch_related(*prefetch_list).prefetch_stock().resolve_product_subclasses()
 
     def get_context_data(self, **kwargs):
         context = super(ListingListView, self).get_context_data(**kwargs)
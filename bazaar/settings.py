@@ -45,7 +45,12 @@ DEFAULTS = {
     'OUTPUT_NAME': 'bazaar output',
     'SUPPLIER_NAME': 'bazaar supplier',
     'CUSTOMER_NAME': 'bazaar customer',
-    'LOST_AND_FOUND_NAME': 'bazaar lost and found'
+    'LOST_AND_FOUND_NAME': 'bazaar lost and found',
+    'MOVEMENT_ARCHIVE_DAYS': 365,
+    'STOCK_OUTBOX': False,
+    'STOCK_BACKEND': 'bazaar.warehouse.backends.TableStockBackend',
+    'RESERVATION_TIMEOUT': 15 * 60,
+    'EXCHANGE_RATES_TIMEOUT': 60 * 60,
 }
 
 
@@ -58,6 +63,7 @@ MANDATORY = (
 # List of settings that may be in string import notation.
 IMPORT_STRINGS = (
     'DEFAULT_AVAILABILITY_BACKEND',
+    'STOCK_BACKEND',
     'LISTING_FILTER',
 )
 
@@ -2,6 +2,8 @@ from __future__ import unicode_literals
 
 from django import template
 
+from ..utils import get_subclass
+
 register = template.Library()
 
 
@@ -62,7 +64,8 @@ def get_url(obj, path, endpoint='detail'):
     for path in tokenized_paths:
         if hasattr(obj, path):
             obj = getattr(obj, path)
-    url_product_path = obj.__class__.objects.get_subclass(id=obj.id).__class__.__name__.lower()
+    # subclasses resolved in bulk (see `bazaar.utils.resolve_subclasses`) are not queried again
+    url_product_path = get_subclass(obj).__class__.__name__.lower()
     if url_product_path == 'compositeproduct':
         url_product_path = 'product'
     path = "{}-{}".format(url_product_path, endpoint)
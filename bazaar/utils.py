@@ -1,18 +1,32 @@
 from __future__ import unicode_literals
 
+import threading
+import time
+from decimal import Decimal
+
 from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.template.loader import render_to_string
 from django.utils import six
 
-from djmoney_rates.utils import convert_money
+from djmoney_rates.exceptions import CurrencyConversionException
+from djmoney_rates.models import Rate, RateSource
+from djmoney_rates.utils import get_rate_source
 
 from moneyed import Money, get_currency
 
 import stored_messages
 
+from .compat import post_migrate
 from .settings import bazaar_settings
 
 
+# Process local table of the exchange rates of the default rate source, see `get_rates`
+_rates = {}
+_rates_lock = threading.Lock()
+
+
 def get_default_currency():
     return get_currency(bazaar_settings.DEFAULT_CURRENCY)
 
@@ -24,15 +38,83 @@ def has_default_currency(money):
         return True
 
 
+def get_rates():
+    """
+    Returns (base currency code, dict of rates by currency code) of the default rate source.
+    Rates are read with two queries and kept for EXCHANGE_RATES_TIMEOUT seconds, or until they change.
+    """
+    with _rates_lock:
+        if _rates.get("expires", 0) > time.time():
+            return _rates["base_currency"], _rates["rates"]
+
+    source = get_rate_source()
+    rates = dict(Rate.objects.filter(source=source).values_list("currency", "value"))
+
+    with _rates_lock:
+        _rates.update(base_currency=source.base_currency, rates=rates,
+                      expires=time.time() + bazaar_settings.EXCHANGE_RATES_TIMEOUT)
+    return source.base_currency, rates
+
+
+def clear_rates():
+    """
+    Empties the rates table, rates will be read again on next conversion
+    """
+    with _rates_lock:
+        _rates.clear()
+
+
+def _get_rate(rates, currency):
+    try:
+        return rates[currency]
+    except KeyError:
+        raise CurrencyConversionException(
+            "Rate for %s does not exist. Please run python manage.py update_rates" % currency)
+
+
+def convert(amount, currency_from, currency_to):
+    """
+    Converts `amount` from `currency_from` to `currency_to` with the rates table,
+    rounding like `djmoney_rates.utils.convert_money`. Returns a Money instance.
+    """
+    return _convert(amount, currency_from, currency_to, get_rates())
+
+
+def _convert(amount, currency_from, currency_to, rates):
+    base_currency, rates = rates
+
+    rate_from = _get_rate(rates, currency_from) if currency_from != base_currency else Decimal(1)
+    rate_to = _get_rate(rates, currency_to)
+
+    if isinstance(amount, float):
+        amount = Decimal(amount).quantize(Decimal(".000001"))
+
+    return Money(((amount / rate_from) * rate_to).quantize(Decimal("1.00")), currency_to)
+
+
 def money_to_default(value):
     """
     Convert 'value' to the system default currency. Returns a Money instance
     """
-    if not has_default_currency(value):
-        default_currency = get_default_currency()
-        value = convert_money(value.amount, value.currency.code, default_currency.code)
+    return convert_many([value])[0]
+
+
+def convert_many(values):
+    """
+    Bulk version of `money_to_default`, returns the list of the converted `values`.
+    Rates are read at most once for all the values.
+    """
+    default_currency = get_default_currency()
+    rates = None
 
-    return to_money(value)
+    converted = []
+    for value in values:
+        if not has_default_currency(value):
+            if rates is None:
+                rates = get_rates()
+            value = _convert(value.amount, value.currency.code, default_currency.code, rates)
+        converted.append(to_money(value))
+    return converted
 
 
 def to_money(value):
@@ -58,3 +140,48 @@ def send_to_staff(messages, level=None, tags=''):
     for message in messages:
         rendered = render_to_string("bazaar/message.html", {"message": message})
         stored_messages.add_message_for(users, level, rendered, tags)
+
+
+def resolve_subclasses(objects):
+    """
+    Resolves the most specific subclass of every given model instance, whose manager must
+    support `select_subclasses` (django-model-utils). Instances of the same model are resolved
+    by a single query, and every instance keeps its subclass instance in `_subclass`.
+    Returns the list of the subclass instances.
+    """
+    objects = [obj for obj in objects if obj is not None]
+
+    pending = {}
+    for obj in objects:
+        if not hasattr(obj, "_subclass"):
+            pending.setdefault(obj.__class__, {}).setdefault(obj.pk, []).append(obj)
+
+    for model, instances in pending.items():
+        subclasses = model.objects.select_subclasses().in_bulk(list(instances))
+        for pk, same_objects in instances.items():
+            for obj in same_objects:
+                # deleted objects are their own subclass
+                obj._subclass = subclasses.get(pk, obj)
+
+    return [obj._subclass for obj in objects]
+
+
+def get_subclass(obj):
+    """
+    Returns the instance of the most specific subclass of `obj`, see `resolve_subclasses`
+    """
+    return resolve_subclasses([obj])[0]
+
+
+@receiver(post_save, sender=Rate)
+@receiver(post_delete, sender=Rate)
+@receiver(post_save, sender=RateSource)
+@receiver(post_delete, sender=RateSource)
+def clear_rates_on_change(sender, **kwargs):
+    clear_rates()
+
+
+@receiver(post_migrate)
+def clear_rates_on_migrate(sender, **kwargs):
+    # the flush command sends post_migrate as well, rates are gone
+    clear_rates()
@@ -2,7 +2,7 @@ from __future__ import unicode_literals
 
 from django.contrib import admin
 
-from .models import Location, Movement
+from .models import Location, Movement, Reservation
 
 
 class LocationAdmin(admin.ModelAdmin):
@@ -20,6 +20,21 @@ class MovementAdmin(admin.ModelAdmin):
     raw_id_fields = ('product',)
     search_fields = ['product__name']
 
+    date_hierarchy = 'date'
+    ordering = ('-date',)
+
+
+class ReservationAdmin(admin.ModelAdmin):
+    list_display = ('product', 'location', 'quantity', 'status', 'reference', 'date', 'expires')
+    list_filter = ('status', 'location')
+
+    raw_id_fields = ('product',)
+    search_fields = ['product__name', 'reference']
+
+    # reserved quantities are only changed by the reservations api
+    readonly_fields = ('product', 'location', 'quantity', 'status')
+
 
 admin.site.register(Location, LocationAdmin)
 admin.site.register(Movement, MovementAdmin)
+admin.site.register(Reservation, ReservationAdmin)
@@ -1,17 +1,27 @@
 from __future__ import unicode_literals
 
-from ...utils import money_to_default, has_default_currency
-from ..exceptions import MovementException
+from django.db import transaction
+
+from ...utils import convert_many, money_to_default, has_default_currency, to_money
+from ..dispatch import coalesce_changed_signals
+from ..exceptions import MovementException, ReservedStockException
 from ..signals import incoming_movement, outgoing_movement
 
 
-__all__ = ["move"]
+__all__ = ["move", "move_many"]
+
+# maximum number of ids used in a single `IN` lookup
+LOOKUP_CHUNK_SIZE = 500
 
 
+@coalesce_changed_signals()
+@transaction.atomic
 def move(from_location, to_location, product, quantity, unit_price, agent=None, note=None):
     """Move a product from `from_location` to `to_location`"""
 
-    from ..models import Movement
+    from ..models import Location, Movement
+    from ..sales import add_sales, get_sales_day, get_sold_quantity
+    from ..stocks import lock_stocks
 
     agent = agent or ""
     note = note or ""
@@ -36,5 +46,146 @@ def move(from_location, to_location, product, quantity, unit_price, agent=None,
     except Exception as de:
         raise MovementException(de)
 
+    # the stocks stay locked until the movement transaction ends
+    for stock in lock_stocks(product, (from_location, to_location)):
+        if stock.location_id == from_location.pk:
+            _check_reserved(stock, stock.quantity - quantity)
+
+    customer_ids = set(location.pk for location in (from_location, to_location)
+                       if location.type == Location.LOCATION_CUSTOMER)
+    sold = get_sold_quantity(from_location.pk, to_location.pk, quantity, customer_ids)
+    if sold:
+        add_sales({(product.pk, get_sales_day(movement.date)): sold})
+
     incoming_movement.send(sender=to_location, movement=movement)
     outgoing_movement.send(sender=from_location, movement=movement)
+
+
+@coalesce_changed_signals()
+@transaction.atomic
+def move_many(movements):
+    """
+    Bulk version of `move`. `movements` is an iterable of unsaved `Movement` instances.
+
+    Movements are inserted with a single `bulk_create` and their stock deltas are folded
+    in memory for every (product, location) pair, so that each touched stock is written
+    only once. The resulting stocks are the same obtained calling `move` for every
+    movement in the given order. Stock backends computing stocks from the movements
+    only get the movements inserted. Daily sales are updated as `move` does.
+
+    `incoming_movement` and `outgoing_movement` signals are not sent, while the
+    location changed signals are sent once for every touched stock.
+    """
+    from ..backends import get_stock_backend
+    from ..models import Movement, Stock
+    from ..sales import record_sales
+    from ..stocks import _send_changed_location
+
+    movements = list(movements)
+
+    for movement in movements:
+        if movement.quantity < 1:
+            raise MovementException("Quantity must be a positive amount")
+
+        movement.agent = movement.agent or ""
+        movement.note = movement.note or ""
+
+    # convert prices to default currency (whether different)
+    # and save the originals in original_unit_price
+    foreign = [m for m in movements if not has_default_currency(m.unit_price)]
+    for movement, unit_price in zip(foreign, convert_many(m.unit_price for m in foreign)):
+        movement.original_unit_price = movement.unit_price
+        movement.unit_price = unit_price
+
+    if not movements:
+        return []
+
+    try:
+        Movement.objects.bulk_create(movements)
+    except Exception as de:
+        raise MovementException(de)
+
+    product_ids = set(m.product_id for m in movements)
+    location_ids = set(m.from_location_id for m in movements) | set(m.to_location_id for m in movements)
+
+    if get_stock_backend().stores_stocks:
+        _update_stocks(movements, product_ids, location_ids)
+
+    record_sales(movements)
+
+    touched = set((m.product_id, m.to_location_id) for m in movements)
+    touched.update((m.product_id, m.from_location_id) for m in movements)
+
+    for chunk in _chunks(sorted(product_ids), LOOKUP_CHUNK_SIZE):
+        qs = Stock.objects.filter(product_id__in=chunk, location_id__in=location_ids)
+        for stock in qs.select_related("product", "location"):
+            if (stock.product_id, stock.location_id) in touched:
+                _send_changed_location(stock)
+
+    return movements
+
+
+def _update_stocks(movements, product_ids, location_ids):
+    """
+    Writes the stocks changed by `movements`, folding them in memory
+    """
+    from ..composites import update_stocks
+    from ..models import Stock
+    from ..stocks import compute_incoming, compute_outgoing
+
+    stocks = {}
+    for chunk in _chunks(sorted(product_ids), LOOKUP_CHUNK_SIZE):
+        qs = Stock.objects.select_for_update().filter(product_id__in=chunk, location_id__in=location_ids)
+        for stock in qs.order_by("product", "location"):
+            stocks[(stock.product_id, stock.location_id)] = stock
+
+    # fold movements into (quantity, unit price) amounts for every touched stock
+    state = {}
+
+    def get_state(key):
+        if key not in state:
+            stock = stocks.get(key)
+            state[key] = (stock.quantity, stock.unit_price.amount) if stock else (0, 0)
+        return state[key]
+
+    for movement in movements:
+        incoming_key = (movement.product_id, movement.to_location_id)
+        quantity, unit_price = get_state(incoming_key)
+        state[incoming_key] = compute_incoming(
+            quantity, unit_price, movement.quantity, movement.unit_price.amount)
+
+        outgoing_key = (movement.product_id, movement.from_location_id)
+        quantity, unit_price = get_state(outgoing_key)
+        state[outgoing_key] = (compute_outgoing(quantity, movement.quantity), unit_price)
+        if outgoing_key in stocks:
+            _check_reserved(stocks[outgoing_key], state[outgoing_key][0])
+
+    new_stocks, changed_stocks = [], []
+    for key, (quantity, unit_price) in state.items():
+        # prices are saved as money instances exactly like `Stock.save` does
+        unit_price = to_money(unit_price)
+        stock = stocks.get(key)
+        if stock is None:
+            new_stocks.append(Stock(product_id=key[0], location_id=key[1], quantity=quantity,
+                                    unit_price=unit_price))
+        elif stock.quantity != quantity or stock.unit_price != unit_price:
+            stock.quantity, stock.unit_price = quantity, unit_price
+            changed_stocks.append(stock)
+
+    update_stocks(Stock, changed_stocks)
+    Stock.objects.bulk_create(new_stocks)
+
+
+def _check_reserved(stock, quantity):
+    """
+    Raises `ReservedStockException` when `stock` would be left with `quantity`, not enough
+    for its pending reservations. Stocks without reservations can go below zero.
+    """
+    if stock.reserved and quantity < stock.reserved:
+        raise ReservedStockException("Only %s units of %s in %s are not reserved" % (
+            stock.quantity - stock.reserved, stock.product_id, stock.location_id))
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
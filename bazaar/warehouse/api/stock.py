@@ -2,8 +2,10 @@ from __future__ import unicode_literals
 from __future__ import division
 
 import collections
+from decimal import Decimal
 
-from django.db.models import Sum
+from django.db import connection
+from django.db.models import Max, Sum
 
 from ...utils import money_to_default
 
@@ -12,16 +14,31 @@ __all__ = [
     "get_stock_quantity", "get_stock_price", "get_storage_quantity", "get_storage_price",
     "get_customer_price", "get_customer_quantity", "get_output_price", "get_output_quantity",
     "get_lostandfound_price", "get_lostandfound_quantity", "get_supplier_price",
-    "get_supplier_quantity",
+    "get_supplier_quantity", "get_stock_summary", "cache_stock_summary",
 ]
 
+# maximum number of products summarized by a single query
+SUMMARY_CHUNK_SIZE = 500
 
-def get_stock_quantity(product, location_type=None, **kwargs):
+# Weighted arithmetic mean of the stocks unit price or standard mean if weights sum is 0
+WEIGHTED_PRICE_SQL = (
+    "CASE WHEN SUM({table}.quantity) <> 0 "
+    "THEN 1.0 * SUM({table}.unit_price * {table}.quantity) / SUM({table}.quantity) "
+    "ELSE AVG({table}.unit_price) END"
+)
+
+StockTotals = collections.namedtuple("StockTotals", ["quantity", "value", "price_sum", "count", "reserved"])
+
+
+def get_stock_quantity(product, location_type=None, as_of=None, **kwargs):
     from ..models import Stock
 
+    if as_of is not None:
+        return _get_past_stock_quantity(product, location_type, as_of)
+
     qs = Stock.objects.filter(product=product, **kwargs)
 
-    if location_type:
+    if location_type is not None:
         if isinstance(location_type, collections.Sequence):
             qs = qs.filter(location__type__in=location_type)
         else:
@@ -32,30 +49,70 @@ def get_stock_quantity(product, location_type=None, **kwargs):
     return result["quantity__sum"] or 0
 
 
+def _get_past_stock_quantity(product, location_type, as_of):
+    """
+    Returns the stock quantity of `product` at the `as_of` date, starting from the nearest
+    previous snapshot and applying the movements done after it (see `StockSnapshot`).
+
+    Movements up to the last archive snapshot are deleted, so quantities before it can only
+    be read from a snapshot taken exactly at `as_of`: a ValueError is raised otherwise.
+    """
+    from ..ledger import get_last_archive_date
+    from ..models import Movement, StockSnapshot
+
+    def filter_location_type(qs, field):
+        if location_type is not None:
+            if isinstance(location_type, collections.Sequence):
+                qs = qs.filter(**{"%s__type__in" % field: location_type})
+            else:
+                qs = qs.filter(**{"%s__type" % field: location_type})
+        return qs
+
+    snapshot_date = StockSnapshot.objects.filter(date__lte=as_of).aggregate(Max("date"))["date__max"]
+
+    archive_date = get_last_archive_date()
+    if archive_date is not None and as_of < archive_date and snapshot_date != as_of:
+        raise ValueError("Movements up to %s are archived, past quantities before it are unknown" % archive_date)
+
+    movements = Movement.objects.filter(product=product, date__lte=as_of)
+    if snapshot_date is not None:
+        # movements committed after the snapshot can be dated before it
+        last_movement_id = StockSnapshot.objects.filter(date=snapshot_date).aggregate(
+            Max("last_movement_id"))["last_movement_id__max"]
+        if last_movement_id is None:
+            movements = movements.filter(date__gt=snapshot_date)
+        else:
+            movements = movements.filter(id__gt=last_movement_id)
+        snapshots = StockSnapshot.objects.filter(product=product, date=snapshot_date)
+        quantity = filter_location_type(snapshots, "location").aggregate(Sum("quantity"))["quantity__sum"] or 0
+    else:
+        quantity = 0
+
+    incoming = filter_location_type(movements, "to_location").aggregate(Sum("quantity"))["quantity__sum"]
+    outgoing = filter_location_type(movements, "from_location").aggregate(Sum("quantity"))["quantity__sum"]
+
+    return quantity + (incoming or 0) - (outgoing or 0)
+
+
 def get_stock_price(product, location_type=None, **kwargs):
     from ..models import Stock
 
     qs = Stock.objects.filter(product=product, **kwargs)
 
-    if location_type:
+    if location_type is not None:
         if isinstance(location_type, collections.Sequence):
             qs = qs.filter(location__type__in=location_type)
         else:
             qs = qs.filter(location__type=location_type)
 
-    stocks = qs.values("unit_price", "quantity")
+    # the weighted mean is computed by the database over the matching stocks
+    sql, params = qs.values("unit_price", "quantity").query.sql_with_params()
 
-    if len(stocks) > 0:
-        # compute a weighted arithmetic mean or standard mean if weights sum is 0
-        weights = sum(map(lambda s: s["quantity"], stocks))
-        if weights != 0:
-            value = sum(map(lambda s: s["unit_price"] * s["quantity"], stocks)) / weights
-        else:
-            value = sum(map(lambda s: s["unit_price"], stocks)) / len(stocks)
-    else:
-        value = 0
+    cursor = connection.cursor()
+    cursor.execute("SELECT {} FROM ({}) stocks".format(WEIGHTED_PRICE_SQL.format(table="stocks"), sql), params)
+    value = cursor.fetchone()[0]
 
-    return money_to_default(value)
+    return money_to_default(_to_decimal(value))
 
 
 def get_supplier_quantity(product, **kwargs):
@@ -106,3 +163,113 @@ def get_lostandfound_quantity(product, **kwargs):
 def get_lostandfound_price(product, **kwargs):
     from ..models import Location
     return get_stock_price(product, Location.LOCATION_LOST_AND_FOUND, **kwargs)
+
+
+class StockSummary(dict):
+    """
+    Stock totals of many products, as returned by `get_stock_summary`.
+    Maps (product id, location type) pairs to `StockTotals` and computes quantities
+    and prices the same way `get_stock_quantity` and `get_stock_price` do.
+    """
+
+    def __init__(self, location_types):
+        super(StockSummary, self).__init__()
+        self.location_types = location_types
+
+    def _get_totals(self, product, location_type=None):
+        product_id = getattr(product, "pk", product)
+
+        if location_type is None:
+            location_types = self.location_types
+        elif isinstance(location_type, collections.Sequence):
+            location_types = location_type
+        else:
+            location_types = [location_type]
+
+        totals = [self[(product_id, t)] for t in location_types if (product_id, t) in self]
+        return StockTotals(*[sum(values) for values in zip(*totals)]) if totals else None
+
+    def get_quantity(self, product, location_type=None):
+        totals = self._get_totals(product, location_type)
+        return totals.quantity if totals else 0
+
+    def get_reserved(self, product, location_type=None):
+        totals = self._get_totals(product, location_type)
+        return totals.reserved if totals else 0
+
+    def get_available(self, product, location_type=None):
+        """
+        Returns the quantity not held by pending reservations
+        """
+        totals = self._get_totals(product, location_type)
+        return totals.quantity - totals.reserved if totals else 0
+
+    def get_price(self, product, location_type=None):
+        totals = self._get_totals(product, location_type)
+
+        if totals is None:
+            value = 0
+        elif totals.quantity != 0:
+            # weighted arithmetic mean or standard mean if weights sum is 0
+            value = totals.value / totals.quantity
+        else:
+            value = totals.price_sum / totals.count
+
+        return money_to_default(value)
+
+
+def get_stock_summary(products, location_types=None):
+    """
+    Returns a `StockSummary` with quantity, reserved quantity and price of every given product in every
+    location type, computed by a single grouped query (every `SUMMARY_CHUNK_SIZE` products).
+    """
+    from ..models import Location
+
+    if location_types is None:
+        location_types = [location_type for location_type, name in Location.LOCATION_TYPE_CHOICES]
+    elif not isinstance(location_types, collections.Sequence):
+        location_types = [location_types]
+
+    summary = StockSummary(list(location_types))
+    product_ids = sorted(set(getattr(product, "pk", product) for product in products))
+
+    for i in range(0, len(product_ids), SUMMARY_CHUNK_SIZE):
+        chunk = product_ids[i:i + SUMMARY_CHUNK_SIZE]
+        sql = (
+            "SELECT warehouse_stock.product_id, warehouse_location.type, SUM(warehouse_stock.quantity), "
+            "SUM(warehouse_stock.unit_price * warehouse_stock.quantity), SUM(warehouse_stock.unit_price), "
+            "COUNT(*), SUM(warehouse_stock.reserved) "
+            "FROM warehouse_stock "
+            "INNER JOIN warehouse_location ON warehouse_stock.location_id = warehouse_location.id "
+            "WHERE warehouse_stock.product_id IN ({}) AND warehouse_location.type IN ({}) "
+            "GROUP BY warehouse_stock.product_id, warehouse_location.type"
+        ).format(", ".join(["%s"] * len(chunk)), ", ".join(["%s"] * len(summary.location_types)))
+
+        cursor = connection.cursor()
+        cursor.execute(sql, chunk + summary.location_types)
+
+        for product_id, location_type, quantity, value, price_sum, count, reserved in cursor.fetchall():
+            summary[(product_id, location_type)] = StockTotals(
+                _to_decimal(quantity), _to_decimal(value), _to_decimal(price_sum), count, _to_decimal(reserved))
+
+    return summary
+
+
+def cache_stock_summary(products, location_types=None):
+    """
+    Attaches to the given products the `StockSummary` of all of them, read by the
+    `Product.cost` and `Product.quantity` properties instead of querying the stocks
+    """
+    summary = get_stock_summary(products, location_types)
+    for product in products:
+        product._stock_summary = summary
+    return summary
+
+
+def _to_decimal(value):
+    # some backends (sqlite) return aggregates of decimal columns as floats
+    if value is None:
+        return Decimal(0)
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    return Decimal(value)
@@ -10,5 +10,5 @@ class WarehouseConfig(AppConfig):
     verbose_name = "Bazaar Warehouse"
 
     def ready(self):
-        # import stock module to attach handlers to signals
-        from . import stocks  # noqa
+        # import stock, locations and summaries modules to attach handlers to signals
+        from . import stocks, locations, summaries  # noqa
@@ -1,20 +1,126 @@
+"""
+Availability backends compute how many units of a product can still be sold,
+choose one with the DEFAULT_AVAILABILITY_BACKEND setting.
+"""
+
 from __future__ import unicode_literals
 
+from django.core.cache import cache
+from django.db.models import Sum
+
 from ..listings.models import Order
+from ..settings import bazaar_settings
+from .dispatch import Deferred
 
 
 class BaseAvailabilityBackend(object):
     def available(self, *args, **kwargs):
         raise NotImplementedError
 
+    def get_available_quantities(self, products):
+        """
+        Returns a dict mapping the ids of `products` to their available quantity
+        """
+        raise NotImplementedError
+
+    def invalidate(self, products):
+        """
+        Forgets the available quantities computed for `products`, when they are cached
+        """
+        pass
+
+
+class AvailabilityBackend(BaseAvailabilityBackend):
+    """
+    The available quantity of a product is its storage quantity minus the quantity held
+    by pending reservations and the quantity of its pending orders. Quantities are cached
+    per product, and invalidated when orders, stocks or reservations of the product change.
+    """
+    cache_key = "bazaar:availability:%s"
+    cache_timeout = 60 * 60
 
-class AvailabilityBackend(object):
-    # TODO: TEST THIS ONE
     def available(self, stock):
+        """
+        Returns the quantity of `stock` not reserved, minus the quantity of the pending orders
+        of its product
+        """
+        pending = self.get_pending_quantities([stock.product_id])
+        return stock.quantity - stock.reserved - pending.get(stock.product_id, 0)
+
+    def get_pending_quantities(self, products):
+        """
+        Returns a dict mapping the ids of `products` to the quantity of their pending orders,
+        computed by a single grouped query. Products without pending orders are missing.
+        """
+        product_ids = [getattr(product, "pk", product) for product in products]
+
         pending = Order.objects.filter(
-            publishing__listing__product=stock.product
-        ).filter(status=Order.ORDER_PENDING).extra(
-            select={"pending": "SUM(COALESCE(products.quantity, 1) * listings_order.quantity)"}
-        ).values("pending")[0]["pending"]
+            status=Order.ORDER_PENDING, publishing__listing__product__in=product_ids
+        ).values_list("publishing__listing__product").annotate(pending=Sum("quantity")).order_by()
+
+        return dict(pending)
+
+    def get_available_quantities(self, products):
+        from .api import get_stock_summary
+        from .models import Location
+
+        product_ids = set(getattr(product, "pk", product) for product in products)
+
+        keys = dict((self.cache_key % product_id, product_id) for product_id in product_ids)
+        cached = cache.get_many(keys.keys())
+        available = dict((keys[key], quantity) for key, quantity in cached.items())
+
+        missing = product_ids.difference(available)
+        if missing:
+            summary = get_stock_summary(missing, Location.LOCATION_STORAGE)
+            pending = self.get_pending_quantities(missing)
+
+            computed = {}
+            for product_id in missing:
+                quantity = summary.get_available(product_id, Location.LOCATION_STORAGE)
+                computed[product_id] = quantity - pending.get(product_id, 0)
+            cache.set_many(dict((self.cache_key % product_id, quantity)
+                                for product_id, quantity in computed.items()), self.cache_timeout)
+            available.update(computed)
+
+        return available
+
+    def invalidate(self, products):
+        cache.delete_many([self.cache_key % getattr(product, "pk", product) for product in products])
+
+
+_backend = None
+
+
+def get_availability_backend():
+    """
+    Returns the instance of the backend configured in the DEFAULT_AVAILABILITY_BACKEND setting
+    """
+    global _backend
+    if _backend is None:
+        _backend = bazaar_settings.DEFAULT_AVAILABILITY_BACKEND()
+    return _backend
+
+
+def get_available_quantity(product):
+    """
+    Returns the quantity of `product` that can still be sold
+    """
+    product_id = getattr(product, "pk", product)
+    return get_availability_backend().get_available_quantities([product_id])[product_id]
+
+
+# products whose available quantity changed, invalidated when the transaction commits
+_invalidations = Deferred(lambda product_ids: get_availability_backend().invalidate(list(product_ids)),
+                          on_commit=True)
+
 
-        return stock.quantity - (pending or 0)
+def invalidate_availability(products):
+    """
+    Invalidates the available quantities of `products` once the current transaction commits,
+    right away outside transactions. Invalidating them earlier would let a concurrent request
+    cache again the quantities that are still committed.
+    """
+    with _invalidations.block():
+        for product in products:
+            _invalidations.add(getattr(product, "pk", product))
@@ -0,0 +1,201 @@
+"""
+Stock backends define how the `Stock` relation is maintained. Choose one with
+the STOCK_BACKEND setting:
+
+TableStockBackend
+    `warehouse_stock` is a table updated by the movement signals (default).
+    Moving is slower, reading stocks is a lookup.
+
+ViewStockBackend
+    `warehouse_stock` is a database view aggregating the movements, so moving
+    only inserts a movement row. Every read aggregates the movements of the
+    read products.
+
+MaterializedViewStockBackend
+    PostgreSQL only. `warehouse_stock` is a materialized view with the query of
+    `ViewStockBackend`, refreshed concurrently by the `refresh_stock` command
+    (run it on a schedule). Reads are fast, but stale until the next refresh.
+
+The table keeps the running average unit price of every stock: incoming movements
+average their price with the quantity in stock, outgoing ones leave it unchanged. That
+average depends on the order of the movements and cannot be aggregated by a view, so
+view stocks are priced at the average unit price of all their incoming movements. The
+two prices differ once a stock has been emptied and refilled at another price, see
+`running_average_prices`.
+
+Stock reservations need the table, views never hold reserved quantities. Composite
+product stocks are not derived from movements, they are stored in
+`warehouse_compositestock` and merged into the view. Installing a view backend over the
+`warehouse_stock` table moves the composite stocks found in the table there.
+
+Stocks are read from `warehouse_stock` by the bazaar.warehouse.api functions and the
+products queryset annotations, so they work the same with every backend.
+"""
+
+from __future__ import unicode_literals
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+
+from ..settings import bazaar_settings
+
+
+STOCK_VIEW_NAME = "warehouse_stock"
+
+STOCK_VIEW_SQL = (
+    # composite stocks have negative ids, so that they never clash with the other ones
+    "SELECT -id AS id, product_id, location_id, unit_price, unit_price_currency, quantity, 0 AS reserved "
+    "FROM warehouse_compositestock "
+    "UNION ALL "
+    # each movement is split into an incoming and an outgoing side, the minimum key
+    # of the sides grouped in a stock identifies the stock
+    "SELECT MIN(side.stock_key) AS id, side.product_id, side.location_id, "
+    "CASE WHEN SUM(side.incoming) <> 0 THEN 1.0 * SUM(side.value) / SUM(side.incoming) ELSE 0 END AS unit_price, "
+    "'{currency}' AS unit_price_currency, SUM(side.quantity) AS quantity, 0 AS reserved "
+    "FROM ("
+    "SELECT 2 * id AS stock_key, product_id, to_location_id AS location_id, quantity, "
+    "quantity AS incoming, quantity * unit_price AS value FROM warehouse_movement "
+    "UNION ALL "
+    "SELECT 2 * id + 1 AS stock_key, product_id, from_location_id AS location_id, -quantity AS quantity, "
+    "0 AS incoming, 0 AS value FROM warehouse_movement"
+    ") side "
+    "GROUP BY side.product_id, side.location_id"
+)
+
+
+class TableStockBackend(object):
+    """
+    Stocks are stored in the `warehouse_stock` table and updated on every movement
+    """
+    # whether `warehouse_stock` is a table created by Django
+    managed = True
+
+    # whether stocks are written when moving products
+    stores_stocks = True
+
+    # whether stock prices are running averages, or the average price of the incoming movements
+    running_average_prices = True
+
+    def install(self, name=STOCK_VIEW_NAME):
+        """
+        Creates the database objects needed by the backend, called after migrations
+        """
+        pass
+
+    def refresh(self, name=STOCK_VIEW_NAME):
+        """
+        Brings stocks up to date with the movements, when they are not always in sync
+        """
+        pass
+
+    def get_composite_model(self):
+        """
+        Returns the model storing the stocks of composite products
+        """
+        from .models import Stock
+
+        return Stock
+
+
+class ViewStockBackend(TableStockBackend):
+    """
+    Stocks are computed by the `warehouse_stock` view aggregating the movements
+    """
+    managed = False
+    stores_stocks = False
+    running_average_prices = False
+
+    view_type = "VIEW"
+
+    def get_view_sql(self):
+        from ..utils import get_default_currency
+
+        return STOCK_VIEW_SQL.format(currency=get_default_currency())
+
+    def install(self, name=STOCK_VIEW_NAME):
+        relation_type = get_relation_type(name)
+        if relation_type == "TABLE":
+            self.copy_composite_stocks(name)
+
+        cursor = connection.cursor()
+        if relation_type is not None:
+            cursor.execute("DROP {} {}".format(relation_type, name))
+        cursor.execute("CREATE {} {} AS {}".format(self.view_type, name, self.get_view_sql()))
+
+    def copy_composite_stocks(self, name):
+        """
+        Copies the composite stocks of the `name` stock table, that is replaced by the view
+        """
+        from ..goods.models import CompositeProduct
+        from .models import CompositeStock
+
+        CompositeStock.objects.all().delete()
+        connection.cursor().execute(
+            "INSERT INTO {0} (product_id, location_id, unit_price, unit_price_currency, quantity) "
+            "SELECT product_id, location_id, unit_price, unit_price_currency, quantity FROM {1} "
+            "WHERE product_id IN (SELECT {2} FROM {3})".format(
+                CompositeStock._meta.db_table, name, CompositeProduct._meta.pk.column,
+                CompositeProduct._meta.db_table))
+
+    def get_composite_model(self):
+        from .models import CompositeStock
+
+        return CompositeStock
+
+
+class MaterializedViewStockBackend(ViewStockBackend):
+    """
+    Stocks are computed by the `warehouse_stock` materialized view, refreshed by the
+    `refresh_stock` command. Only available on PostgreSQL.
+    """
+    view_type = "MATERIALIZED VIEW"
+
+    def install(self, name=STOCK_VIEW_NAME):
+        if connection.vendor != "postgresql":
+            raise ImproperlyConfigured("MaterializedViewStockBackend requires PostgreSQL")
+
+        super(MaterializedViewStockBackend, self).install(name)
+
+        cursor = connection.cursor()
+        # concurrent refreshes need a unique index
+        cursor.execute("CREATE UNIQUE INDEX {0}_id ON {0} (id)".format(name))
+        cursor.execute("CREATE INDEX {0}_product_id ON {0} (product_id)".format(name))
+        cursor.execute("CREATE INDEX {0}_location_id ON {0} (location_id)".format(name))
+
+    def refresh(self, name=STOCK_VIEW_NAME):
+        # readers are not blocked while refreshing
+        connection.cursor().execute("REFRESH MATERIALIZED VIEW CONCURRENTLY {}".format(name))
+
+
+def get_relation_type(name):
+    """
+    Returns "TABLE", "VIEW" or "MATERIALIZED VIEW", the type of the `name` relation,
+    or None when it does not exist
+    """
+    cursor = connection.cursor()
+    if connection.vendor == "sqlite":
+        cursor.execute("SELECT type FROM sqlite_master WHERE name = %s", [name])
+        types = {"table": "TABLE", "view": "VIEW"}
+    elif connection.vendor == "postgresql":
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s AND pg_table_is_visible(oid)", [name])
+        types = {"r": "TABLE", "v": "VIEW", "m": "MATERIALIZED VIEW"}
+    else:
+        cursor.execute("SELECT table_type FROM information_schema.tables "
+                       "WHERE table_name = %s AND table_schema = DATABASE()", [name])
+        types = {"BASE TABLE": "TABLE", "VIEW": "VIEW"}
+
+    row = cursor.fetchone()
+    return types.get(row[0]) if row else None
+
+
+_backend = None
+
+
+def get_stock_backend():
+    """
+    Returns the instance of the backend configured in the STOCK_BACKEND setting
+    """
+    global _backend
+    if _backend is None:
+        _backend = bazaar_settings.STOCK_BACKEND()
+    return _backend
@@ -0,0 +1,188 @@
+"""
+This module computes the stocks of composite products from the stocks of their
+components: the quantity is the number of complete sets available and the unit
+price is the sum of the components prices.
+"""
+
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection
+
+from .api import get_stock_summary
+from .backends import get_stock_backend
+from .dispatch import Deferred
+
+# composite stocks updated by every UPDATE statement
+UPDATE_CHUNK_SIZE = 100
+
+
+def get_composite_sets(product_ids):
+    """
+    Returns a dict mapping the composite products containing any of `product_ids`
+    to the list of their (component id, set quantity)
+    """
+    from ..goods.models import ProductSet
+
+    containing = ProductSet.objects.filter(product__in=product_ids).values("composite")
+    sets = ProductSet.objects.filter(composite__in=containing).values_list("composite_id", "product_id", "quantity")
+
+    composites = defaultdict(list)
+    for composite_id, product_id, quantity in sets:
+        composites[composite_id].append((product_id, quantity))
+    return composites
+
+
+def compute_composite_stock(components, summary, location_type):
+    """
+    Returns (quantity, unit price amount) of a composite made of `components`,
+    a list of (component id, set quantity), reading component stocks from `summary`
+    """
+    quantities = []
+    unit_price = 0
+    for product_id, set_quantity in components:
+        quantities.append(summary.get_quantity(product_id, location_type) // set_quantity)
+        unit_price += summary.get_price(product_id, location_type).amount * set_quantity
+
+    quantity = min(quantities)
+    return (quantity if quantity > 0 else 0), unit_price
+
+
+def update_composite_stocks(products, locations):
+    """
+    Updates the stocks in `locations` of the composite products containing any of `products`.
+
+    Components stocks are read by a single grouped query and composite stocks by another
+    one, missing composite stocks are created in bulk and the changed ones are saved by a
+    single UPDATE.
+    Location changed signals are sent for every composite stock. Returns the composite stocks.
+    """
+    composites = get_composite_sets([getattr(product, "pk", product) for product in products])
+    if not composites:
+        return []
+
+    return save_composite_stocks(composites, locations)
+
+
+def save_composite_stocks(composites, locations):
+    """
+    Saves the stocks in `locations` of `composites`, a dict mapping composite ids to the
+    list of their (component id, set quantity). Returns the composite stocks.
+    """
+    from .stocks import _send_changed_location
+
+    locations = dict((location.pk, location) for location in locations)
+    location_types = list(set(location.type for location in locations.values()))
+
+    component_ids = set(product_id for components in composites.values() for product_id, _ in components)
+    summary = get_stock_summary(component_ids, location_types)
+
+    expected = {}
+    for composite_id, components in composites.items():
+        for location in locations.values():
+            expected[(composite_id, location.pk)] = compute_composite_stock(components, summary, location.type)
+
+    Stock = get_stock_backend().get_composite_model()
+    exponent = Decimal(1).scaleb(-Stock._meta.get_field("unit_price").decimal_places)
+
+    def get_stocks():
+        stocks = Stock.objects.filter(product__in=composites.keys(), location__in=locations.keys())
+        return dict(((stock.product_id, stock.location_id), stock)
+                    for stock in stocks.select_related("product", "location"))
+
+    stocks = get_stocks()
+
+    new_stocks, changed_stocks = [], []
+    for key, (quantity, unit_price) in expected.items():
+        stock = stocks.get(key)
+        if stock is None:
+            new_stocks.append(Stock(product_id=key[0], location_id=key[1], quantity=quantity, unit_price=unit_price))
+        elif stock.quantity != quantity or stock.unit_price.amount != Decimal(unit_price).quantize(exponent):
+            stock.quantity, stock.unit_price = quantity, Decimal(unit_price).quantize(exponent)
+            changed_stocks.append(stock)
+
+    if changed_stocks:
+        update_stocks(Stock, changed_stocks)
+
+    if new_stocks:
+        Stock.objects.bulk_create(new_stocks)
+        stocks = get_stocks()
+
+    for stock in stocks.values():
+        _send_changed_location(stock)
+
+    return list(stocks.values())
+
+
+def update_stocks(model, stocks):
+    """
+    Saves quantity and unit price of `stocks`, instances of `model`, with one UPDATE
+    statement for every `UPDATE_CHUNK_SIZE` of them, choosing the values by primary key.
+    Values are converted by the model fields like saving the instances does, and passed as
+    decimals so that the CASE expressions are numeric.
+    """
+    qn = connection.ops.quote_name
+    opts = model._meta
+    quantity_field, price_field = opts.get_field("quantity"), opts.get_field("unit_price")
+
+    for i in range(0, len(stocks), UPDATE_CHUNK_SIZE):
+        chunk = stocks[i:i + UPDATE_CHUNK_SIZE]
+        cases = "CASE {} {} END".format(qn(opts.pk.column), " ".join(["WHEN %s THEN %s"] * len(chunk)))
+        sql = "UPDATE {} SET {} = {}, {} = {} WHERE {} IN ({})".format(
+            qn(opts.db_table), qn(opts.get_field("quantity").column), cases,
+            qn(opts.get_field("unit_price").column), cases, qn(opts.pk.column), ", ".join(["%s"] * len(chunk)))
+
+        params = []
+        for stock in chunk:
+            params.extend([stock.pk, Decimal(quantity_field.get_db_prep_save(stock.quantity, connection))])
+        for stock in chunk:
+            params.extend([stock.pk, Decimal(price_field.get_db_prep_save(stock.unit_price, connection))])
+        params.extend(stock.pk for stock in chunk)
+
+        connection.cursor().execute(sql, params)
+
+
+def refresh_composites(composite_ids):
+    """
+    Sets the price of the composite products in `composite_ids` to the sum of their
+    components prices and recomputes their storage stock, after their sets changed
+    """
+    from ..goods.models import CompositeProduct, ProductSet
+    from .locations import get_storage
+
+    sets = ProductSet.objects.filter(composite__in=composite_ids).select_related("product")
+
+    composites = defaultdict(list)
+    prices = defaultdict(int)
+    for product_set in sets:
+        composites[product_set.composite_id].append((product_set.product_id, product_set.quantity))
+        prices[product_set.composite_id] += product_set.product.price.amount * product_set.quantity
+
+    for composite in CompositeProduct.objects.filter(pk__in=composites.keys()):
+        composite.price = prices[composite.pk]
+        composite.save()
+
+    if composites:
+        save_composite_stocks(composites, [get_storage()])
+
+
+# composites whose refresh has been deferred by `defer_composite_refresh`
+_composites = Deferred(lambda composite_ids: refresh_composites(set(composite_ids)))
+
+
+def defer_composite_refresh():
+    """
+    Returns a context manager (or decorator) deferring the refresh of the composite products
+    whose sets are saved inside it, so that every composite is refreshed once when the
+    outermost block exits. Composites of a block raising an exception are not refreshed.
+    """
+    return _composites.block()
+
+
+def schedule_composite_refresh(composite_id):
+    """
+    Refreshes the composite product, or defers it when a `defer_composite_refresh` block is running
+    """
+    _composites.add(composite_id)
@@ -0,0 +1,165 @@
+"""
+This module buffers the location changed signals, so that they can be sent
+once for every changed stock when a transaction is committed.
+
+`Deferred` buffers any kind of change the same way, it's used by storage
+summaries and composite products as well.
+"""
+
+from __future__ import unicode_literals
+
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from django.db import transaction
+
+from ..compat import on_commit
+
+
+class Deferred(object):
+    """
+    Collects the items passed to `add`, and hands them to `flush` all at once as an
+    ordered dict. Items are collected inside the blocks returned by `block`, and flushed
+    when the outermost block exits. When `on_commit` is True, the items added inside a
+    transaction are collected until its outermost atomic block commits instead.
+
+    Items collected by a block raising an exception (the blocks around it keep their own)
+    and items collected by a transaction rolled back are discarded. Rolling back to a
+    savepoint discards the items collected since only when the exception goes through a
+    block. Outside blocks and transactions `flush` is called right away.
+    """
+
+    def __init__(self, flush, on_commit=False):
+        self.flush = flush
+        self.on_commit = on_commit
+        self.local = threading.local()
+
+    def get_state(self):
+        local = self.local
+        if not hasattr(local, "blocks"):
+            # collected items, the commit hook of the transaction collecting them with the
+            # items collected before it, and the (hook, items) of every running block
+            local.items, local.hook, local.base, local.blocks = OrderedDict(), None, None, []
+        elif local.hook is not None and not _is_pending(local.hook):
+            # the transaction has been rolled back, its hook will never run
+            local.items, local.hook, local.base = local.base, None, None
+        return local
+
+    def add(self, key, value=None):
+        """
+        Adds `value` under `key`, replacing the value already collected under the same key.
+        Returns False when `key` was already collected.
+        """
+        state = self.get_state()
+        if self.on_commit and state.hook is None and transaction.get_connection().in_atomic_block:
+            state.hook, state.base = self._make_hook(), state.items.copy()
+            on_commit(state.hook)
+
+        if state.hook is None and not state.blocks:
+            self.flush(OrderedDict([(key, value)]))
+            return True
+
+        collected = key in state.items
+        state.items[key] = value
+        return not collected
+
+    def collected(self):
+        """
+        Returns the ordered dict of the items collected so far
+        """
+        return self.get_state().items
+
+    def _make_hook(self):
+        def hook():
+            state = self.local
+            if state.hook is not hook:
+                return
+            state.hook, state.base = None, None
+            if state.blocks:
+                # committed items wait for the outermost block, that can no longer forget them
+                state.blocks = [(None, state.items.copy()) for block in state.blocks]
+            else:
+                items, state.items = state.items, OrderedDict()
+                if items:
+                    self.flush(items)
+        return hook
+
+    def enter(self):
+        state = self.get_state()
+        # keep a copy to forget the items of a block rolled back to its savepoint
+        state.blocks.append((state.hook, state.items.copy()))
+
+    def exit(self, exc_type):
+        state = self.get_state()
+        hook, items = state.blocks.pop()
+        if exc_type is not None and (hook is None or state.hook is hook):
+            # unless the transaction collecting them has been rolled back already
+            state.items = items
+        if not state.blocks and state.hook is None:
+            items, state.items = state.items, OrderedDict()
+            if items:
+                self.flush(items)
+
+    def block(self):
+        """
+        Returns a context manager (or decorator) collecting the items added inside it
+        """
+        return DeferredBlock(self)
+
+
+class DeferredBlock(object):
+    def __init__(self, deferred):
+        self.deferred = deferred
+
+    def __enter__(self):
+        self.deferred.enter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deferred.exit(exc_type)
+
+    def __call__(self, func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            with DeferredBlock(self.deferred):
+                return func(*args, **kwargs)
+        return inner
+
+
+def _is_pending(hook):
+    # hooks of the transactions (or savepoints) rolled back are dropped by the connection
+    return any(func is hook for sids, func in getattr(transaction.get_connection(), "run_on_commit", []))
+
+
+def _send_signals(signals):
+    from .summaries import defer_summary_updates
+
+    # storage summaries of all the changed products are updated at once
+    with defer_summary_updates():
+        for signal, stock in signals.values():
+            signal.send(sender=stock, product=stock.product)
+
+
+# location changed signals, de-duplicated by (product, location type)
+_signals = Deferred(_send_signals, on_commit=True)
+
+
+def coalesce_changed_signals():
+    """
+    Returns a context manager (or decorator) buffering the location changed signals sent inside it.
+
+    Signals are de-duplicated by (product, location type), the last changed stock being the
+    sender. Signals sent inside a transaction are buffered until its outermost atomic block
+    commits, so receivers never see rolled back stocks, and discarded when it rolls back.
+    Outside transactions they are sent when the outermost block exits. Signals are discarded
+    when the block raises an exception.
+    """
+    return _signals.block()
+
+
+def send_changed(signal, stock):
+    """
+    Sends `signal` for `stock`, or buffers it when running inside a transaction or a
+    `coalesce_changed_signals` block. Returns False when the change was already buffered.
+    """
+    return _signals.add((stock.product_id, stock.location.type), (signal, stock))
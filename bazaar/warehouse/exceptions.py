@@ -1,2 +1,14 @@
 class MovementException(Exception):
     pass
+
+
+class ReservationException(Exception):
+    pass
+
+
+class InsufficientStockException(ReservationException):
+    pass
+
+
+class ReservedStockException(MovementException):
+    pass
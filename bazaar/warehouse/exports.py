@@ -0,0 +1,133 @@
+"""
+This module streams movements and stocks as CSV or JSON lines. Rows are read in chunks
+with keyset pagination, so memory does not depend on the size of the export.
+"""
+
+from __future__ import unicode_literals
+
+import csv
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from django.utils import six
+from django.utils.encoding import force_bytes, force_text
+
+from .ledger import iter_movements
+
+
+MOVEMENT_COLUMNS = (
+    ("id", "id"),
+    ("date", "date"),
+    ("product_id", "product_id"),
+    ("product__ean", "ean"),
+    ("product__code", "code"),
+    ("product__name", "product"),
+    ("from_location__slug", "from_location"),
+    ("to_location__slug", "to_location"),
+    ("quantity", "quantity"),
+    ("unit_price", "unit_price"),
+    ("unit_price_currency", "currency"),
+    ("agent", "agent"),
+    ("note", "note"),
+)
+
+STOCK_COLUMNS = (
+    ("id", "id"),
+    ("product_id", "product_id"),
+    ("product__ean", "ean"),
+    ("product__code", "code"),
+    ("product__name", "product"),
+    ("location__slug", "location"),
+    ("location__type", "location_type"),
+    ("quantity", "quantity"),
+    ("unit_price", "unit_price"),
+    ("unit_price_currency", "currency"),
+)
+
+CONTENT_TYPES = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+}
+
+
+def iter_movement_rows(queryset, chunk_size=2000):
+    """
+    Yields a tuple for every movement in `queryset`, with the values of `MOVEMENT_COLUMNS`
+    """
+    fields = [field for field, name in MOVEMENT_COLUMNS]
+    for chunk in iter_movements(queryset, chunk_size=chunk_size, fields=fields):
+        for row in chunk:
+            yield row
+
+
+def iter_stock_rows(queryset, chunk_size=2000):
+    """
+    Yields a tuple for every stock in `queryset`, with the values of `STOCK_COLUMNS`
+    """
+    queryset = queryset.order_by("pk").values_list(*[field for field, name in STOCK_COLUMNS])
+
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            break
+
+        for row in chunk:
+            yield row
+
+        last_pk = chunk[-1][0]
+
+
+def _to_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return force_text(value)
+
+
+def _to_json(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        # decimals are exported as strings to keep their precision
+        return force_text(value)
+    return value
+
+
+class Echo(object):
+    """
+    File-like object returning what is written, used to stream the csv writer output
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(columns, rows):
+    writer = csv.writer(Echo())
+
+    header = [name for field, name in columns]
+    if six.PY2:
+        header = [force_bytes(name) for name in header]
+    yield writer.writerow(header)
+
+    for row in rows:
+        row = [_to_text(value) for value in row]
+        if six.PY2:
+            # the python 2 csv module works on bytes
+            row = [force_bytes(value) for value in row]
+        yield writer.writerow(row)
+
+
+def jsonl_lines(columns, rows):
+    names = [name for field, name in columns]
+    for row in rows:
+        yield "%s\n" % json.dumps(dict(zip(names, [_to_json(value) for value in row])))
+
+
+def export_lines(export_format, columns, rows):
+    if export_format == "csv":
+        return csv_lines(columns, rows)
+    return jsonl_lines(columns, rows)
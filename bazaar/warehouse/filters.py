@@ -0,0 +1,35 @@
+from __future__ import unicode_literals
+
+from django.db.models import Q
+
+import django_filters
+
+from ..filters import BaseFilterSet
+from .models import Location, Movement, Stock
+
+
+def filter_by_location(queryset, slug):
+    if not slug:
+        return queryset
+    return queryset.filter(Q(from_location__slug=slug) | Q(to_location__slug=slug))
+
+
+class MovementExportFilter(BaseFilterSet):
+    date_from = django_filters.DateFilter(name="date", lookup_type="gte")
+    date_to = django_filters.DateFilter(name="date", lookup_type="lt", help_text="Excluded")
+    location = django_filters.CharFilter(action=filter_by_location)
+    product = django_filters.NumberFilter(name="product")
+
+    class Meta:
+        model = Movement
+        fields = ["date_from", "date_to", "location", "product"]
+
+
+class StockExportFilter(BaseFilterSet):
+    location = django_filters.CharFilter(name="location__slug")
+    location_type = django_filters.ChoiceFilter(name="location__type", choices=Location.LOCATION_TYPE_CHOICES)
+    product = django_filters.NumberFilter(name="product")
+
+    class Meta:
+        model = Stock
+        fields = ["location", "location_type", "product"]
@@ -0,0 +1,224 @@
+"""
+This module imports movements from files (CSV or JSON lines) streaming their rows,
+so that files with hundreds of thousands of rows can be imported with constant memory.
+
+Every row has the following fields:
+
+    ean or code      the product, looked up by ean first
+    from_location    slug of the source location
+    to_location      slug of the destination location
+    quantity         positive amount
+    unit_price       optional, defaults to the product price
+    currency         optional, defaults to the default currency
+    note             optional
+"""
+
+from __future__ import unicode_literals
+
+import csv
+import json
+from collections import defaultdict, namedtuple
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import six
+from django.utils.encoding import force_text
+
+from moneyed import Money, CURRENCIES
+
+from ..goods.models import Product, CompositeProduct, ProductSet
+from ..utils import get_default_currency
+from .api import move_many
+from .composites import update_composite_stocks
+from .dispatch import coalesce_changed_signals
+from .models import Location, Movement
+
+
+ImportResult = namedtuple("ImportResult", ["imported", "rejected"])
+
+# marks eans and codes shared by more products
+AMBIGUOUS = object()
+
+
+class RejectedRow(Exception):
+    pass
+
+
+def read_csv(stream):
+    """
+    Yields the rows of a CSV file, opened in binary mode on python 2
+    """
+    for row in csv.DictReader(stream):
+        if six.PY2:
+            row = dict((force_text(key), force_text(value) if value is not None else None)
+                       for key, value in row.items())
+        yield row
+
+
+def read_jsonl(stream):
+    """
+    Yields the rows of a JSON lines file, lines that are not valid JSON are yielded as strings
+    """
+    for line in stream:
+        line = force_text(line).strip()
+        if not line:
+            continue
+
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield line
+
+
+class MovementImporter(object):
+    """
+    Imports movements from an iterable of rows (dicts), see the module documentation.
+
+    Products and locations are resolved through lookup maps built once, valid rows are
+    applied with `move_many` in a transaction every `chunk_size` rows.
+    """
+
+    def __init__(self, agent="import", chunk_size=1000):
+        self.agent = agent
+        self.chunk_size = chunk_size
+
+        self.locations = dict((location.slug, location) for location in Location.objects.all())
+
+        self.products_by_ean = {}
+        self.products_by_code = {}
+        products = Product.objects.values_list("pk", "ean", "code", "price", "price_currency")
+        for pk, ean, code, price, currency in products.iterator():
+            product = (pk, Money(price, currency))
+            self._add_product(self.products_by_ean, ean, product)
+            self._add_product(self.products_by_code, code, product)
+
+        self.composite_ids = set(CompositeProduct.objects.values_list("pk", flat=True))
+        self.component_ids = set(ProductSet.objects.values_list("product_id", flat=True))
+
+    def _add_product(self, lookup, key, product):
+        if key:
+            lookup[key] = AMBIGUOUS if key in lookup else product
+
+    def import_rows(self, rows, rejected=None, progress=None):
+        """
+        Imports the movements in `rows`. `rejected` is called with every invalid row and
+        the error message, `progress` with the number of imported and rejected rows after
+        every chunk. Returns an `ImportResult`.
+        """
+        imported = rejected_count = 0
+        chunk = []
+
+        for row in rows:
+            try:
+                chunk.append(self.resolve(row))
+            except RejectedRow as e:
+                rejected_count += 1
+                if rejected is not None:
+                    rejected(row, force_text(e))
+
+            if len(chunk) >= self.chunk_size:
+                imported += self.apply(chunk)
+                chunk = []
+                if progress is not None:
+                    progress(imported, rejected_count)
+
+        if chunk:
+            imported += self.apply(chunk)
+        if progress is not None:
+            progress(imported, rejected_count)
+
+        return ImportResult(imported, rejected_count)
+
+    def resolve(self, row):
+        """
+        Returns an unsaved `Movement` for `row`, raises `RejectedRow` when the row is invalid
+        """
+        if not isinstance(row, dict):
+            raise RejectedRow("Invalid row")
+
+        ean = (row.get("ean") or "").strip()
+        code = (row.get("code") or "").strip()
+        if ean:
+            product = self.products_by_ean.get(ean)
+        elif code:
+            product = self.products_by_code.get(code)
+        else:
+            raise RejectedRow("Missing product ean or code")
+
+        if product is None:
+            raise RejectedRow("Unknown product '%s'" % (ean or code))
+        if product is AMBIGUOUS:
+            raise RejectedRow("More products match '%s'" % (ean or code))
+
+        product_id, product_price = product
+        if product_id in self.composite_ids:
+            raise RejectedRow("Composite products are moved through their components")
+
+        from_location = self._get_location(row, "from_location")
+        to_location = self._get_location(row, "to_location")
+
+        quantity = self._get_decimal(row, "quantity")
+        if quantity is None or quantity < 1:
+            raise RejectedRow("Quantity must be a positive amount")
+
+        unit_price = self._get_decimal(row, "unit_price")
+        currency = (row.get("currency") or "").strip().upper()
+        if currency and currency not in CURRENCIES:
+            raise RejectedRow("Unknown currency '%s'" % currency)
+
+        if unit_price is None:
+            if currency:
+                raise RejectedRow("Currency '%s' given without unit price" % currency)
+            unit_price = product_price
+        elif unit_price < 0:
+            raise RejectedRow("Unit price cannot be negative")
+        else:
+            unit_price = Money(unit_price, currency or get_default_currency())
+
+        return Movement(product_id=product_id, from_location=from_location, to_location=to_location,
+                        quantity=quantity, unit_price=unit_price, agent=self.agent,
+                        note=force_text(row.get("note") or ""))
+
+    def _get_location(self, row, field):
+        slug = (row.get(field) or "").strip()
+        try:
+            return self.locations[slug]
+        except KeyError:
+            raise RejectedRow("Unknown %s '%s'" % (field, slug))
+
+    def _get_decimal(self, row, field):
+        value = row.get(field)
+        if value is None or force_text(value).strip() == "":
+            return None
+
+        try:
+            value = Decimal(force_text(value).strip())
+        except InvalidOperation:
+            raise RejectedRow("Invalid %s '%s'" % (field, row.get(field)))
+        if not value.is_finite():
+            raise RejectedRow("Invalid %s '%s'" % (field, row.get(field)))
+
+        # values the database column cannot store would fail the whole chunk
+        model_field = Movement._meta.get_field(field)
+        if abs(value) >= Decimal(10) ** (model_field.max_digits - model_field.decimal_places):
+            raise RejectedRow("Too large %s '%s'" % (field, row.get(field)))
+        if value != value.quantize(Decimal(1).scaleb(-model_field.decimal_places)):
+            raise RejectedRow("Too many decimal places in %s '%s'" % (field, row.get(field)))
+
+        return value
+
+    @coalesce_changed_signals()
+    @transaction.atomic
+    def apply(self, movements):
+        move_many(movements)
+
+        # composite stocks are derived from their components
+        moved = defaultdict(set)
+        for m in movements:
+            if m.product_id in self.component_ids:
+                moved[(m.from_location, m.to_location)].add(m.product_id)
+
+        for locations, product_ids in moved.items():
+            update_composite_stocks(product_ids, locations)
+
+        return len(movements)
@@ -0,0 +1,126 @@
+"""
+This module replays movements to compute stock data from scratch, without
+relying on the denormalized `Stock` table.
+"""
+
+from __future__ import unicode_literals
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db.models import Max, Q
+
+from .stocks import compute_incoming, compute_outgoing
+
+
+MOVEMENT_FIELDS = ("id", "date", "product_id", "from_location_id", "to_location_id", "quantity", "unit_price")
+
+
+def iter_movements(queryset=None, chunk_size=10000, fields=MOVEMENT_FIELDS):
+    """
+    Yields chunks of movement tuples (see `MOVEMENT_FIELDS`) in date order.
+    Custom `fields` must start with "id" and "date".
+
+    Movements are fetched with keyset pagination on (date, id), so every chunk is a range
+    scan of the (date, id) movement index and memory does not depend on the number of
+    movements.
+    """
+    from .models import Movement
+
+    if queryset is None:
+        queryset = Movement.objects.all()
+
+    queryset = queryset.order_by("date", "id").values_list(*fields)
+
+    last = None
+    while True:
+        qs = queryset
+        if last is not None:
+            # the lower bound on date alone lets the planner start the index scan there
+            qs = qs.filter(Q(date__gt=last[1]) | Q(date=last[1], id__gt=last[0]), date__gte=last[1])
+
+        chunk = list(qs[:chunk_size])
+        if not chunk:
+            break
+
+        yield chunk
+
+        last = chunk[-1]
+
+
+def get_last_archive_date():
+    """
+    Returns the date of the last archive snapshot, movements up to it have been archived
+    """
+    from .models import StockSnapshot
+
+    return StockSnapshot.objects.filter(archive=True).aggregate(Max("date"))["date__max"]
+
+
+def get_ledger_movements():
+    """
+    Returns the movements that must be applied to the last archive snapshot
+    """
+    from .models import Movement
+
+    archive_date = get_last_archive_date()
+    if archive_date is None:
+        return Movement.objects.all()
+    return Movement.objects.filter(date__gt=archive_date)
+
+
+class StockLedger(object):
+    """
+    Stock quantities and average unit prices indexed by (product id, location id),
+    computed applying movements in date order.
+    """
+
+    def __init__(self, decimal_places=None):
+        from .models import Stock
+
+        if decimal_places is None:
+            decimal_places = Stock._meta.get_field("unit_price").decimal_places
+
+        self.exponent = Decimal(1).scaleb(-decimal_places)
+        self.stocks = {}
+
+    def load_snapshot(self, date, product_ids=None):
+        """
+        Loads the stocks saved in the snapshot taken at `date`, of `product_ids` only when given
+        """
+        from .models import StockSnapshot
+
+        snapshots = StockSnapshot.objects.filter(date=date)
+        if product_ids is not None:
+            snapshots = snapshots.filter(product__in=product_ids)
+        snapshots = snapshots.values_list("product_id", "location_id", "quantity", "unit_price")
+        for product_id, location_id, quantity, unit_price in snapshots.iterator():
+            self.set(product_id, location_id, quantity, unit_price)
+
+    def get(self, product_id, location_id):
+        return self.stocks.get((product_id, location_id), (Decimal(0), Decimal(0)))
+
+    def set(self, product_id, location_id, quantity, unit_price):
+        self.stocks[(product_id, location_id)] = (quantity, unit_price)
+
+    def apply(self, product_id, from_location_id, to_location_id, quantity, unit_price):
+        stock_quantity, stock_unit_price = self.get(product_id, to_location_id)
+        stock_quantity, stock_unit_price = compute_incoming(stock_quantity, stock_unit_price, quantity, unit_price)
+        # prices are rounded as the database does when the stock is saved
+        self.set(product_id, to_location_id, stock_quantity, self.round(stock_unit_price))
+
+        stock_quantity, stock_unit_price = self.get(product_id, from_location_id)
+        self.set(product_id, from_location_id, compute_outgoing(stock_quantity, quantity), stock_unit_price)
+
+    def apply_many(self, movements):
+        for movement_id, date, product_id, from_location_id, to_location_id, quantity, unit_price in movements:
+            self.apply(product_id, from_location_id, to_location_id, quantity, unit_price)
+
+    def round(self, value):
+        return Decimal(value).quantize(self.exponent, rounding=ROUND_HALF_UP)
+
+    def __iter__(self):
+        for (product_id, location_id), (quantity, unit_price) in self.stocks.items():
+            yield product_id, location_id, quantity, unit_price
+
+    def __len__(self):
+        return len(self.stocks)
@@ -1,10 +1,22 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from bazaar.compat import post_migrate
 from bazaar.settings import bazaar_settings
+from bazaar.warehouse.dispatch import Deferred
 from bazaar.warehouse.models import Location
 
 
+# Process local registry of the well known locations, indexed by slug
+_registry = {}
+
+# locations resolved inside a transaction, they join the registry when it commits
+_resolved = Deferred(_registry.update, on_commit=True)
+
+
 def get_location(slug):
     try:
         return Location.objects.get(slug=slug)
@@ -12,31 +24,80 @@ def get_location(slug):
         return None
 
 
-def get_storage():
-    return Location.objects.get_or_create(slug=bazaar_settings.STORAGE,
-                                          type=Location.LOCATION_STORAGE,
-                                          defaults={'name': bazaar_settings.STORAGE_NAME})[0]
+def _get_well_known_location(slug, location_type, name, cache=None):
+    """
+    Returns the location identified by `slug`, creating it when missing.
+
+    Locations are kept in the registry once resolved. When running inside a transaction
+    the location could be rolled back, so it's cached for the rest of the transaction and
+    joins the registry when the transaction commits, unless `cache` is True. Locations
+    are never cached when `cache` is False.
+    """
+    location = _registry.get(slug) or _resolved.collected().get(slug)
+    if location is None:
+        location = Location.objects.get_or_create(slug=slug, type=location_type, defaults={'name': name})[0]
+
+        if cache:
+            _registry[slug] = location
+        elif cache is None:
+            _resolved.add(slug, location)
+
+    return location
+
+
+def get_storage(cache=None):
+    return _get_well_known_location(bazaar_settings.STORAGE, Location.LOCATION_STORAGE,
+                                    bazaar_settings.STORAGE_NAME, cache)
+
+
+def get_output(cache=None):
+    return _get_well_known_location(bazaar_settings.OUTPUT, Location.LOCATION_OUTPUT,
+                                    bazaar_settings.OUTPUT_NAME, cache)
+
+
+def get_lost_and_found(cache=None):
+    return _get_well_known_location(bazaar_settings.LOST_AND_FOUND, Location.LOCATION_LOST_AND_FOUND,
+                                    bazaar_settings.LOST_AND_FOUND_NAME, cache)
+
+
+def get_customer(cache=None):
+    return _get_well_known_location(bazaar_settings.CUSTOMER, Location.LOCATION_CUSTOMER,
+                                    bazaar_settings.CUSTOMER_NAME, cache)
+
+
+def get_supplier(cache=None):
+    return _get_well_known_location(bazaar_settings.SUPPLIER, Location.LOCATION_SUPPLIER,
+                                    bazaar_settings.SUPPLIER_NAME, cache)
 
 
-def get_output():
-    return Location.objects.get_or_create(slug=bazaar_settings.OUTPUT,
-                                          type=Location.LOCATION_OUTPUT,
-                                          defaults={'name': bazaar_settings.OUTPUT_NAME})[0]
+def warm():
+    """
+    Resolves all the well known locations and keeps them in the registry.
+    Call it at startup so that requests never query for them.
+    """
+    for getter in (get_storage, get_output, get_lost_and_found, get_customer, get_supplier):
+        getter(cache=True)
 
 
-def get_lost_and_found():
-    return Location.objects.get_or_create(slug=bazaar_settings.LOST_AND_FOUND,
-                                          type=Location.LOCATION_LOST_AND_FOUND,
-                                          defaults={'name': bazaar_settings.LOST_AND_FOUND_NAME})[0]
+def clear():
+    """
+    Empties the registry, locations will be resolved again on next access
+    """
+    _registry.clear()
+    _resolved.collected().clear()
 
 
-def get_customer():
-    return Location.objects.get_or_create(slug=bazaar_settings.CUSTOMER,
-                                          type=Location.LOCATION_CUSTOMER,
-                                          defaults={'name': bazaar_settings.CUSTOMER_NAME})[0]
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+def clear_on_location_change(sender, instance, **kwargs):
+    # the slug could have been changed, look for the location by pk as well
+    for registry in (_registry, _resolved.collected()):
+        for slug, location in list(registry.items()):
+            if slug == instance.slug or location.pk == instance.pk:
+                del registry[slug]
 
 
-def get_supplier():
-    return Location.objects.get_or_create(slug=bazaar_settings.SUPPLIER,
-                                          type=Location.LOCATION_SUPPLIER,
-                                          defaults={'name': bazaar_settings.SUPPLIER_NAME})[0]
+@receiver(post_migrate)
+def clear_on_migrate(sender, **kwargs):
+    # the flush command sends post_migrate as well, locations are gone
+    clear()
@@ -0,0 +1,136 @@
+from __future__ import division
+from __future__ import unicode_literals
+
+import time
+from datetime import timedelta
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from ....settings import bazaar_settings
+from ....utils import to_money
+from ...backends import get_stock_backend
+from ...ledger import StockLedger, get_last_archive_date, iter_movements
+from ...models import Movement, MovementRollup, StockSnapshot
+
+
+class Command(BaseCommand):
+    help = ("Archive the movements older than the archive horizon into monthly rollups. Stocks at the "
+            "horizon are saved in an archive snapshot, so that stocks can still be rebuilt from movements.")
+
+    option_list = BaseCommand.option_list + (
+        make_option("--days", action="store", type="int", dest="days", default=None,
+                    help="Archive horizon in days, defaults to the MOVEMENT_ARCHIVE_DAYS setting"),
+        make_option("--chunk-size", action="store", type="int", dest="chunk_size", default=10000,
+                    help="Number of movements fetched (and deleted) by each query"),
+    )
+
+    def handle(self, *args, **options):
+        if not get_stock_backend().stores_stocks:
+            raise CommandError("Stocks are computed from movements by the %s stock backend" %
+                               get_stock_backend().__class__.__name__)
+
+        days = options["days"]
+        if days is None:
+            days = bazaar_settings.MOVEMENT_ARCHIVE_DAYS
+        if days < 1:
+            raise CommandError("The archive horizon must be at least one day")
+
+        chunk_size = options["chunk_size"]
+        horizon = timezone.now() - timedelta(days=days)
+
+        last_archive_date = get_last_archive_date()
+        if last_archive_date is not None:
+            # movements left by an interrupted run are already in the archive
+            self.delete_movements(None, last_archive_date, chunk_size)
+
+        if last_archive_date is not None and last_archive_date >= horizon:
+            self.stdout.write("Movements older than %s are already archived" % horizon)
+            return
+
+        with transaction.atomic():
+            ledger = StockLedger()
+            movements = Movement.objects.filter(date__lte=horizon)
+
+            if last_archive_date is not None:
+                ledger.load_snapshot(last_archive_date)
+                movements = movements.filter(date__gt=last_archive_date)
+
+            start = time.time()
+            rollups = {}
+            archived = 0
+            for chunk in iter_movements(movements, chunk_size=chunk_size):
+                ledger.apply_many(chunk)
+                self.add_to_rollups(rollups, chunk)
+                archived += len(chunk)
+
+                elapsed = time.time() - start
+                self.stdout.write("%d movements read (%d movements/s)" % (archived, archived / (elapsed or 1)))
+
+            StockSnapshot.objects.bulk_create([
+                StockSnapshot(product_id=product_id, location_id=location_id, date=horizon, quantity=quantity,
+                              unit_price=to_money(unit_price), archive=True)
+                for product_id, location_id, quantity, unit_price in ledger
+            ], batch_size=chunk_size)
+
+            self.save_rollups(rollups, chunk_size)
+
+        # the archive snapshot replaces the movements up to the horizon from now on
+        self.delete_movements(last_archive_date, horizon, chunk_size)
+
+        self.stdout.write("%d movements archived in %d rollups" % (archived, len(rollups)))
+
+    def delete_movements(self, since, until, chunk_size):
+        """
+        Deletes the movements dated after `since` (when given) up to `until`, by date ranges
+        of about `chunk_size` movements each committed on its own
+        """
+        while True:
+            movements = Movement.objects.filter(date__lte=until)
+            if since is not None:
+                movements = movements.filter(date__gt=since)
+
+            dates = list(movements.order_by("date").values_list("date", flat=True)[chunk_size - 1:chunk_size])
+            end = dates[0] if dates else until
+
+            with transaction.atomic():
+                movements.filter(date__lte=end).delete()
+
+            if end >= until:
+                break
+            since = end
+
+    def get_month(self, date):
+        if settings.USE_TZ:
+            date = timezone.localtime(date)
+        return date.date().replace(day=1)
+
+    def add_to_rollups(self, rollups, movements):
+        for movement_id, date, product_id, from_location_id, to_location_id, quantity, unit_price in movements:
+            key = (product_id, from_location_id, to_location_id, self.get_month(date))
+            total_quantity, total_value, count = rollups.get(key, (0, 0, 0))
+            rollups[key] = (total_quantity + quantity, total_value + quantity * unit_price, count + 1)
+
+    def save_rollups(self, rollups, chunk_size):
+        if not rollups:
+            return
+
+        # rollups of the first month could already contain movements archived before
+        first_month = min(key[3] for key in rollups)
+        existing = MovementRollup.objects.filter(month__gte=first_month)
+        for rollup in existing.filter(product__in=set(key[0] for key in rollups)):
+            key = (rollup.product_id, rollup.from_location_id, rollup.to_location_id, rollup.month)
+            if key in rollups:
+                quantity, value, count = rollups.pop(key)
+                MovementRollup.objects.filter(pk=rollup.pk).update(
+                    quantity=rollup.quantity + quantity, value=rollup.value + to_money(value),
+                    count=rollup.count + count)
+
+        MovementRollup.objects.bulk_create([
+            MovementRollup(product_id=product_id, from_location_id=from_location_id, to_location_id=to_location_id,
+                           month=month, quantity=quantity, value=to_money(value), count=count)
+            for (product_id, from_location_id, to_location_id, month), (quantity, value, count) in rollups.items()
+        ], batch_size=chunk_size)
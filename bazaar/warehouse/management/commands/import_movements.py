@@ -0,0 +1,115 @@
+from __future__ import division
+from __future__ import unicode_literals
+
+import csv
+import io
+import json
+import os
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import six
+from django.utils.encoding import force_bytes
+
+from ...importer import MovementImporter, read_csv, read_jsonl
+
+
+def open_csv(path, mode):
+    # the python 2 csv module works on bytes
+    if six.PY2:
+        return open(path, mode + "b")
+    return io.open(path, mode, newline="", encoding="utf-8")
+
+
+class Command(BaseCommand):
+    args = "<file>"
+    help = ("Import movements from a CSV or JSON lines file. Rows need ean or code, from_location, "
+            "to_location and quantity, unit_price, currency and note are optional.")
+
+    option_list = BaseCommand.option_list + (
+        make_option("--format", action="store", dest="format", default=None, choices=["csv", "jsonl"],
+                    help="File format, guessed from the file extension by default"),
+        make_option("--rejected", action="store", dest="rejected", default=None,
+                    help="File where rejected rows are written with the error, in the same format of the input"),
+        make_option("--agent", action="store", dest="agent", default="import",
+                    help="Agent saved in the imported movements"),
+        make_option("--chunk-size", action="store", type="int", dest="chunk_size", default=1000,
+                    help="Number of movements saved in a single transaction"),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: import_movements %s" % self.args)
+
+        path = args[0]
+        file_format = options["format"] or os.path.splitext(path)[1].lstrip(".").lower()
+        if file_format not in ("csv", "jsonl"):
+            raise CommandError("Unknown file format '%s', use --format" % file_format)
+
+        importer = MovementImporter(agent=options["agent"], chunk_size=options["chunk_size"])
+
+        rejected_file = None
+        rejected = None
+        if options["rejected"]:
+            if file_format == "csv":
+                rejected_file = open_csv(options["rejected"], "w")
+                rejected = self.get_csv_writer(rejected_file)
+            else:
+                rejected_file = io.open(options["rejected"], "w", encoding="utf-8")
+                rejected = self.get_jsonl_writer(rejected_file)
+
+        start = time.time()
+
+        def progress(imported, rejected_count):
+            elapsed = time.time() - start
+            rows_per_second = (imported + rejected_count) / (elapsed or 1)
+            self.stdout.write("%d rows imported, %d rejected (%d rows/s)" % (imported, rejected_count,
+                                                                             rows_per_second))
+
+        try:
+            if file_format == "csv":
+                with open_csv(path, "r") as stream:
+                    result = importer.import_rows(read_csv(stream), rejected=rejected, progress=progress)
+            else:
+                with io.open(path, "r", encoding="utf-8") as stream:
+                    result = importer.import_rows(read_jsonl(stream), rejected=rejected, progress=progress)
+        finally:
+            if rejected_file is not None:
+                rejected_file.close()
+
+        if result.rejected and rejected_file is None:
+            self.stderr.write("%d rows rejected, use --rejected to save them" % result.rejected)
+
+    def get_csv_writer(self, stream):
+        state = {}
+
+        def write(row, error):
+            if not isinstance(row, dict):
+                row = {"row": row}
+            row = dict(row, error=error)
+
+            if "writer" not in state:
+                # columns are the ones of the first rejected row
+                fieldnames = sorted(key for key in row if key != "error") + ["error"]
+                if six.PY2:
+                    fieldnames = [force_bytes(name) for name in fieldnames]
+                state["writer"] = csv.DictWriter(stream, fieldnames, extrasaction="ignore")
+                state["writer"].writeheader()
+
+            if six.PY2:
+                row = dict((force_bytes(key), force_bytes(value) if value is not None else None)
+                           for key, value in row.items())
+            state["writer"].writerow(row)
+
+        return write
+
+    def get_jsonl_writer(self, stream):
+        def write(row, error):
+            if isinstance(row, dict):
+                row = dict(row, error=error)
+            else:
+                row = {"row": row, "error": error}
+            stream.write("%s\n" % json.dumps(row, ensure_ascii=False))
+
+        return write
@@ -0,0 +1,20 @@
+from __future__ import unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from ...sales import rebuild_sales
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily sales from the movements to customer locations"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--chunk-size", action="store", type="int", dest="chunk_size", default=10000,
+                    help="Number of movements fetched by each query"),
+    )
+
+    def handle(self, *args, **options):
+        count = rebuild_sales(chunk_size=options["chunk_size"])
+        self.stdout.write("%d daily sales rebuilt" % count)
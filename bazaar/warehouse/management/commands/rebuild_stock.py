@@ -0,0 +1,174 @@
+from __future__ import division
+from __future__ import unicode_literals
+
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ....goods.models import CompositeProduct
+from ....utils import to_money
+from ...availability import invalidate_availability
+from ...backends import get_stock_backend
+from ...composites import update_composite_stocks
+from ...ledger import StockLedger, get_last_archive_date, get_ledger_movements, iter_movements
+from ...models import Location, Stock
+from ...summaries import update_storage_summaries
+
+
+class Command(BaseCommand):
+    help = "Recompute stocks replaying all the movements and report (or fix) the differences"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--fix", action="store_true", dest="fix", default=False,
+                    help="Write the recomputed values in the stock table"),
+        make_option("--chunk-size", action="store", type="int", dest="chunk_size", default=10000,
+                    help="Number of movements (and stocks) fetched by each query"),
+    )
+
+    def handle(self, *args, **options):
+        if not get_stock_backend().stores_stocks:
+            raise CommandError("Stocks are computed from movements by the %s stock backend" %
+                               get_stock_backend().__class__.__name__)
+
+        self.verbosity = int(options.get("verbosity", 1))
+        chunk_size = options["chunk_size"]
+
+        ledger = self.replay(chunk_size)
+        drifts = self.compare(ledger, chunk_size)
+
+        self.stdout.write("%d stocks differ from movements" % len(drifts))
+
+        if options["fix"] and drifts:
+            fixed = self.fix(drifts, chunk_size)
+            self.stdout.write("%d stocks fixed" % fixed)
+
+    def replay(self, chunk_size, product_ids=None, verbosity=None):
+        """
+        Returns the `StockLedger` of all the movements, or of the movements of `product_ids`
+        """
+        verbosity = self.verbosity if verbosity is None else verbosity
+        ledger = StockLedger()
+
+        # archived movements are replaced by the snapshot taken when archiving them
+        archive_date = get_last_archive_date()
+        if archive_date is not None:
+            ledger.load_snapshot(archive_date, product_ids)
+
+        movements = get_ledger_movements()
+        if product_ids is not None:
+            movements = movements.filter(product__in=product_ids)
+
+        start = time.time()
+        count = 0
+        for chunk in iter_movements(movements, chunk_size=chunk_size):
+            ledger.apply_many(chunk)
+            count += len(chunk)
+
+            if verbosity >= 1:
+                elapsed = time.time() - start
+                self.stdout.write("%d movements replayed (%d movements/s)" % (count, count / (elapsed or 1)))
+
+        return ledger
+
+    def compare(self, ledger, chunk_size):
+        """
+        Returns a list of (stock id, product id, location id, quantity, unit price) with the
+        right values for stocks differing from the ledger. Stock id is None for missing stocks.
+        """
+        # composite stocks are computed from their components, not from movements
+        composite_ids = set(CompositeProduct.objects.values_list("pk", flat=True))
+
+        expected = dict(((product_id, location_id), (quantity, unit_price))
+                        for product_id, location_id, quantity, unit_price in ledger
+                        if product_id not in composite_ids)
+
+        drifts = []
+        stocks = Stock.objects.order_by("pk").values_list("pk", "product_id", "location_id", "quantity", "unit_price")
+
+        last_pk = 0
+        while True:
+            chunk = list(stocks.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                break
+
+            for pk, product_id, location_id, quantity, unit_price in chunk:
+                if product_id in composite_ids:
+                    continue
+
+                right_quantity, right_unit_price = expected.pop((product_id, location_id), (0, unit_price))
+
+                if quantity != right_quantity or ledger.round(unit_price) != ledger.round(right_unit_price):
+                    self.report(product_id, location_id, quantity, unit_price, right_quantity, right_unit_price)
+                    drifts.append((pk, product_id, location_id, right_quantity, right_unit_price))
+
+            last_pk = chunk[-1][0]
+
+        for (product_id, location_id), (quantity, unit_price) in expected.items():
+            self.report(product_id, location_id, None, None, quantity, unit_price)
+            drifts.append((None, product_id, location_id, quantity, unit_price))
+
+        return drifts
+
+    def report(self, product_id, location_id, quantity, unit_price, right_quantity, right_unit_price):
+        if self.verbosity >= 2:
+            self.stdout.write("Stock of product %s in location %s: quantity %s (expected %s), "
+                              "unit price %s (expected %s)" % (product_id, location_id, quantity, right_quantity,
+                                                               unit_price, right_unit_price))
+
+    @transaction.atomic
+    def fix(self, drifts, chunk_size):
+        """
+        Writes the right values of the drifted stocks and returns the number of fixed ones.
+
+        Drifted stocks are locked like moving does, and their values are computed again under
+        the lock: movements done since the comparison are not overwritten, and movements
+        waiting for the lock are applied on the fixed values.
+        """
+        stocks = self.lock(drifts, chunk_size)
+        product_ids = sorted(set(product_id for product_id, location_id in stocks))
+
+        fixed = []
+        for i in range(0, len(product_ids), chunk_size):
+            chunk = set(product_ids[i:i + chunk_size])
+            ledger = self.replay(chunk_size, chunk, verbosity=0)
+
+            for key, stock in stocks.items():
+                if key[0] not in chunk:
+                    continue
+
+                quantity, unit_price = ledger.stocks.get(key, (0, stock.unit_price.amount))
+
+                if stock.quantity != quantity or ledger.round(stock.unit_price.amount) != ledger.round(unit_price):
+                    Stock.objects.filter(pk=stock.pk).update(quantity=quantity, unit_price=to_money(unit_price))
+                    fixed.append(key)
+
+        if fixed:
+            # stocks are written without sending the changed signals
+            fixed_product_ids = set(product_id for product_id, location_id in fixed)
+            update_storage_summaries(fixed_product_ids)
+            locations = Location.objects.filter(pk__in=set(location_id for product_id, location_id in fixed))
+            update_composite_stocks(fixed_product_ids, locations)
+            invalidate_availability(fixed_product_ids)
+
+        return len(fixed)
+
+    def lock(self, drifts, chunk_size):
+        """
+        Locks the drifted stocks in primary key order, creating the missing ones.
+        Returns a dict of the locked stocks by (product id, location id).
+        """
+        pks = sorted(pk for pk, product_id, location_id, quantity, unit_price in drifts if pk is not None)
+
+        stocks = {}
+        for i in range(0, len(pks), chunk_size):
+            for stock in Stock.objects.select_for_update().filter(pk__in=pks[i:i + chunk_size]).order_by("pk"):
+                stocks[(stock.product_id, stock.location_id)] = stock
+
+        for pk, product_id, location_id, quantity, unit_price in drifts:
+            if (product_id, location_id) not in stocks:
+                stocks[(product_id, location_id)] = Stock.objects.select_for_update().get_or_create(
+                    product_id=product_id, location_id=location_id, defaults={"unit_price": to_money(unit_price)})[0]
+
+        return stocks
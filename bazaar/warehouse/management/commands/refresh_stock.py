@@ -0,0 +1,25 @@
+from __future__ import division
+from __future__ import unicode_literals
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...backends import get_stock_backend
+from ...summaries import update_storage_summaries
+
+
+class Command(BaseCommand):
+    help = "Refresh stocks from movements, when the stock backend does not keep them in sync (run it on a schedule)"
+
+    def handle(self, *args, **options):
+        backend = get_stock_backend()
+
+        start = time.time()
+        backend.refresh()
+
+        self.stdout.write("Stocks refreshed by %s in %.3fs" % (backend.__class__.__name__, time.time() - start))
+
+        # summaries of stocks not kept in sync are stale as well
+        count = update_storage_summaries()
+        self.stdout.write("%d storage summaries updated" % count)
@@ -0,0 +1,13 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from ...reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = "Release the expired stock reservations (run it on a schedule)"
+
+    def handle(self, *args, **options):
+        count = release_expired()
+        self.stdout.write("%d expired reservations released" % count)
@@ -0,0 +1,41 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = "Save a snapshot of the current stocks, used to compute past stock quantities"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            cursor = connection.cursor()
+            lock_movements(cursor)
+
+            date = timezone.now()
+            # stocks and the highest movement id are read by the same statement, past
+            # quantities apply the movements after it even when they are dated before `date`
+            cursor.execute(
+                "INSERT INTO warehouse_stocksnapshot "
+                "(product_id, location_id, date, unit_price, unit_price_currency, quantity, archive, "
+                "last_movement_id) "
+                "SELECT product_id, location_id, %s, unit_price, unit_price_currency, quantity, %s, "
+                "(SELECT COALESCE(MAX(id), 0) FROM warehouse_movement) "
+                "FROM warehouse_stock WHERE quantity <> 0",
+                [connection.ops.value_to_db_datetime(date), False]
+            )
+
+        self.stdout.write("%d stocks saved in snapshot of %s" % (cursor.rowcount, date))
+
+
+def lock_movements(cursor):
+    """
+    Waits for the transactions inserting movements to commit, and blocks new ones until
+    the snapshot is committed: stocks then include every movement up to the highest id.
+    """
+    if connection.vendor == "postgresql":
+        # SHARE conflicts with the ROW EXCLUSIVE lock taken by INSERT, reads are not blocked
+        cursor.execute("LOCK TABLE warehouse_movement IN SHARE MODE")
+    # SQLite has a single writer, movements not committed yet get higher ids than the
+    # committed ones
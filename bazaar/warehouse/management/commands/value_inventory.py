@@ -0,0 +1,50 @@
+from __future__ import unicode_literals
+
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from ...valuation import value_inventory, ProductValuation
+
+
+def parse_end_of_day(value):
+    date = parse_date(value or "")
+    if date is None:
+        raise CommandError("Invalid date '%s', use YYYY-MM-DD" % value)
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time.max), timezone.get_current_timezone())
+
+
+class Command(BaseCommand):
+    help = ("Value the inventory (storage and output locations) with weighted average and FIFO costs, "
+            "writing a CSV line for every product")
+
+    option_list = BaseCommand.option_list + (
+        make_option("--start", action="store", dest="start", default=None,
+                    help="Opening date (YYYY-MM-DD), values are taken at the end of the day"),
+        make_option("--end", action="store", dest="end", default=None,
+                    help="Closing date (YYYY-MM-DD), values are taken at the end of the day, defaults to now"),
+        make_option("--processes", action="store", type="int", dest="processes", default=1,
+                    help="Number of processes valuing ranges of products in parallel"),
+        make_option("--range-size", action="store", type="int", dest="range_size", default=1000,
+                    help="Number of products valued by each process at a time"),
+    )
+
+    def handle(self, *args, **options):
+        start = parse_end_of_day(options["start"]) if options["start"] else None
+        end = parse_end_of_day(options["end"]) if options["end"] else timezone.now()
+        if start is not None and start > end:
+            raise CommandError("The opening date must precede the closing one")
+        if options["processes"] < 1:
+            raise CommandError("At least one process is needed")
+
+        self.stdout.write(",".join(ProductValuation._fields))
+
+        try:
+            for valuation in value_inventory(end, start=start, processes=options["processes"],
+                                             range_size=options["range_size"]):
+                self.stdout.write(",".join("%s" % value for value in valuation))
+        except ValueError as e:
+            raise CommandError(e)
@@ -8,6 +8,7 @@ from django.utils.translation import ugettext_lazy as _
 
 from ..fields import MoneyField
 from ..goods.models import Product
+from ..settings import bazaar_settings
 
 
 @python_2_unicode_compatible
@@ -52,7 +53,13 @@ class Movement(models.Model):
 
     class Meta:
         get_latest_by = "date"
-        ordering = ["-date"]
+        # time window queries on the movements of a product in a location (e.g. sales)
+        index_together = [
+            ("product", "to_location", "date"),
+            ("to_location", "date"),
+            # keyset pagination of the replays in date order (see `ledger.iter_movements`)
+            ("date", "id"),
+        ]
 
     @property
     def value(self):
@@ -63,20 +70,71 @@ class Movement(models.Model):
             self.product, self.from_location.slug, self.to_location.slug, self.quantity)
 
 
+@python_2_unicode_compatible
+class MovementRollup(models.Model):
+    """
+    Monthly totals of the archived movements of a product between two locations.
+    """
+    from_location = models.ForeignKey(Location, related_name="outgoing_rollups")
+    to_location = models.ForeignKey(Location, related_name="incoming_rollups")
+
+    month = models.DateField(help_text=_("First day of the month"))
+
+    product = models.ForeignKey(Product, related_name="movement_rollups")
+    quantity = models.DecimalField(max_digits=30, decimal_places=4)
+    value = MoneyField(help_text=_("Total value of the movements"))
+
+    count = models.PositiveIntegerField(default=0, help_text=_("Number of archived movements"))
+
+    class Meta:
+        unique_together = ('product', 'from_location', 'to_location', 'month')
+
+    def __str__(self):
+        return _("Movements '%s' from '%s' to '%s' in %s: %s") % (
+            self.product, self.from_location.slug, self.to_location.slug, self.month.strftime("%Y-%m"),
+            self.quantity)
+
+
+@python_2_unicode_compatible
+class DailySales(models.Model):
+    """
+    Quantity of a product moved to customer locations in a day less the quantity returned
+    from them, updated with the movements.
+    """
+    product = models.ForeignKey(Product, related_name="daily_sales")
+    date = models.DateField()
+    quantity = models.DecimalField(max_digits=30, decimal_places=4, default=0)
+
+    class Meta:
+        unique_together = ('product', 'date')
+        # sales of all the products in a time window
+        index_together = [('date', 'product')]
+
+    def __str__(self):
+        return _("Sales of '%s' on %s: %s") % (self.product, self.date, self.quantity)
+
+
+_stock_on_delete = models.CASCADE if bazaar_settings.STOCK_BACKEND.managed else models.DO_NOTHING
+
+
 @python_2_unicode_compatible
 class Stock(models.Model):
     """
     Denormalized stock data for a product in a location.
-    TODO: this could be a database view
+    It's a table or a database view, depending on the STOCK_BACKEND setting.
     """
-    product = models.ForeignKey(Product, related_name="stocks")
-    location = models.ForeignKey(Location, related_name="stocks")
+    # stock views cannot be deleted from, their rows go away with the movements
+    product = models.ForeignKey(Product, related_name="stocks", on_delete=_stock_on_delete)
+    location = models.ForeignKey(Location, related_name="stocks", on_delete=_stock_on_delete)
 
     unit_price = MoneyField(help_text=_("Average unit price"))
     quantity = models.DecimalField(max_digits=30, decimal_places=4, default=0)
+    reserved = models.DecimalField(max_digits=30, decimal_places=4, default=0,
+                                   help_text=_("Quantity held by pending reservations"))
 
     class Meta:
         unique_together = ('product', 'location')
+        managed = bazaar_settings.STOCK_BACKEND.managed
 
     @property
     def value(self):
@@ -85,6 +143,134 @@ class Stock(models.Model):
     def __str__(self):
         return _("Stock '%s' at '%s': %s") % (self.product, self.location.slug, self.value)
 
+
+@python_2_unicode_compatible
+class StorageSummary(models.Model):
+    """
+    Stock of a product in the storage, copied from `Stock` when it changes so that
+    product lists can be sorted by quantity and unit price joining a single indexed row.
+    """
+    product = models.OneToOneField(Product, primary_key=True, related_name="storage_summary")
+
+    quantity = models.DecimalField(max_digits=30, decimal_places=4, default=0, db_index=True)
+    unit_price = MoneyField(db_index=True, help_text=_("Average unit price"))
+
+    def __str__(self):
+        return _("Storage summary of '%s': %s") % (self.product, self.quantity)
+
+
+@python_2_unicode_compatible
+class CompositeStock(models.Model):
+    """
+    Stock data of composite products, used when `Stock` is a database view.
+    """
+    product = models.ForeignKey(Product, related_name="composite_stocks")
+    location = models.ForeignKey(Location, related_name="composite_stocks")
+
+    unit_price = MoneyField(help_text=_("Average unit price"))
+    quantity = models.DecimalField(max_digits=30, decimal_places=4, default=0)
+
+    class Meta:
+        unique_together = ('product', 'location')
+
+    @property
+    def value(self):
+        return self.quantity * self.unit_price
+
+    def __str__(self):
+        return _("Composite stock '%s' at '%s': %s") % (self.product, self.location.slug, self.value)
+
+
+@python_2_unicode_compatible
+class StockSnapshot(models.Model):
+    """
+    Copy of the stock data of a product in a location taken at `date`.
+    Past stocks are computed from the nearest snapshot applying the following movements:
+    the ones after `last_movement_id`, or after `date` for archive snapshots.
+    """
+    product = models.ForeignKey(Product, related_name="stock_snapshots")
+    location = models.ForeignKey(Location, related_name="stock_snapshots")
+
+    date = models.DateTimeField(db_index=True)
+
+    unit_price = MoneyField(help_text=_("Average unit price"))
+    quantity = models.DecimalField(max_digits=30, decimal_places=4, default=0)
+
+    archive = models.BooleanField(default=False, help_text=_("Computed from movements while archiving them"))
+    last_movement_id = models.PositiveIntegerField(
+        null=True, blank=True, help_text=_("Highest id of the movements included in the snapshot"))
+
+    class Meta:
+        get_latest_by = "date"
+        unique_together = ('product', 'location', 'date')
+
+    def __str__(self):
+        return _("Stock snapshot '%s' at '%s' on %s: %s") % (
+            self.product, self.location.slug, self.date, self.quantity)
+
+
+@python_2_unicode_compatible
+class Reservation(models.Model):
+    """
+    Quantity of a product held in a location until the reservation is committed, released
+    or expires. The held quantity is added to the `reserved` field of the stock.
+    """
+    RESERVATION_PENDING = 0
+    RESERVATION_COMMITTED = 1
+    RESERVATION_RELEASED = 2
+    RESERVATION_STATUS_CHOICES = (
+        (RESERVATION_PENDING, _("Pending")),
+        (RESERVATION_COMMITTED, _("Committed")),
+        (RESERVATION_RELEASED, _("Released")),
+    )
+
+    product = models.ForeignKey(Product, related_name="reservations")
+    location = models.ForeignKey(Location, related_name="reservations")
+    quantity = models.DecimalField(max_digits=30, decimal_places=4)
+
+    status = models.IntegerField(choices=RESERVATION_STATUS_CHOICES, default=RESERVATION_PENDING)
+    reference = models.CharField(max_length=256, blank=True, help_text=_("The order holding the reservation"))
+
+    date = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField()
+
+    class Meta:
+        index_together = [('status', 'expires')]
+
+    def is_pending(self):
+        return self.status == self.RESERVATION_PENDING
+
+    def __str__(self):
+        return _("Reservation of %s '%s' at '%s'") % (self.quantity, self.product, self.location.slug)
+
+
+@python_2_unicode_compatible
+class StockEvent(models.Model):
+    """
+    Outbox of the stock changes. Events are written in the same transaction of the stock
+    update and drained by the `drain_stock_events` command.
+    """
+    product = models.ForeignKey(Product, related_name="stock_events")
+    location_type = models.IntegerField(choices=Location.LOCATION_TYPE_CHOICES)
+
+    date = models.DateTimeField(auto_now_add=True)
+
+    pending_consumers = models.TextField(
+        null=True, blank=True, help_text=_("Names of the consumers that failed the event, one per line"))
+    attempts = models.PositiveIntegerField(default=0, help_text=_("Number of failed deliveries"))
+    retry_after = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return _("Stock of '%s' changed in %s locations") % (self.product, self.get_location_type_display())
+
+    def is_pending_for(self, consumer_name):
+        """
+        Returns whether the event must be passed to the consumer named `consumer_name`,
+        new events are passed to all the consumers
+        """
+        return self.pending_consumers is None or consumer_name in self.pending_consumers.split("\n")
+
+
 if django.VERSION < (1, 7):
     # import stock module to attach handlers to signals
     from . import stocks  # noqa
@@ -0,0 +1,112 @@
+"""
+This module drains the stock events outbox, passing the events to the consumers
+(usually the store strategies) outside of the requests that changed the stocks.
+
+A consumer failing a batch does not hold back the others: the events are kept for the
+failed consumers only and retried after a delay doubling at every attempt, while the
+following events are drained. Events failing `max_attempts` times are dropped for
+those consumers and logged.
+"""
+
+from __future__ import unicode_literals
+
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ..goods.models import Product
+from .models import StockEvent
+
+
+logger = logging.getLogger(__name__)
+
+# number of deliveries of an event to a failing consumer before dropping it
+MAX_ATTEMPTS = 5
+
+# seconds before the first retry of a failed batch
+RETRY_DELAY = 60
+
+
+class StockEventConsumer(object):
+    """
+    Interface of the stock events consumers
+    """
+
+    def get_consumer_name(self):
+        """
+        Returns the name identifying the consumer in the outbox, unique among the consumers
+        """
+        return "%s.%s" % (self.__class__.__module__, self.__class__.__name__)
+
+    def consume_stock_events(self, events):
+        """
+        Handles a batch of `StockEvent`, ordered by creation. Raising an exception keeps
+        the events in the outbox, so that they will be passed again to this consumer only.
+        """
+        raise NotImplementedError("Stock events consumers must implement consume_stock_events")
+
+
+def drain(consumers, batch_size=500, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY):
+    """
+    Passes the pending stock events to every consumer in batches of `batch_size` events,
+    deleting the events once consumed by all of them. Errors of the consumers are logged
+    and the failed events retried later (see the module documentation).
+    Returns the number of drained events.
+    """
+    names = [consumer.get_consumer_name() for consumer in consumers]
+
+    count = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            now = timezone.now()
+            # concurrent drains wait for the batch to be consumed instead of reading it twice
+            events = StockEvent.objects.select_for_update().filter(
+                Q(retry_after__isnull=True) | Q(retry_after__lte=now), pk__gt=last_pk)
+            events = list(events.order_by("pk")[:batch_size])
+            if not events:
+                break
+
+            # failed events are not read again by this drain
+            last_pk = events[-1].pk
+
+            products = Product.objects.in_bulk(set(event.product_id for event in events))
+            for event in events:
+                event.product = products[event.product_id]
+
+            failed = set()
+            for consumer, name in zip(consumers, names):
+                pending = [event for event in events if event.is_pending_for(name)]
+                if not pending:
+                    continue
+
+                try:
+                    # changes of the failed consumer are rolled back, not the ones of the others
+                    with transaction.atomic():
+                        consumer.consume_stock_events(pending)
+                except Exception:
+                    logger.exception("Stock events consumer %s failed %d events", name, len(pending))
+                    failed.add(name)
+
+            drained = []
+            for event in events:
+                retried = [name for name in names if name in failed and event.is_pending_for(name)]
+                if retried and event.attempts + 1 >= max_attempts:
+                    logger.error("Stock event %s dropped for %s after %d attempts", event.pk, ", ".join(retried),
+                                 event.attempts + 1)
+                elif retried:
+                    event.pending_consumers = "\n".join(retried)
+                    event.attempts += 1
+                    event.retry_after = now + timedelta(seconds=retry_delay * 2 ** (event.attempts - 1))
+                    event.save(update_fields=["pending_consumers", "attempts", "retry_after"])
+                    continue
+                drained.append(event.pk)
+
+            StockEvent.objects.filter(pk__in=drained).delete()
+
+        count += len(drained)
+
+    return count
@@ -0,0 +1,141 @@
+"""
+Stock reservations hold a quantity of a product in a location, so that concurrent
+orders of the same product cannot sell more than the stock.
+
+A reservation is taken with a single conditional UPDATE of the stock, which only
+succeeds when the quantity not already reserved is enough: concurrent reservations
+of the same stock are serialized by the database row lock, without reading the
+stock first. Reservations are then committed, moving the product out of the location,
+or released. Movements cannot take reserved units out of a location, they raise
+`ReservedStockException` instead. Pending reservations expire after the
+RESERVATION_TIMEOUT setting (seconds), expired ones are released by `release_expired`.
+
+Reservations need a stock backend storing stocks (see bazaar.warehouse.backends).
+"""
+
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from ..settings import bazaar_settings
+from .api import move
+from .availability import invalidate_availability
+from .backends import get_stock_backend
+from .dispatch import coalesce_changed_signals
+from .exceptions import ReservationException, InsufficientStockException
+from .models import Reservation, Stock
+
+
+def _hold(product, location, quantity):
+    # the stock row is locked by the update, the condition is evaluated on the last committed quantities
+    cursor = connection.cursor()
+    cursor.execute(
+        "UPDATE {} SET reserved = reserved + %s "
+        "WHERE product_id = %s AND location_id = %s AND quantity - reserved >= %s".format(Stock._meta.db_table),
+        [quantity, product.pk, location.pk, quantity])
+    held = cursor.rowcount == 1
+    if held:
+        invalidate_availability([product])
+    return held
+
+
+def _unhold(reservation):
+    Stock.objects.filter(product=reservation.product_id, location=reservation.location_id).update(
+        reserved=F("reserved") - reservation.quantity)
+    invalidate_availability([reservation.product_id])
+
+
+def _close(reservation, status):
+    # only one of concurrent commits and releases of the same reservation succeeds
+    closed = Reservation.objects.filter(pk=reservation.pk, status=Reservation.RESERVATION_PENDING).update(
+        status=status) == 1
+    if closed:
+        reservation.status = status
+    return closed
+
+
+@transaction.atomic
+def _reserve(product, location, quantity, timeout, reference):
+    if not _hold(product, location, quantity):
+        raise InsufficientStockException("Not enough stock of %s in %s to reserve %s" % (
+            product, location.slug, quantity))
+
+    return Reservation.objects.create(product=product, location=location, quantity=quantity,
+                                      reference=reference, expires=timezone.now() + timedelta(seconds=timeout))
+
+
+def reserve(product, quantity=1, location=None, timeout=None, reference=""):
+    """
+    Holds `quantity` of `product` in `location` (the storage by default) for `timeout` seconds.
+    Returns the `Reservation`, raises `InsufficientStockException` when the stock is not enough.
+    """
+    from .locations import get_storage
+
+    if not get_stock_backend().stores_stocks:
+        raise ImproperlyConfigured("Reservations require a stock backend storing stocks")
+    if quantity <= 0:
+        raise ReservationException("Quantity must be a positive amount")
+    if hasattr(product, "compositeproduct"):
+        raise ReservationException("Composite products are reserved through their components")
+
+    location = location or get_storage()
+    timeout = timeout if timeout is not None else bazaar_settings.RESERVATION_TIMEOUT
+
+    try:
+        return _reserve(product, location, quantity, timeout, reference)
+    except InsufficientStockException:
+        # expired reservations could be holding the stock
+        if not release_expired(product=product, location=location):
+            raise
+        return _reserve(product, location, quantity, timeout, reference)
+
+
+@coalesce_changed_signals()
+@transaction.atomic
+def commit(reservation, to_location=None, agent=None, note=None):
+    """
+    Moves the reserved quantity to `to_location` (the customer by default), at the
+    stock unit price. Expired reservations can be committed until they are released.
+    """
+    from .locations import get_customer
+
+    if not _close(reservation, Reservation.RESERVATION_COMMITTED):
+        raise ReservationException("Only pending reservations can be committed")
+
+    _unhold(reservation)
+
+    stock = Stock.objects.get(product=reservation.product_id, location=reservation.location_id)
+    move(reservation.location, to_location or get_customer(), reservation.product, reservation.quantity,
+         stock.unit_price, agent=agent or "reservation", note=note or reservation.reference)
+
+
+@transaction.atomic
+def release(reservation):
+    """
+    Gives back the reserved quantity. Returns False when the reservation was not pending.
+    """
+    if not _close(reservation, Reservation.RESERVATION_RELEASED):
+        return False
+
+    _unhold(reservation)
+    return True
+
+
+def release_expired(product=None, location=None, now=None):
+    """
+    Releases the expired pending reservations, of `product` in `location` when given.
+    Returns the number of released reservations.
+    """
+    reservations = Reservation.objects.filter(status=Reservation.RESERVATION_PENDING,
+                                              expires__lte=now or timezone.now())
+    if product is not None:
+        reservations = reservations.filter(product=product)
+    if location is not None:
+        reservations = reservations.filter(location=location)
+
+    return sum(1 for reservation in reservations if release(reservation))
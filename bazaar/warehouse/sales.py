@@ -0,0 +1,138 @@
+"""
+Daily sales are the quantities of the products moved to customer locations every day,
+less the quantities returned from customer locations. They are stored in `DailySales`
+and updated by `move` and `move_many`, so that the sales in a time window (see
+`ProductsQuerySet.with_sales_velocity`) read one row per product and day instead of
+all the movements.
+
+Days are in the current time zone. The `rebuild_sales` command computes the table from
+the movements, run it after importing movements with other means.
+"""
+
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .ledger import get_last_archive_date, iter_movements
+from .models import DailySales, Location, Movement
+
+
+def get_sales_day(date):
+    if settings.USE_TZ:
+        date = timezone.localtime(date)
+    return date.date()
+
+
+def get_customer_ids(location_ids):
+    return set(Location.objects.filter(pk__in=location_ids, type=Location.LOCATION_CUSTOMER)
+               .values_list("pk", flat=True))
+
+
+def get_sold_quantity(from_location_id, to_location_id, quantity, customer_ids):
+    """
+    Returns the quantity sold by a movement, negative for returns from customer locations
+    """
+    sold = 0
+    if to_location_id in customer_ids:
+        sold += quantity
+    if from_location_id in customer_ids:
+        sold -= quantity
+    return sold
+
+
+def record_sales(movements):
+    """
+    Adds the saved `movements` to and from customer locations to the daily sales
+    """
+    location_ids = set(movement.to_location_id for movement in movements)
+    location_ids.update(movement.from_location_id for movement in movements)
+    customer_ids = get_customer_ids(location_ids)
+    if not customer_ids:
+        return
+
+    sales = defaultdict(int)
+    for movement in movements:
+        sold = get_sold_quantity(movement.from_location_id, movement.to_location_id, movement.quantity,
+                                 customer_ids)
+        if sold:
+            sales[(movement.product_id, get_sales_day(movement.date))] += sold
+
+    add_sales(sales)
+
+
+def _increment(product_id, day, quantity):
+    return DailySales.objects.filter(product=product_id, date=day).update(quantity=F("quantity") + quantity)
+
+
+@transaction.atomic
+def add_sales(sales):
+    """
+    Adds quantities to the daily sales, `sales` maps (product id, day) pairs to quantities,
+    negative for returns
+    """
+    days = set(day for product_id, day in sales)
+    existing = set(DailySales.objects.filter(product__in=set(product_id for product_id, day in sales),
+                                             date__in=days).values_list("product_id", "date"))
+
+    # rows are updated in the same order to prevent deadlocks between concurrent movements
+    missing = []
+    for key in sorted(sales):
+        if key in existing:
+            _increment(key[0], key[1], sales[key])
+        else:
+            missing.append(key)
+
+    try:
+        with transaction.atomic():
+            DailySales.objects.bulk_create([
+                DailySales(product_id=product_id, date=day, quantity=sales[(product_id, day)])
+                for product_id, day in missing
+            ])
+    except IntegrityError:
+        # rows created by concurrent movements in the meantime
+        for product_id, day in missing:
+            if not _increment(product_id, day, sales[(product_id, day)]):
+                DailySales.objects.create(product_id=product_id, date=day, quantity=sales[(product_id, day)])
+
+
+@transaction.atomic
+def rebuild_sales(chunk_size=10000):
+    """
+    Recomputes the daily sales from the movements. Archived movements are gone, so the days
+    up to the last archive are kept. Returns the number of daily sales written.
+    """
+    customer = Location.LOCATION_CUSTOMER
+    customer_ids = set(Location.objects.filter(type=customer).values_list("pk", flat=True))
+    movements = Movement.objects.filter(Q(to_location__type=customer) | Q(from_location__type=customer))
+    stale = DailySales.objects.all()
+
+    first_day = None
+    archive_date = get_last_archive_date()
+    if archive_date is not None:
+        # the day of the archive is partly archived as well
+        first_day = get_sales_day(archive_date) + timedelta(days=1)
+        movements = movements.filter(date__gt=archive_date)
+        stale = stale.filter(date__gte=first_day)
+
+    sales = defaultdict(int)
+    fields = ("id", "date", "product_id", "from_location_id", "to_location_id", "quantity")
+    for chunk in iter_movements(movements, chunk_size=chunk_size, fields=fields):
+        for movement_id, date, product_id, from_location_id, to_location_id, quantity in chunk:
+            day = get_sales_day(date)
+            sold = get_sold_quantity(from_location_id, to_location_id, quantity, customer_ids)
+            if sold and (first_day is None or day >= first_day):
+                sales[(product_id, day)] += sold
+
+    stale.delete()
+    DailySales.objects.bulk_create([
+        DailySales(product_id=product_id, date=day, quantity=quantity)
+        for (product_id, day), quantity in sales.items()
+    ], batch_size=chunk_size)
+
+    return len(sales)
@@ -9,9 +9,14 @@ from __future__ import unicode_literals
 import logging
 import warnings
 
+from django.db import transaction
 from django.dispatch import receiver
 
-from .models import Stock, Location
+from ..compat import post_migrate
+from ..settings import bazaar_settings
+from .backends import get_stock_backend
+from .dispatch import send_changed
+from .models import Stock, StockEvent, Location
 from .signals import (incoming_movement, outgoing_movement, lost_and_found_changed, unknown_changed,
                       supplier_changed, storage_changed, output_changed, customer_changed)
 
@@ -20,47 +25,115 @@ logger = logging.getLogger(__name__)
 
 
 @receiver(incoming_movement)
+@transaction.atomic
 def update_stock_on_incoming(sender, movement, **kwargs):
-    stock, created = Stock.objects.get_or_create(location=sender, product=movement.product)
+    if not get_stock_backend().stores_stocks:
+        _send_computed_location(sender, movement.product)
+        return
 
-    # new stock quantity
-    quantity = stock.quantity + movement.quantity
-
-    # update average unit price
-    divider = quantity if quantity else 1
-
-    avg_unit_price = (stock.value + movement.value) / divider
+    stock = get_locked_stock(sender, movement.product)
 
-    stock.quantity = quantity
-    stock.unit_price = avg_unit_price
+    stock.quantity, stock.unit_price = compute_incoming(
+        stock.quantity, stock.unit_price, movement.quantity, movement.unit_price)
     stock.save()
 
     _send_changed_location(stock)
 
 
 @receiver(outgoing_movement)
+@transaction.atomic
 def update_stock_on_outgoing(sender, movement, **kwargs):
-    stock, created = Stock.objects.get_or_create(location=sender, product=movement.product)
+    if not get_stock_backend().stores_stocks:
+        _send_computed_location(sender, movement.product)
+        return
 
-    stock.quantity = stock.quantity - movement.quantity
+    stock = get_locked_stock(sender, movement.product)
+
+    stock.quantity = compute_outgoing(stock.quantity, movement.quantity)
     stock.save()
 
     _send_changed_location(stock)
 
 
+@receiver(post_migrate)
+def install_stock_backend(sender, **kwargs):
+    # the stock view reads warehouse tables, install it once they exist
+    if getattr(sender, "label", None) == "warehouse":
+        get_stock_backend().install()
+
+
+def _send_computed_location(location, product):
+    # stocks are computed by the database, a materialized view could not contain the stock yet
+    stock = Stock.objects.filter(location=location, product=product).first()
+    if stock is not None:
+        _send_changed_location(stock)
+
+
+def get_locked_stock(location, product):
+    """
+    Returns the stock of `product` in `location`, creating it when missing.
+    The stock row is locked until the end of the current transaction so that
+    concurrent movements cannot overwrite each other updates.
+    """
+    stock = Stock.objects.select_for_update().get_or_create(location=location, product=product)[0]
+    # receivers of the location changed signals get the moved instance
+    stock.product = product
+    return stock
+
+
+def lock_stocks(product, locations):
+    """
+    Locks the stocks of `product` in all the given `locations`. Stocks are always
+    locked in the same order to prevent deadlocks between concurrent movements.
+    """
+    if not get_stock_backend().stores_stocks:
+        # stocks computed from movements have no rows to lock
+        return []
+    return [get_locked_stock(location, product) for location in sorted(locations, key=lambda location: location.pk)]
+
+
+def compute_incoming(quantity, unit_price, movement_quantity, movement_unit_price):
+    """
+    Returns the new (quantity, unit_price) of a stock receiving `movement_quantity` units
+    at `movement_unit_price`. The unit price is the average weighted on quantities.
+    """
+    # new stock quantity
+    new_quantity = quantity + movement_quantity
+
+    # update average unit price
+    divider = new_quantity if new_quantity else 1
+
+    avg_unit_price = (quantity * unit_price + movement_quantity * movement_unit_price) / divider
+
+    return new_quantity, avg_unit_price
+
+
+def compute_outgoing(quantity, movement_quantity):
+    """
+    Returns the new quantity of a stock losing `movement_quantity` units.
+    Outgoing movements do not change the average unit price.
+    """
+    return quantity - movement_quantity
+
+
 def _send_changed_location(stock):
-    if stock.location.type == Location.LOCATION_LOST_AND_FOUND:
+    if send_changed(_get_changed_signal(stock.location.type), stock) and bazaar_settings.STOCK_OUTBOX:
+        StockEvent.objects.create(product_id=stock.product_id, location_type=stock.location.type)
+
+
+def _get_changed_signal(location_type):
+    if location_type == Location.LOCATION_LOST_AND_FOUND:
         signal = lost_and_found_changed
-    elif stock.location.type == Location.LOCATION_SUPPLIER:
+    elif location_type == Location.LOCATION_SUPPLIER:
         signal = supplier_changed
-    elif stock.location.type == Location.LOCATION_STORAGE:
+    elif location_type == Location.LOCATION_STORAGE:
         signal = storage_changed
-    elif stock.location.type == Location.LOCATION_OUTPUT:
+    elif location_type == Location.LOCATION_OUTPUT:
         signal = output_changed
-    elif stock.location.type == Location.LOCATION_CUSTOMER:
+    elif location_type == Location.LOCATION_CUSTOMER:
         signal = customer_changed
     else:
-        warnings.warn("Unknown location type '%s' has changed" % stock.location.type)
+        warnings.warn("Unknown location type '%s' has changed" % location_type)
         signal = unknown_changed
 
-    signal.send(sender=stock, product=stock.product)
+    return signal
@@ -0,0 +1,123 @@
+"""
+Storage summaries copy the stock of every product in the storage into `StorageSummary`,
+so that product lists sorted by stock quantity or unit price join one indexed row per
+product instead of aggregating the stocks of every product.
+
+Summaries are updated by the storage changed signals, copying the stock sent with them,
+and for all the products by the `refresh_stock` command. Signals sent inside a
+`defer_summary_updates` block (like the ones buffered by `coalesce_changed_signals`)
+update all their summaries at once.
+
+Stock backends not storing stocks (see `bazaar.warehouse.backends`) don't send the
+changed stock with the signals, a materialized view could be stale or miss it entirely,
+so their summaries are only updated by `refresh_stock`, and they are as stale as the view.
+"""
+
+from __future__ import unicode_literals
+
+from django.db import IntegrityError, transaction
+from django.dispatch import receiver
+
+from ..settings import bazaar_settings
+from ..utils import to_money
+from .backends import get_stock_backend
+from .dispatch import Deferred
+from .locations import get_storage
+from .models import Stock, StorageSummary
+from .signals import storage_changed
+
+
+# maximum number of products updated by a single query
+CHUNK_SIZE = 500
+
+
+def update_storage_summaries(product_ids=None, chunk_size=CHUNK_SIZE):
+    """
+    Copies the stocks in the storage of the given products (all of them by default) into
+    their storage summaries. Returns the number of changed summaries.
+    """
+    from ..goods.models import Product
+
+    if product_ids is None:
+        product_ids = Product.objects.values_list("pk", flat=True)
+    product_ids = sorted(set(product_ids))
+
+    storage = get_storage()
+    return sum(_update_summaries(product_ids[i:i + chunk_size], storage)
+               for i in range(0, len(product_ids), chunk_size))
+
+
+@transaction.atomic
+def _update_summaries(product_ids, storage):
+    stocks = dict((product_id, (quantity, unit_price)) for product_id, quantity, unit_price in
+                  Stock.objects.filter(product__in=product_ids, location=storage)
+                  .values_list("product_id", "quantity", "unit_price"))
+    summaries = dict((product_id, (quantity, unit_price)) for product_id, quantity, unit_price in
+                     StorageSummary.objects.filter(product__in=product_ids)
+                     .values_list("product_id", "quantity", "unit_price"))
+
+    stale = [product_id for product_id in summaries if product_id not in stocks]
+    if stale:
+        StorageSummary.objects.filter(product__in=stale).delete()
+
+    new_summaries = []
+    changed = 0
+    for product_id, (quantity, unit_price) in sorted(stocks.items()):
+        if product_id not in summaries:
+            new_summaries.append(StorageSummary(product_id=product_id, quantity=quantity,
+                                                unit_price=to_money(unit_price)))
+        elif summaries[product_id] != (quantity, unit_price):
+            _save_summary(product_id, quantity, unit_price)
+            changed += 1
+
+    _create_summaries(new_summaries)
+    return len(stale) + len(new_summaries) + changed
+
+
+def save_storage_summaries(stocks):
+    """
+    Writes the storage summaries of `stocks`, a dict mapping product ids to their
+    (quantity, unit price amount) in the storage
+    """
+    _create_summaries([StorageSummary(product_id=product_id, quantity=quantity, unit_price=to_money(unit_price))
+                       for product_id, (quantity, unit_price) in sorted(stocks.items())
+                       if not _save_summary(product_id, quantity, unit_price)])
+
+
+def _create_summaries(new_summaries):
+    if not new_summaries:
+        return
+
+    try:
+        with transaction.atomic():
+            StorageSummary.objects.bulk_create(new_summaries)
+    except IntegrityError:
+        # summaries created by concurrent updates in the meantime
+        for summary in new_summaries:
+            if not _save_summary(summary.product_id, summary.quantity, summary.unit_price.amount):
+                summary.save()
+
+
+def _save_summary(product_id, quantity, unit_price):
+    return StorageSummary.objects.filter(product=product_id).update(quantity=quantity,
+                                                                    unit_price=to_money(unit_price))
+
+
+# storage stocks collected by `defer_summary_updates`, indexed by product id
+_summaries = Deferred(save_storage_summaries)
+
+
+def defer_summary_updates():
+    """
+    Returns a context manager (or decorator) deferring the summary updates of the products
+    whose storage changes inside it, so that they are written together when the outermost
+    block exits.
+    """
+    return _summaries.block()
+
+
+@receiver(storage_changed)
+def update_storage_summary_on_storage_change(sender, product, **kwargs):
+    # only the well known storage is summarized, stocks of view backends are not sent
+    if get_stock_backend().stores_stocks and sender.location.slug == bazaar_settings.STORAGE:
+        _summaries.add(sender.product_id, (sender.quantity, to_money(sender.unit_price).amount))
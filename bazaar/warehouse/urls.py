@@ -1,8 +1,10 @@
 from django.conf.urls import patterns, url
 
-from .views import MovementFormView
+from .views import MovementFormView, MovementExportView, StockExportView
 
 urlpatterns = patterns(
     '',
     url(r'^movements/in/$', MovementFormView.as_view(), name="movement"),
+    url(r'^movements/export\.(?P<format>csv|jsonl)$', MovementExportView.as_view(), name="movement-export"),
+    url(r'^stocks/export\.(?P<format>csv|jsonl)$', StockExportView.as_view(), name="stock-export"),
 )
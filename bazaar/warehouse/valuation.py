@@ -0,0 +1,268 @@
+"""
+This module values the inventory, the stock held in storage and output locations,
+with two cost methods:
+
+weighted average
+    every incoming unit updates the average unit cost, outgoing units leave at the
+    average cost (the method of `Stock.unit_price`, applied to all the valued locations).
+
+FIFO
+    incoming units form cost layers, outgoing units consume the oldest layers first.
+
+Movements between two valued locations do not change the inventory. Movements are
+streamed in date order for a range of products at a time, so memory depends on the
+size of the range and not on the number of movements, and ranges can be valued in
+parallel by a process pool.
+
+Archived movements are replaced by the last archive snapshot, whose stocks enter the
+inventory as a single layer at their average unit price.
+"""
+
+from __future__ import unicode_literals
+
+from collections import deque, namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+from multiprocessing import Pool
+
+from django.db import connection
+
+from .ledger import get_last_archive_date, get_ledger_movements, iter_movements
+from .models import Location, Stock, StockSnapshot
+from .stocks import compute_incoming, compute_outgoing
+
+
+VALUED_LOCATION_TYPES = (Location.LOCATION_STORAGE, Location.LOCATION_OUTPUT)
+
+ProductValuation = namedtuple("ProductValuation", [
+    "product_id",
+    "opening_quantity", "opening_average_value", "opening_fifo_value",
+    "quantity", "average_value", "fifo_value",
+])
+
+
+class AverageCost(object):
+    """
+    Quantity and weighted average unit cost of a product
+    """
+
+    def __init__(self):
+        self.quantity = Decimal(0)
+        self.unit_price = Decimal(0)
+
+    def add(self, quantity, unit_price):
+        self.quantity, self.unit_price = compute_incoming(self.quantity, self.unit_price, quantity, unit_price)
+
+    def remove(self, quantity):
+        self.quantity = compute_outgoing(self.quantity, quantity)
+
+    @property
+    def value(self):
+        return self.quantity * self.unit_price
+
+
+class FifoCost(object):
+    """
+    Cost layers of a product, oldest first. Units going out of an empty inventory are
+    kept as a deficit, covered by the next incoming units.
+    """
+
+    def __init__(self):
+        self.layers = deque()
+        self.deficit = Decimal(0)
+        self.last_unit_price = Decimal(0)
+
+    def add(self, quantity, unit_price):
+        covered = min(quantity, self.deficit)
+        self.deficit -= covered
+        quantity -= covered
+
+        if quantity > 0:
+            self.layers.append([quantity, unit_price])
+        self.last_unit_price = unit_price
+
+    def remove(self, quantity):
+        while quantity > 0 and self.layers:
+            layer = self.layers[0]
+            consumed = min(quantity, layer[0])
+            layer[0] -= consumed
+            quantity -= consumed
+            self.last_unit_price = layer[1]
+            if not layer[0]:
+                self.layers.popleft()
+
+        self.deficit += quantity
+
+    @property
+    def quantity(self):
+        return sum(quantity for quantity, unit_price in self.layers) - self.deficit
+
+    @property
+    def value(self):
+        value = sum(quantity * unit_price for quantity, unit_price in self.layers)
+        # missing units are valued at the last known cost
+        return value - self.deficit * self.last_unit_price
+
+
+class InventoryValuation(object):
+    """
+    Average and FIFO costs of products, computed applying movements in date order
+    """
+
+    def __init__(self, location_ids, decimal_places=None):
+        if decimal_places is None:
+            decimal_places = Stock._meta.get_field("unit_price").decimal_places
+
+        self.exponent = Decimal(1).scaleb(-decimal_places)
+        self.location_ids = set(location_ids)
+        self.costs = {}
+        self.opening = {}
+
+    def get_costs(self, product_id):
+        try:
+            return self.costs[product_id]
+        except KeyError:
+            costs = self.costs[product_id] = (AverageCost(), FifoCost())
+            return costs
+
+    def add(self, product_id, quantity, unit_price):
+        for cost in self.get_costs(product_id):
+            cost.add(quantity, unit_price)
+
+    def remove(self, product_id, quantity):
+        for cost in self.get_costs(product_id):
+            cost.remove(quantity)
+
+    def load_snapshot(self, date, first_id=None, last_id=None):
+        """
+        Adds the valued stocks saved in the snapshot taken at `date`, of the products
+        with ids between `first_id` and `last_id` when given
+        """
+        snapshots = StockSnapshot.objects.filter(date=date, location__in=self.location_ids)
+        if first_id is not None:
+            snapshots = snapshots.filter(product__gte=first_id, product__lte=last_id)
+
+        for product_id, quantity, unit_price in snapshots.values_list("product_id", "quantity", "unit_price"):
+            if quantity > 0:
+                self.add(product_id, quantity, unit_price)
+            elif quantity < 0:
+                self.remove(product_id, -quantity)
+
+    def apply_many(self, movements):
+        for movement_id, date, product_id, from_location_id, to_location_id, quantity, unit_price in movements:
+            incoming = to_location_id in self.location_ids
+            outgoing = from_location_id in self.location_ids
+
+            if incoming and not outgoing:
+                self.add(product_id, quantity, unit_price)
+            elif outgoing and not incoming:
+                self.remove(product_id, quantity)
+
+    def close_opening(self):
+        """
+        Keeps the current costs as the opening ones of the valued period
+        """
+        self.opening = dict((product_id, self.get_values(product_id)) for product_id in self.costs)
+
+    def get_values(self, product_id):
+        average, fifo = self.get_costs(product_id)
+        return average.quantity, self.round(average.value), self.round(fifo.value)
+
+    def round(self, value):
+        return Decimal(value).quantize(self.exponent, rounding=ROUND_HALF_UP)
+
+    def __iter__(self):
+        zero = (Decimal(0), self.round(0), self.round(0))
+        for product_id in sorted(self.costs):
+            yield ProductValuation(product_id, *(self.opening.get(product_id, zero) + self.get_values(product_id)))
+
+
+def get_valued_locations(location_types=VALUED_LOCATION_TYPES):
+    return list(Location.objects.filter(type__in=location_types).values_list("pk", flat=True))
+
+
+def value_products(first_id, last_id, end, start=None, location_types=VALUED_LOCATION_TYPES, chunk_size=10000):
+    """
+    Returns the list of the `ProductValuation` of the products with ids between `first_id`
+    and `last_id`, at `start` (opening) and `end` (closing)
+    """
+    location_ids = get_valued_locations(location_types)
+    valuation = InventoryValuation(location_ids)
+
+    archive_date = get_last_archive_date()
+    if archive_date is not None:
+        if archive_date > end or (start is not None and archive_date > start):
+            raise ValueError("Movements until %s have been archived" % archive_date)
+        valuation.load_snapshot(archive_date, first_id, last_id)
+
+    movements = get_ledger_movements().filter(product__gte=first_id, product__lte=last_id, date__lte=end)
+
+    opened = start is None
+    for chunk in iter_movements(movements, chunk_size=chunk_size):
+        if not opened and chunk[-1][1] > start:
+            # the opening costs are the ones after the last movement until start
+            valuation.apply_many(movement for movement in chunk if movement[1] <= start)
+            valuation.close_opening()
+            valuation.apply_many(movement for movement in chunk if movement[1] > start)
+            opened = True
+        else:
+            valuation.apply_many(chunk)
+
+    if not opened:
+        valuation.close_opening()
+
+    return list(valuation)
+
+
+def get_product_ranges(size):
+    """
+    Yields (first id, last id) of consecutive ranges of `size` products
+    """
+    from ..goods.models import Product
+
+    first_id = last_id = None
+    count = 0
+    for product_id in Product.objects.order_by("pk").values_list("pk", flat=True).iterator():
+        if first_id is None:
+            first_id = product_id
+        last_id = product_id
+        count += 1
+
+        if count == size:
+            yield first_id, last_id
+            first_id, count = None, 0
+
+    if first_id is not None:
+        yield first_id, last_id
+
+
+def _value_range(args):
+    first_id, last_id, kwargs = args
+    return value_products(first_id, last_id, **kwargs)
+
+
+def value_inventory(end, start=None, location_types=VALUED_LOCATION_TYPES, processes=1, range_size=1000,
+                    chunk_size=10000):
+    """
+    Yields the `ProductValuation` of every moved product, in product order. Ranges of
+    `range_size` products are valued by a pool of `processes` processes.
+    """
+    kwargs = {"end": end, "start": start, "location_types": location_types, "chunk_size": chunk_size}
+    ranges = [(first_id, last_id, kwargs) for first_id, last_id in get_product_ranges(range_size)]
+
+    if processes == 1:
+        for args in ranges:
+            for valuation in _value_range(args):
+                yield valuation
+        return
+
+    # workers are forked, they must not share the connection of this process
+    connection.close()
+    pool = Pool(processes)
+    try:
+        for valuations in pool.imap(_value_range, ranges):
+            for valuation in valuations:
+                yield valuation
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -1,13 +1,20 @@
 from __future__ import unicode_literals
 
 from django.core.urlresolvers import reverse_lazy
-from django.views.generic import FormView
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.utils import timezone
+from django.views.generic import FormView, View
 
 from braces.views import LoginRequiredMixin
 
 from ..mixins import BazaarPrefixMixin
 from . import api
+from .exceptions import ReservedStockException
+from .exports import CONTENT_TYPES, MOVEMENT_COLUMNS, STOCK_COLUMNS, export_lines, iter_movement_rows, \
+    iter_stock_rows
+from .filters import MovementExportFilter, StockExportFilter
 from .forms import MovementForm
+from .models import Movement, Stock
 
 
 class MovementMixin(LoginRequiredMixin, BazaarPrefixMixin):
@@ -40,9 +47,59 @@ class MovementFormView(MovementMixin, FormView):
         unit_price = form.cleaned_data["unit_price"]
         note = form.cleaned_data["note"]
 
-        price_multiplier = unit_price / product.price
+        price_multiplier = unit_price.amount / product.price.amount
 
-        product.move(from_location, to_location, quantity=quantity, price_multiplier=price_multiplier,
-                     agent=self.request.user, note=note)
+        try:
+            product.move(from_location, to_location, quantity=quantity, price_multiplier=price_multiplier,
+                         agent=self.request.user, note=note)
+        except ReservedStockException as e:
+            form.add_error("quantity", "%s" % e)
+            return self.form_invalid(form)
 
         return super(MovementFormView, self).form_valid(form)
+
+
+class ExportView(LoginRequiredMixin, View):
+    """
+    Streams the rows of `model` filtered by `filter_class` as CSV or JSON lines,
+    the format is the `format` url argument.
+    """
+    model = None
+    filter_class = None
+    columns = None
+
+    def get_rows(self, queryset):
+        raise NotImplementedError("Export views must implement get_rows")
+
+    def get(self, request, *args, **kwargs):
+        export_format = kwargs["format"]
+
+        object_filter = self.filter_class(request.GET, self.model.objects.all())
+        if not object_filter.form.is_valid():
+            return HttpResponseBadRequest(object_filter.form.errors.as_text())
+
+        lines = export_lines(export_format, self.columns, self.get_rows(object_filter.qs))
+        response = StreamingHttpResponse(lines, content_type=CONTENT_TYPES[export_format])
+
+        filename = "%s-%s.%s" % (self.model._meta.model_name, timezone.now().strftime("%Y%m%d%H%M%S"),
+                                 export_format)
+        response["Content-Disposition"] = "attachment; filename=%s" % filename
+        return response
+
+
+class MovementExportView(ExportView):
+    model = Movement
+    filter_class = MovementExportFilter
+    columns = MOVEMENT_COLUMNS
+
+    def get_rows(self, queryset):
+        return iter_movement_rows(queryset)
+
+
+class StockExportView(ExportView):
+    model = Stock
+    filter_class = StockExportFilter
+    columns = STOCK_COLUMNS
+
+    def get_rows(self, queryset):
+        return iter_stock_rows(queryset)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Measures the latency of the sales window annotation (`with_last_sold`) with and
+without the time window indexes of the movement table.
+
+    python benchmarks/movement_indexes.py [--products 1000] [--movements 1000000] [--days 30]
+
+Movements are spread over a year among the products and the supplier, storage and
+customer locations. The annotation is timed on all the products with the indexes,
+then again after dropping them.
+
+Runs on sqlite by default, set BENCHMARK_DB_ENGINE, BENCHMARK_DB_NAME, ... to use
+PostgreSQL.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+from datetime import timedelta
+
+
+def time_annotation(products, customer, present, days, repeat):
+    from bazaar.goods.models import Product
+
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        list(Product.objects.filter(pk__in=products).with_last_sold(
+            customer.pk, present - timedelta(days=days), present=present).values_list("pk", "last_sold"))
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+INDEX_QUERIES = {
+    "sqlite": "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s",
+    "postgresql": "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s",
+}
+
+
+def drop_window_indexes(connection):
+    from bazaar.warehouse.models import Movement
+
+    # index_together indexes are the ones on more columns, including the date
+    cursor = connection.cursor()
+    cursor.execute(INDEX_QUERIES[connection.vendor], [Movement._meta.db_table])
+    for name, definition in cursor.fetchall():
+        if definition and "to_location_id" in definition and "date" in definition:
+            cursor.execute("DROP INDEX %s" % connection.ops.quote_name(name))
+
+
+def run(options):
+    import django
+    from django.db import connection
+    from django.utils import timezone
+
+    django.setup()
+    connection.creation.create_test_db(verbosity=0)
+
+    try:
+        from bazaar.goods.models import Product
+        from bazaar.warehouse.locations import get_customer, get_storage, get_supplier
+        from bazaar.warehouse.models import Movement
+
+        random.seed(0)
+        supplier, storage, customer = get_supplier(), get_storage(), get_customer()
+        products = [Product.objects.create(name="product %d" % i, ean="%d" % i, price=1).pk
+                    for i in range(options.products)]
+
+        present = timezone.now()
+        routes = [(supplier, storage), (storage, customer), (storage, customer)]
+
+        start = time.time()
+        batch = []
+        for i in range(options.movements):
+            from_location, to_location = random.choice(routes)
+            batch.append(Movement(product_id=random.choice(products), from_location=from_location,
+                                  to_location=to_location, quantity=random.randint(1, 5), unit_price=1,
+                                  agent="benchmark"))
+            if len(batch) == 10000 or i == options.movements - 1:
+                Movement.objects.bulk_create(batch)
+                batch = []
+        print("%d movements inserted in %.1fs" % (options.movements, time.time() - start))
+
+        # auto_now_add dates are all the same, spread them over a year
+        cursor = connection.cursor()
+        movement_ids = list(Movement.objects.values_list("pk", flat=True))
+        for i in range(0, len(movement_ids), 10000):
+            params = [(present - timedelta(minutes=random.randint(0, 365 * 24 * 60)), pk)
+                      for pk in movement_ids[i:i + 10000]]
+            cursor.executemany("UPDATE warehouse_movement SET date = %s WHERE id = %s", params)
+
+        with_indexes = time_annotation(products, customer, present, options.days, options.repeat)
+        drop_window_indexes(connection)
+        without_indexes = time_annotation(products, customer, present, options.days, options.repeat)
+
+        print("with_last_sold on %d products, %d days window:" % (options.products, options.days))
+        print("%-20s%10.1f ms" % ("with indexes", with_indexes * 1000))
+        print("%-20s%10.1f ms" % ("without indexes", without_indexes * 1000))
+    finally:
+        connection.creation.destroy_test_db(connection.settings_dict["NAME"], verbosity=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Movement indexes benchmark")
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--movements", type=int, default=1000000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=3)
+    options = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    logging.disable(logging.CRITICAL)
+
+    run(options)
+
+
+if __name__ == "__main__":
+    main()
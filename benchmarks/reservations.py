@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Measures the contention of stock reservations: concurrent workers reserve one unit
+of the same product until its stock is exhausted, then checks that no unit was
+reserved twice.
+
+    python benchmarks/reservations.py [--workers 8] [--stock 2000]
+
+Runs on a sqlite file by default, where writers are serialized by the database lock.
+Set BENCHMARK_DB_ENGINE, BENCHMARK_DB_NAME, ... to use another database.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+
+def run(options):
+    import django
+    from django.db import connection
+
+    django.setup()
+    if connection.vendor == "sqlite":
+        # an in memory database is not shared by the connections of the workers
+        connection.settings_dict["TEST"]["NAME"] = os.path.join(tempfile.mkdtemp(), "reservations.sqlite3")
+    connection.creation.create_test_db(verbosity=0)
+
+    try:
+        from bazaar.goods.models import Product
+        from bazaar.warehouse.api import move
+        from bazaar.warehouse.exceptions import InsufficientStockException
+        from bazaar.warehouse.locations import get_storage, get_supplier
+        from bazaar.warehouse.models import Reservation, Stock
+        from bazaar.warehouse.reservations import reserve
+
+        storage = get_storage()
+        product = Product.objects.create(name="hot product", ean="1", price=1)
+        move(get_supplier(), storage, product, options.stock, 1)
+
+        latencies = []
+        errors = []
+
+        def worker():
+            try:
+                while True:
+                    start = time.time()
+                    try:
+                        reserve(product, 1, location=storage)
+                    except InsufficientStockException:
+                        break
+                    latencies.append(time.time() - start)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                # every thread has its own connection
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options.workers)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+
+        stock = Stock.objects.get(product=product, location=storage)
+        reserved = Reservation.objects.filter(product=product).count()
+        latencies.sort()
+
+        print("workers: %d, stock: %d" % (options.workers, options.stock))
+        print("reservations: %d in %.2fs (%.0f/s)" % (len(latencies), elapsed, len(latencies) / elapsed))
+        if latencies:
+            print("latency p50 %.1fms, p99 %.1fms" % (latencies[len(latencies) // 2] * 1000,
+                                                      latencies[int(len(latencies) * 0.99)] * 1000))
+        print("errors: %d%s" % (len(errors), " (%r)" % errors[0] if errors else ""))
+        print("stock quantity %s, reserved %s, reservations %d: %s" % (
+            stock.quantity, stock.reserved, reserved,
+            "ok" if stock.reserved == reserved <= stock.quantity else "OVERSOLD"))
+    finally:
+        connection.creation.destroy_test_db(connection.settings_dict["NAME"], verbosity=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stock reservations benchmark")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--stock", type=int, default=2000)
+    options = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    logging.disable(logging.CRITICAL)
+
+    run(options)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+
+from tests.settings import *  # noqa
+
+DEBUG = False
+
+# e.g. BENCHMARK_DB_ENGINE=django.db.backends.postgresql_psycopg2 BENCHMARK_DB_NAME=bazaar
+DATABASES = {
+    "default": {
+        "ENGINE": os.environ.get("BENCHMARK_DB_ENGINE", "django.db.backends.sqlite3"),
+        "NAME": os.environ.get("BENCHMARK_DB_NAME", ""),
+        "USER": os.environ.get("BENCHMARK_DB_USER", ""),
+        "PASSWORD": os.environ.get("BENCHMARK_DB_PASSWORD", ""),
+        "HOST": os.environ.get("BENCHMARK_DB_HOST", ""),
+    }
+}
+
+DJANGO_BAZAAR = dict(DJANGO_BAZAAR, STOCK_BACKEND=os.environ.get(  # noqa
+    "BENCHMARK_STOCK_BACKEND", "bazaar.warehouse.backends.TableStockBackend"))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Compares the stock backends: write throughput (movements per second) against
+read latency (stock quantity of a product, stock summary of all the products).
+
+Every backend runs in its own process on a fresh test database:
+
+    python benchmarks/stock_backends.py [--products 200] [--movements 2000] [--reads 500]
+
+Runs on sqlite by default, set BENCHMARK_DB_ENGINE, BENCHMARK_DB_NAME, ... to use
+another database. The materialized view backend is skipped when not on PostgreSQL.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+
+
+BACKENDS = (
+    "bazaar.warehouse.backends.TableStockBackend",
+    "bazaar.warehouse.backends.ViewStockBackend",
+    "bazaar.warehouse.backends.MaterializedViewStockBackend",
+)
+
+
+def run(options):
+    import django
+    from django.db import connection
+
+    django.setup()
+    connection.creation.create_test_db(verbosity=0)
+
+    try:
+        from bazaar.warehouse.api import get_storage_quantity, get_stock_summary, move
+        from bazaar.warehouse.backends import get_stock_backend
+        from bazaar.warehouse.locations import get_customer, get_storage, get_supplier
+        from bazaar.goods.models import Product
+
+        random.seed(0)
+        supplier, storage, customer = get_supplier(), get_storage(), get_customer()
+        products = [Product.objects.create(name="product %d" % i, ean="%d" % i, price=1)
+                    for i in range(options.products)]
+
+        start = time.time()
+        for i in range(options.movements):
+            product = random.choice(products)
+            if i % 3:
+                move(supplier, storage, product, random.randint(1, 10), random.randint(1, 100))
+            else:
+                move(storage, customer, product, 1, 1)
+        write_time = time.time() - start
+
+        start = time.time()
+        get_stock_backend().refresh()
+        refresh_time = time.time() - start
+
+        start = time.time()
+        for i in range(options.reads):
+            get_storage_quantity(random.choice(products))
+        read_time = time.time() - start
+
+        start = time.time()
+        get_stock_summary(products)
+        summary_time = time.time() - start
+
+        return {
+            "movements/s": options.movements / write_time,
+            "refresh (ms)": refresh_time * 1000,
+            "quantity read (ms)": read_time * 1000 / options.reads,
+            "summary read (ms)": summary_time * 1000,
+        }
+    finally:
+        connection.creation.destroy_test_db(connection.settings_dict["NAME"], verbosity=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stock backends benchmark")
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--movements", type=int, default=2000)
+    parser.add_argument("--reads", type=int, default=500)
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    logging.disable(logging.CRITICAL)
+
+    if options.backend:
+        os.environ["BENCHMARK_STOCK_BACKEND"] = options.backend
+        print(json.dumps(run(options)))
+        return
+
+    engine = os.environ.get("BENCHMARK_DB_ENGINE", "sqlite3")
+    columns = ("movements/s", "refresh (ms)", "quantity read (ms)", "summary read (ms)")
+    print("%-30s" % "backend" + "".join("%20s" % column for column in columns))
+
+    for backend in BACKENDS:
+        name = backend.rsplit(".", 1)[1]
+        if backend.endswith("MaterializedViewStockBackend") and "postgresql" not in engine:
+            print("%-30s%20s" % (name, "skipped"))
+            continue
+
+        output = subprocess.check_output([sys.executable, __file__, "--backend", backend] + sys.argv[1:])
+        results = json.loads(output.decode("utf-8").splitlines()[-1])
+        print("%-30s" % name + "".join("%20.2f" % results[column] for column in columns))
+
+
+if __name__ == "__main__":
+    main()
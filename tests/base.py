@@ -1,10 +1,30 @@
 from __future__ import unicode_literals
 
+from contextlib import contextmanager
+
 from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connections
 from django.test import TestCase
 
+from bazaar.warehouse import locations
+
 
 class BaseTestCase(TestCase):
     @classmethod
     def setUpClass(cls):
         call_command("update_rates")
+
+
+@contextmanager
+def run_commit_hooks(using=DEFAULT_DB_ALIAS):
+    """
+    Runs the pending transaction hooks when the block exits, as if the transaction
+    of the test case was committed
+    """
+    connection = connections[using]
+    yield
+    while getattr(connection, "run_on_commit", None):
+        sids, func = connection.run_on_commit.pop(0)
+        func()
+    # locations cached on commit are rolled back with the test case
+    locations.clear()
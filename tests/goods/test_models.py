@@ -3,12 +3,17 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+import mock
 from moneyed import Money
 
 from bazaar.goods.models import Product, CompositeProduct
 from bazaar.listings.models import Listing
 from bazaar.settings import bazaar_settings
+from bazaar.warehouse.composites import defer_composite_refresh
+from bazaar.warehouse.locations import get_storage
 from bazaar.warehouse.api import get_storage_quantity, get_storage_price, get_output_quantity, \
     get_customer_quantity
 from .. import factories as f
@@ -101,6 +106,61 @@ class TestCompositeProduct(TestCase):
         self.assertIn(self.product1, self.composite.products.all())
         self.assertIn(self.product2, self.composite.products.all())
 
+    def test_saving_sets_refreshes_composite(self):
+        storage = get_storage()
+        lost_and_found = f.LostFoundFactory()
+        self.product1.move(lost_and_found, storage, quantity=4)
+        self.product2.move(lost_and_found, storage, quantity=3)
+
+        product3 = f.ProductFactory(price=2)
+        product3.move(lost_and_found, storage, quantity=6)
+        f.ProductSetFactory(composite=self.composite, product=product3, quantity=3)
+
+        self.assertEqual(CompositeProduct.objects.get(pk=self.composite.pk).price.amount, 6)
+        self.assertEqual(get_storage_quantity(product=self.composite), 2)
+        self.assertEqual(get_storage_price(product=self.composite).amount, 6)
+
+    def test_saving_sets_in_deferred_block_refreshes_composite_once(self):
+        composite = CompositeProduct.objects.create(name='Other composite')
+        products = [f.ProductFactory(price=1) for _ in range(3)]
+
+        with mock.patch("bazaar.warehouse.composites.refresh_composites") as refresh_composites:
+            with defer_composite_refresh():
+                for product in products:
+                    f.ProductSetFactory(composite=composite, product=product, quantity=1)
+                with defer_composite_refresh():
+                    f.ProductSetFactory(composite=self.composite, product=products[0], quantity=1)
+
+                self.assertFalse(refresh_composites.called)
+
+        refresh_composites.assert_called_once_with(set([composite.pk, self.composite.pk]))
+
+    def test_deferred_refresh_is_discarded_on_error(self):
+        composite = CompositeProduct.objects.create(name='Other composite')
+        product = f.ProductFactory(price=1)
+
+        with mock.patch("bazaar.warehouse.composites.refresh_composites") as refresh_composites:
+            with self.assertRaises(ValueError):
+                with defer_composite_refresh():
+                    f.ProductSetFactory(composite=composite, product=product, quantity=1)
+                    raise ValueError
+
+        self.assertFalse(refresh_composites.called)
+
+    def test_nested_deferred_refresh_is_discarded_on_error(self):
+        composite = CompositeProduct.objects.create(name='Other composite')
+        product = f.ProductFactory(price=1)
+
+        with mock.patch("bazaar.warehouse.composites.refresh_composites") as refresh_composites:
+            with defer_composite_refresh():
+                f.ProductSetFactory(composite=self.composite, product=product, quantity=1)
+                with self.assertRaises(ValueError):
+                    with defer_composite_refresh():
+                        f.ProductSetFactory(composite=composite, product=product, quantity=1)
+                        raise ValueError
+
+        refresh_composites.assert_called_once_with(set([self.composite.pk]))
+
 
 class TestProductMovements(TestCase):
     def setUp(self):
@@ -210,3 +270,45 @@ class TestProductMovements(TestCase):
         self.assertEqual(get_storage_quantity(product=self.product_1), 0)
         self.assertEqual(get_storage_quantity(product=self.product_2), 0)
         self.assertEqual(get_customer_quantity(product=self.composite_2), 1)
+
+    def test_move_updates_many_composites_with_constant_queries(self):
+        def count_move_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.product_1.move(from_location=self.lost_and_found, to_location=self.storage)
+            return len(queries)
+
+        # creates the composite stocks
+        self.product_1.move(from_location=self.lost_and_found, to_location=self.storage)
+        few = count_move_queries()
+
+        composites = [f.CompositeProductFactory() for _ in range(10)]
+        for composite in composites:
+            f.ProductSetFactory(product=self.product_1, composite=composite, quantity=1)
+            f.ProductSetFactory(product=self.product_2, composite=composite, quantity=1)
+        self.product_1.move(from_location=self.lost_and_found, to_location=self.storage)
+
+        self.assertEqual(count_move_queries(), few)
+        for composite in composites:
+            self.assertEqual(get_storage_quantity(product=composite), 0)
+            self.assertEqual(get_storage_price(product=composite).amount, 1)
+
+    def test_move_changing_every_composite_with_constant_queries(self):
+        def count_move_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.product_1.move(from_location=self.lost_and_found, to_location=self.storage, price_multiplier=2)
+            return len(queries)
+
+        # creates the composite stocks, then changes the quantity of composite_1 only
+        self.product_1.move(from_location=self.lost_and_found, to_location=self.storage, price_multiplier=2)
+        few = count_move_queries()
+
+        composites = [f.CompositeProductFactory() for _ in range(10)]
+        for composite in composites:
+            f.ProductSetFactory(product=self.product_1, composite=composite, quantity=1)
+        self.product_1.move(from_location=self.lost_and_found, to_location=self.storage, price_multiplier=2)
+
+        self.assertEqual(count_move_queries(), few)
+        for composite in composites + [self.composite_1]:
+            stock = composite.stocks.get(location=self.storage)
+            self.assertEqual(stock.quantity, 4)
+            self.assertEqual(stock.unit_price.amount, 2)
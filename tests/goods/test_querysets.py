@@ -1,16 +1,23 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+from collections import namedtuple
+from unittest import skipIf
+
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
 from bazaar.goods.models import Product
 from bazaar.warehouse import api
 from tests import factories as f
+from tests.base import run_commit_hooks
 
 from django.utils import timezone
 
 FORCED_LOWER = -999999
 
+StoreFees = namedtuple("StoreFees", ["lower_fixed_store_fee", "store_fee", "vat"])
+
 
 class TestBase(TestCase):
     def setUp(self):
@@ -70,6 +77,21 @@ class TestProductQuerySet(TestBase):
         product = Product.objects.with_total_avr_cost(self.output.id).get(pk=self.product3.id)
         self.assertEqual(product.total_avr_cost, 500)
 
+    def test_with_stock_price(self):
+        for product in Product.objects.with_stock_price([self.storage.type, self.output.type]):
+            expected = api.get_stock_price(product, [self.storage.type, self.output.type])
+            self.assertAlmostEqual(float(product.stock_price), float(expected.amount))
+
+        product = Product.objects.with_stock_price(self.output.type).get(pk=self.product3.id)
+        self.assertEqual(product.stock_price, 500)
+
+        product = Product.objects.with_stock_price(self.customer.type).get(pk=self.product1.id)
+        self.assertEqual(product.stock_price, 0)
+
+    def test_with_stock_price_in_one_query(self):
+        with self.assertNumQueries(1):
+            list(Product.objects.with_stock_price(self.storage.type))
+
     def test_with_stock_quantity(self):
         product = Product.objects.with_stock_quantity(self.storage.id, self.output.id).get(pk=self.product1.id)
         self.assertEqual(product.stock_quantity, 1)
@@ -103,3 +125,78 @@ class TestProductQuerySet(TestBase):
         product = Product.objects.with_last_sold(self.customer.id, self.time_ago, present=present)\
             .get(pk=self.product3.id)
         self.assertEqual(product.last_sold, 2)
+
+    def test_with_stock_metrics(self):
+        products = Product.objects.with_stock_metrics(
+            availability=self.storage.id, stock_quantity=[self.storage.id, self.output.id], sold=self.customer.id,
+            total_avr_cost=[self.storage.id, self.output.id])
+
+        for product in products:
+            expected = Product.objects.with_availability(self.storage.id)\
+                .with_stock_quantity(self.storage.id, self.output.id).with_sold(self.customer.id)\
+                .with_total_avr_cost((self.storage.id, self.output.id)).get(pk=product.pk)
+            self.assertEqual(product.availability, expected.availability)
+            self.assertEqual(product.stock_quantity, expected.stock_quantity)
+            self.assertEqual(product.sold, expected.sold)
+            self.assertEqual(product.total_avr_cost, expected.total_avr_cost)
+
+    def test_with_stock_metrics_in_one_query(self):
+        with self.assertNumQueries(1):
+            list(Product.objects.with_stock_metrics(
+                availability=self.storage.id, stock_quantity=[self.storage.id, self.output.id], sold=self.customer.id,
+                total_avr_cost=[self.storage.id, self.output.id]))
+
+    def test_with_stock_metrics_filter_and_order(self):
+        products = Product.objects.with_stock_metrics(availability=self.storage.id, sold=self.customer.id)\
+            .with_last_sold(self.customer.id, self.time_ago, present=timezone.now())
+
+        self.assertEqual(list(products.filter(availability__gt=0).order_by("-availability")),
+                         [self.product3, self.product2])
+        self.assertEqual(list(products.filter(sold__gt=0)), [self.product3])
+        self.assertEqual(products.order_by("availability")[1:].count(), 2)
+        self.assertEqual(products.get(pk=self.product3.pk).last_sold, 2)
+
+    def test_with_stock_metrics_avr_price_delta_requires_reference(self):
+        with self.assertRaises(ValueError):
+            Product.objects.with_stock_metrics(avr_price_delta=self.storage.id)
+
+    @skipIf(connection.vendor == "sqlite", "GREATEST is not available in sqlite")
+    def test_with_stock_metrics_avr_price_delta(self):
+        reference = StoreFees(lower_fixed_store_fee=1, store_fee=10, vat=22)
+        location_ids = [self.storage.id, self.output.id]
+
+        for product in Product.objects.with_stock_metrics(avr_price_delta=location_ids, reference=reference):
+            expected = Product.objects.with_avr_price_delta(reference, location_ids).get(pk=product.pk)
+            self.assertEqual(product.avr_price_delta, expected.avr_price_delta)
+
+    def test_with_last_sold_default_present(self):
+        api.move(self.output, self.customer, self.product2, 1, 50)
+
+        product = Product.objects.with_last_sold(self.customer.id, self.time_ago).get(pk=self.product2.id)
+        self.assertEqual(product.last_sold, 1)
+
+    def test_with_stock_cache(self):
+        products = Product.objects.order_by("pk")
+        expected = [(product.quantity, product.cost) for product in products]
+
+        with self.assertNumQueries(2):
+            cached = list(products.with_stock_cache())
+            self.assertEqual([(product.quantity, product.cost) for product in cached], expected)
+
+        # values querysets are not affected
+        self.assertEqual(len(products.with_stock_cache().values_list("pk", flat=True)), 3)
+
+    def test_with_stock_cache_is_cleared_when_moving(self):
+        product = Product.objects.with_stock_cache().get(pk=self.product1.pk)
+        quantity = product.quantity
+
+        product.move(self.lost_and_found, self.storage, quantity=2)
+        self.assertEqual(product.quantity, quantity + 2)
+
+    def test_with_stock_cache_is_cleared_on_storage_change(self):
+        product = Product.objects.with_stock_cache().get(pk=self.product1.pk)
+        quantity = product.quantity
+
+        with run_commit_hooks():
+            api.move(self.lost_and_found, self.storage, product, 2, 1)
+        self.assertEqual(product.quantity, quantity + 2)
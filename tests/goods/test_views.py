@@ -3,7 +3,9 @@ from __future__ import unicode_literals
 
 from django.contrib.auth import get_user_model
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from bazaar.goods.models import Product
 from django.utils.translation import ugettext as _
 from bazaar.listings.models import Listing
@@ -12,6 +14,7 @@ from bazaar.warehouse import api
 from rest_framework import status
 from bazaar.warehouse.locations import get_storage, get_lost_and_found
 from tests import factories as f
+from tests.base import run_commit_hooks
 from tests.factories import PublishingFactory, ListingFactory, ProductFactory
 
 
@@ -89,7 +92,8 @@ class TestProductListView(TestBase):
         Test that sort by stock quantity works correctly
         """
         product2 = f.ProductFactory(name='product2', price=1, description='the best you can have!')
-        product2.move(get_lost_and_found(), get_storage(), quantity=5)
+        with run_commit_hooks():
+            product2.move(get_lost_and_found(), get_storage(), quantity=5)
         self.client.login(username=self.user.username, password='test')
         response = self.client.get("/products/?&order_by=stock")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -276,6 +280,24 @@ class TestProductDetailView(TestBase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertNotIn(b'<img ', response.content)
 
+    def _count_detail_queries(self, components):
+        composite = f.CompositeProductFactory()
+        for i in range(components):
+            product = f.ProductFactory()
+            product.move(get_lost_and_found(), get_storage(), quantity=i + 1)
+            f.ProductSetFactory(composite=composite, product=product, quantity=1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('bazaar:product-detail', kwargs={'pk': composite.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([product_set.product.quantity for product_set in response.context_data['product_sets']],
+                         [i + 1 for i in range(components)])
+        return len(queries)
+
+    def test_detail_view_components_stocks_are_read_at_once(self):
+        self.client.login(username=self.user.username, password='test')
+        self.assertEqual(self._count_detail_queries(2), self._count_detail_queries(5))
+
     def test_code_column_being_shown(self):
         self.client.login(username=self.user.username, password='test')
         response = self.client.get(reverse('bazaar:product-detail', kwargs={'pk': self.product.pk}))
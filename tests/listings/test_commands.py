@@ -0,0 +1,123 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from django.core.management import call_command
+from django.db import DatabaseError, transaction
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+import mock
+
+from bazaar.settings import bazaar_settings
+from bazaar.warehouse.models import Location, StockEvent
+
+from ..base import run_commit_hooks
+from ..stores import Store1, Store2
+from .. import factories as f
+
+
+@mock.patch.object(bazaar_settings, "STOCK_OUTBOX", True)
+class TestDrainStockEventsCommand(TestCase):
+    def setUp(self):
+        self.product = f.ProductFactory()
+        self.storage = f.StorageFactory()
+        self.supplier = f.SupplierFactory()
+
+    def _call(self, **options):
+        out = StringIO()
+        call_command("drain_stock_events", stdout=out, batch_size=1, **options)
+        return out.getvalue()
+
+    def test_events_are_passed_to_stores(self):
+        self.product.move(self.supplier, self.storage, quantity=10)
+        self.product.move(self.supplier, self.storage, quantity=5)
+
+        # changes of the same stock in a transaction are recorded once
+        self.assertEqual(StockEvent.objects.count(), 2)
+
+        consumed = []
+
+        def consume(store, events):
+            consumed.extend((store.get_store_name(), event.product, event.location_type) for event in events)
+
+        with mock.patch.object(Store1, "consume_stock_events", autospec=True, side_effect=consume), \
+                mock.patch.object(Store2, "consume_stock_events", autospec=True, side_effect=consume):
+            output = self._call()
+
+        self.assertIn("2 stock events drained", output)
+        self.assertEqual(StockEvent.objects.count(), 0)
+        self.assertEqual(set(consumed[:2]), set([("Store 1", self.product, Location.LOCATION_STORAGE),
+                                                 ("Store 2", self.product, Location.LOCATION_STORAGE)]))
+        self.assertEqual(len(consumed), 4)
+
+    def test_failed_batches_stay_in_outbox(self):
+        self.product.move(self.supplier, self.storage, quantity=10)
+
+        with mock.patch.object(Store1, "consume_stock_events") as store1, \
+                mock.patch.object(Store2, "consume_stock_events", side_effect=ValueError):
+            self.assertIn("0 stock events drained", self._call())
+
+            # failed events are retried later
+            self.assertIn("0 stock events drained", self._call())
+
+        self.assertEqual(store1.call_count, 2)
+        self.assertEqual(StockEvent.objects.count(), 2)
+        for event in StockEvent.objects.all():
+            self.assertEqual((event.pending_consumers, event.attempts), ("Store 2", 1))
+            self.assertGreater(event.retry_after, timezone.now())
+
+        StockEvent.objects.update(retry_after=timezone.now())
+
+        with mock.patch.object(Store1, "consume_stock_events") as store1, \
+                mock.patch.object(Store2, "consume_stock_events") as store2:
+            self.assertIn("2 stock events drained", self._call())
+
+        # events already consumed by the first store are not passed again
+        self.assertEqual((store1.call_count, store2.call_count), (0, 2))
+        self.assertEqual(StockEvent.objects.count(), 0)
+
+    def test_failing_consumer_does_not_block_the_others(self):
+        with run_commit_hooks():
+            self.product.move(self.supplier, self.storage, quantity=10)
+
+        with mock.patch.object(Store2, "consume_stock_events", side_effect=ValueError):
+            self._call()
+            with run_commit_hooks():
+                self.product.move(self.supplier, self.storage, quantity=5)
+
+            with mock.patch.object(Store1, "consume_stock_events") as store1:
+                self._call()
+
+        # events of the second move are passed to the first store
+        self.assertEqual(store1.call_count, 2)
+        self.assertEqual(StockEvent.objects.count(), 4)
+
+    def test_events_are_dropped_after_max_attempts(self):
+        self.product.move(self.supplier, self.storage, quantity=10)
+
+        with mock.patch.object(Store2, "consume_stock_events", side_effect=ValueError), \
+                mock.patch("bazaar.warehouse.outbox.logger") as logger:
+            self.assertIn("2 stock events drained", self._call(max_attempts=1))
+
+        self.assertEqual(logger.error.call_count, 2)
+        self.assertEqual(StockEvent.objects.count(), 0)
+
+    def test_worker_keeps_polling_after_errors(self):
+        path = "bazaar.listings.management.commands.drain_stock_events"
+
+        with mock.patch("%s.drain" % path, side_effect=[DatabaseError, 3, KeyboardInterrupt]) as drain, \
+                mock.patch("%s.time.sleep" % path), mock.patch("%s.logger" % path) as logger:
+            self.assertRaises(KeyboardInterrupt, self._call, interval=1)
+
+        self.assertEqual(drain.call_count, 3)
+        self.assertEqual(logger.exception.call_count, 1)
+
+    def test_events_are_not_written_on_rollback(self):
+        try:
+            with transaction.atomic():
+                self.product.move(self.supplier, self.storage, quantity=10)
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(StockEvent.objects.count(), 0)
@@ -8,9 +8,11 @@ from django.test import TestCase
 import datetime
 import pytz
 
+from bazaar.goods.models import CompositeProduct, Product
 from bazaar.listings.models import Store, Listing, Publishing
+from bazaar.templatetags.bazaar_list import get_url
 from moneyed import Money
-from ..factories import (ProductFactory, StockFactory, ListingFactory, PublishingFactory)
+from ..factories import (ProductFactory, CompositeProductFactory, StockFactory, ListingFactory, PublishingFactory)
 
 
 class TestPublishingModelManager(TestCase):
@@ -117,3 +119,25 @@ class TestListingModel(TestCase):
     def test_is_low_cost(self):
         PublishingFactory(listing=self.listing, available_units=25, price=1)
         self.assertTrue(self.listing.is_low_cost())
+
+    def test_prefetch_stock(self):
+        other = ListingFactory(product=ProductFactory())
+        StockFactory(product=other.product, unit_price=4.0, quantity=10)
+
+        expected = [(listing.available_units, listing.cost) for listing in (self.listing, other)]
+
+        with self.assertNumQueries(2):
+            listings = list(Listing.objects.filter(pk__in=[self.listing.pk, other.pk]).order_by("pk").prefetch_stock())
+            self.assertEqual([(listing.available_units, listing.cost) for listing in listings], expected)
+
+    def test_resolve_product_subclasses(self):
+        other = ListingFactory(product=CompositeProductFactory())
+
+        with self.assertNumQueries(2):
+            listings = list(Listing.objects.filter(pk__in=[self.listing.pk, other.pk]).order_by("pk")
+                            .resolve_product_subclasses())
+            self.assertEqual([get_url(listing, "product") for listing in listings],
+                             ["product-detail", "product-detail"])
+
+        self.assertIs(listings[0].product.__class__, Product)
+        self.assertIs(listings[1].product._subclass.__class__, CompositeProduct)
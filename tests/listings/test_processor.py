@@ -3,7 +3,10 @@ from __future__ import unicode_literals
 
 from django.test import TestCase
 import mock
+from bazaar.goods.models import Product, CompositeProduct
 from bazaar.listings.processor import OrderProcessor
+from bazaar.utils import resolve_subclasses
+from bazaar.warehouse.exceptions import ReservedStockException
 
 from .. import factories as f
 
@@ -19,3 +22,74 @@ class TestProcessorGetOrder(TestCase):
         incoming = mock.Mock()
         incoming.external_id = self.order.external_id
         self.assertEqual(processor.get_order(incoming), self.order)
+
+    def test_product_subclasses_are_resolved_once(self):
+        processor = OrderProcessor()
+        composite = f.CompositeProductFactory()
+        product = Product.objects.get(pk=composite.pk)
+
+        with processor.batch([]):
+            self.assertIsInstance(processor._get_product_subclass(product, product.id), CompositeProduct)
+
+            # another order of the same product
+            product = Product.objects.get(pk=composite.pk)
+            with self.assertNumQueries(0):
+                self.assertIsInstance(processor._get_product_subclass(product, product.id), CompositeProduct)
+
+        # resolved products are forgotten after the batch
+        self.assertIsNone(processor._product_subclasses)
+
+
+class RecordingProcessor(OrderProcessor):
+    order_lookup_id = "external_id"
+    publishing_lookup_id = "item_id"
+
+    def __init__(self):
+        super(RecordingProcessor, self).__init__()
+        self.products = []
+
+    def action(self, publishing, incoming, order):
+        self.products.append(publishing.listing.product)
+
+
+class TestProcessorRunMany(TestCase):
+
+    def setUp(self):
+        composite = f.CompositeProductFactory()
+        listing = f.ListingFactory(product=Product.objects.get(pk=composite.pk))
+        self.publishing = f.PublishingFactory(listing=listing)
+        self.other_publishing = f.PublishingFactory(listing=f.ListingFactory())
+
+    def get_incoming(self, publishing, external_id):
+        incoming = mock.Mock()
+        incoming.external_id = external_id
+        incoming.item_id = publishing.external_id
+        return incoming
+
+    def test_run_many_resolves_products_at_once(self):
+        processor = RecordingProcessor()
+        incoming_orders = [self.get_incoming(self.publishing, "a"), self.get_incoming(self.other_publishing, "b"),
+                           self.get_incoming(self.publishing, "c")]
+
+        with mock.patch("bazaar.listings.processor.resolve_subclasses", wraps=resolve_subclasses) as resolve:
+            processor.run_many(incoming_orders)
+
+        self.assertEqual(resolve.call_count, 1)
+        self.assertEqual([product.pk for product in processor.products],
+                         [self.publishing.listing.product_id, self.other_publishing.listing.product_id,
+                          self.publishing.listing.product_id])
+        self.assertIsInstance(processor.products[0], CompositeProduct)
+        self.assertIs(processor.products[0], processor.products[2])
+        self.assertIsNone(processor._product_subclasses)
+
+    def test_orders_taking_reserved_units_are_not_processed(self):
+        processor = RecordingProcessor()
+        incoming_orders = [self.get_incoming(self.publishing, "a"), self.get_incoming(self.other_publishing, "b")]
+
+        with mock.patch.object(RecordingProcessor, "action", autospec=True,
+                               side_effect=[ReservedStockException("reserved"), None]) as action:
+            processor.run_many(incoming_orders)
+
+        self.assertEqual(action.call_count, 2)
+        self.assertEqual(len(processor.get_messages()), 1)
+        self.assertIn("reserved", processor.get_messages()[0])
@@ -1,6 +1,9 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import os
+import tempfile
+
 DEBUG = True
 
 USE_TZ = True
@@ -8,6 +11,11 @@ USE_TZ = True
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
+        # a file shared by the connections of the threads running the concurrency tests,
+        # sqlite serializes their transactions
+        "TEST": {
+            "NAME": os.path.join(tempfile.gettempdir(), "bazaar-tests-%d.sqlite3" % os.getpid()),
+        },
     }
 }
 
@@ -3,9 +3,14 @@ import mock
 
 from moneyed import Money
 
-from bazaar.utils import money_to_default, send_to_staff
+from bazaar.goods.models import Product, CompositeProduct
+from bazaar.settings import bazaar_settings
+from bazaar.utils import (money_to_default, send_to_staff, convert_many, clear_rates, get_subclass,
+                          resolve_subclasses)
+from djmoney_rates.models import Rate
 
 from .base import BaseTestCase
+from .factories import ProductFactory, CompositeProductFactory
 
 
 class TestUtils(BaseTestCase):
@@ -17,6 +22,41 @@ class TestUtils(BaseTestCase):
         money = money_to_default(1.5)
         self.assertEqual(money, Money(1.5, "EUR"))
 
+    def test_rates_are_cached(self):
+        clear_rates()
+        money_to_default(Money(1.0, "USD"))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(money_to_default(Money(2.0, "USD")), Money(1.48, "EUR"))
+
+    def test_rates_expire(self):
+        clear_rates()
+        with mock.patch.object(bazaar_settings, "EXCHANGE_RATES_TIMEOUT", -1):
+            money_to_default(Money(1.0, "USD"))
+
+            with self.assertNumQueries(2):
+                money_to_default(Money(1.0, "USD"))
+        clear_rates()
+
+    def test_rates_are_cleared_when_updated(self):
+        # the updated rate is rolled back at the end of the test
+        self.addCleanup(clear_rates)
+        money_to_default(Money(1.0, "USD"))
+
+        rate = Rate.objects.get(currency="EUR")
+        rate.value = 0.5
+        rate.save()
+
+        self.assertEqual(money_to_default(Money(1.0, "USD")), Money(0.5, "EUR"))
+
+    def test_convert_many(self):
+        clear_rates()
+
+        with self.assertNumQueries(2):
+            values = convert_many([Money(1.0, "USD"), 1.5, Money(2, "EUR"), Money(10, "USD")])
+
+        self.assertEqual(values, [Money(0.74, "EUR"), Money(1.5, "EUR"), Money(2, "EUR"), Money(7.4, "EUR")])
+
     @mock.patch('bazaar.utils.stored_messages.add_message_for')
     def test_send_to_staff_should_attach_tags_if_explicitly_passed(self, patched):
         send_to_staff('error', None, 'test_tag')
@@ -28,3 +68,17 @@ class TestUtils(BaseTestCase):
         send_to_staff('error', None)
         arguments = patched.call_args[0]
         self.assertEqual(arguments[3], '')
+
+    def test_resolve_subclasses(self):
+        product = ProductFactory()
+        composite = CompositeProductFactory()
+        products = list(Product.objects.filter(pk__in=[product.pk, composite.pk]).order_by("pk"))
+
+        with self.assertNumQueries(1):
+            subclasses = resolve_subclasses(products + [None])
+
+        self.assertEqual([subclass.__class__ for subclass in subclasses], [Product, CompositeProduct])
+        self.assertEqual(subclasses[1].pk, composite.pk)
+
+        with self.assertNumQueries(0):
+            self.assertIsInstance(get_subclass(products[1]), CompositeProduct)
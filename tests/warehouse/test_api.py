@@ -1,17 +1,26 @@
 from __future__ import unicode_literals
-from django.dispatch import receiver
 
-from django.test import TestCase
+import threading
+
+from django.db import connection, transaction
+from django.db.models.query import QuerySet
+from django.dispatch import receiver
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from bazaar.settings import bazaar_settings
 
+import mock
+
+from bazaar.warehouse.dispatch import coalesce_changed_signals
 from bazaar.warehouse.exceptions import MovementException
 from bazaar.warehouse.models import Movement, Stock, Location
-from bazaar.warehouse.api import move, get_stock_price, get_stock_quantity
+from bazaar.warehouse.api import move, move_many, get_stock_price, get_stock_quantity, get_stock_summary
 
 from moneyed import Money
 from bazaar.warehouse.signals import lost_and_found_changed, supplier_changed, storage_changed, output_changed, customer_changed
+from bazaar.warehouse.stocks import lock_stocks
 
-from ..base import BaseTestCase
+from ..base import BaseTestCase, run_commit_hooks
 from ..factories import (ProductFactory, StorageFactory, SupplierFactory, StockFactory,
                          CustomerFactory, OutputFactory, LostFoundFactory, CompositeProductFactory, ProductSetFactory)
 
@@ -51,6 +60,218 @@ class TestMovementApi(BaseTestCase):
         self.assertEqual(movement.original_unit_price, Money(1.0, "USD"))
 
 
+class TestMoveManyApi(BaseTestCase):
+    def setUp(self):
+        self.product_a = ProductFactory()
+        self.product_b = ProductFactory()
+        self.storage = StorageFactory()
+        self.supplier = SupplierFactory()
+        self.output = OutputFactory()
+
+    def _movements(self, product):
+        return [
+            Movement(from_location=self.supplier, to_location=self.storage, product=product,
+                     quantity=10, unit_price=1.0),
+            Movement(from_location=self.supplier, to_location=self.storage, product=product,
+                     quantity=10, unit_price=0.5),
+            Movement(from_location=self.storage, to_location=self.output, product=product,
+                     quantity=5, unit_price=2.5),
+            Movement(from_location=self.supplier, to_location=self.storage, product=product,
+                     quantity=20, unit_price=0.4),
+            Movement(from_location=self.output, to_location=self.storage, product=product,
+                     quantity=2, unit_price=3.0),
+        ]
+
+    def test_move_many_creates_movements(self):
+        move_many(self._movements(self.product_a))
+
+        self.assertEqual(Movement.objects.filter(product=self.product_a).count(), 5)
+
+    def test_move_many_raise_error_with_invalid_quantity(self):
+        movements = [Movement(from_location=self.supplier, to_location=self.storage, product=self.product_a,
+                              quantity=0, unit_price=1.0)]
+
+        with self.assertRaises(MovementException):
+            move_many(movements)
+
+        self.assertFalse(Movement.objects.exists())
+
+    def test_move_many_converts_currency(self):
+        move_many([Movement(from_location=self.supplier, to_location=self.storage, product=self.product_a,
+                            quantity=10, unit_price=Money(1.0, "USD"))])
+
+        movement = Movement.objects.get(from_location=self.supplier, to_location=self.storage)
+
+        self.assertEqual(movement.unit_price, Money(0.74, "EUR"))
+        self.assertEqual(movement.original_unit_price, Money(1.0, "USD"))
+
+    def test_move_many_stocks_match_move(self):
+        movements = self._movements(self.product_a)
+        move(self.supplier, self.storage, self.product_a, 4, 2.0)
+        for movement in movements[1:] + movements[:1]:
+            move(movement.from_location, movement.to_location, movement.product, movement.quantity,
+                 movement.unit_price)
+
+        # preexisting stocks are updated too
+        movements = self._movements(self.product_b)
+        move(self.supplier, self.storage, self.product_b, 4, 2.0)
+        move_many(movements[1:])
+        move_many(movements[:1])
+
+        for location in (self.supplier, self.storage, self.output):
+            stock_a = Stock.objects.get(location=location, product=self.product_a)
+            stock_b = Stock.objects.get(location=location, product=self.product_b)
+
+            self.assertEqual(stock_a.quantity, stock_b.quantity)
+            self.assertEqual(stock_a.unit_price, stock_b.unit_price)
+
+    def _receive(self, count):
+        """
+        Moves a unit of `count` products already in stock to the storage, returns the
+        captured queries
+        """
+        products = [ProductFactory() for i in range(count)]
+        for product in products:
+            move(self.supplier, self.storage, product, 1, 1.0)
+
+        with CaptureQueriesContext(connection) as queries:
+            move_many([Movement(from_location=self.supplier, to_location=self.storage, product=product,
+                                quantity=2, unit_price=2.5) for product in products])
+
+        for product in products:
+            self.assertEqual(Stock.objects.get(location=self.storage, product=product).quantity, 3)
+            self.assertEqual(Stock.objects.get(location=self.storage, product=product).unit_price, Money(2, "EUR"))
+            self.assertEqual(Stock.objects.get(location=self.supplier, product=product).quantity, -3)
+        return queries.captured_queries
+
+    def test_move_many_updates_stocks_with_constant_statements(self):
+        few, many = self._receive(2), self._receive(20)
+
+        updates = [query for query in many if 'UPDATE "warehouse_stock"' in query["sql"]]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(len(many), len(few))
+
+    def test_move_many_sends_one_signal_per_stock(self):
+        self.changed = []
+
+        @receiver(storage_changed)
+        def storage_listener(sender, product, **kwargs):
+            self.changed.append((sender.location, product))
+
+        with run_commit_hooks():
+            move_many(self._movements(self.product_a) + self._movements(self.product_b))
+
+        self.assertEqual(len(self.changed), 2)
+        self.assertIn((self.storage, self.product_a), self.changed)
+        self.assertIn((self.storage, self.product_b), self.changed)
+
+
+class TestStockLocks(TestCase):
+    def setUp(self):
+        self.product = ProductFactory()
+        self.storage = StorageFactory()
+        self.supplier = SupplierFactory()
+        self.output = OutputFactory()
+
+    def _locked_location_ids(self, func):
+        """
+        Returns the ids of the locations whose stocks are got for update by `func`, in order
+        """
+        locked = []
+        get_or_create = QuerySet.get_or_create
+
+        def record(qs, **kwargs):
+            if qs.model is Stock:
+                self.assertTrue(qs.query.select_for_update)
+                locked.append(kwargs["location"].pk)
+            return get_or_create(qs, **kwargs)
+
+        with mock.patch.object(QuerySet, "get_or_create", autospec=True, side_effect=record):
+            func()
+
+        return locked
+
+    def test_stocks_are_locked_in_location_order(self):
+        locations = [self.output, self.supplier, self.storage]
+
+        with transaction.atomic():
+            locked = self._locked_location_ids(lambda: lock_stocks(self.product, locations))
+
+        self.assertEqual(locked, sorted(location.pk for location in locations))
+
+    def test_move_locks_stocks_in_location_order(self):
+        expected = sorted([self.output.pk, self.storage.pk])
+
+        # stock receivers get for update the rows already locked by `move`
+        locked = self._locked_location_ids(lambda: move(self.output, self.storage, self.product, 1, 1.0))
+        self.assertEqual(locked[:2], expected)
+
+        locked = self._locked_location_ids(lambda: move(self.storage, self.output, self.product, 1, 1.0))
+        self.assertEqual(locked[:2], expected)
+
+
+class TestConcurrentMovements(TransactionTestCase):
+    threads = 8
+    moves_per_thread = 10
+
+    def setUp(self):
+        self.product = ProductFactory()
+        self.storage = StorageFactory()
+        self.supplier = SupplierFactory()
+        self.output = OutputFactory()
+
+    def _run_in_threads(self, target):
+        errors = []
+
+        def worker():
+            try:
+                for i in range(self.moves_per_thread):
+                    target(i)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+
+    def test_parallel_moves_do_not_lose_updates(self):
+        # averages of different prices would depend on the order of the moves
+        self._run_in_threads(lambda i: move(self.supplier, self.storage, self.product, 2, 1.5))
+
+        total = self.threads * self.moves_per_thread * 2
+        storage_stock = Stock.objects.get(location=self.storage, product=self.product)
+        supplier_stock = Stock.objects.get(location=self.supplier, product=self.product)
+
+        self.assertEqual(storage_stock.quantity, total)
+        self.assertEqual(supplier_stock.quantity, -total)
+        self.assertEqual(storage_stock.unit_price, Money("1.5", "EUR"))
+        self.assertEqual(Movement.objects.count(), self.threads * self.moves_per_thread)
+
+    def test_parallel_moves_in_both_directions(self):
+        move(self.supplier, self.storage, self.product, 1000, 1.0)
+
+        def target(i):
+            if i % 2:
+                move(self.storage, self.output, self.product, 3, 1.0)
+            else:
+                move(self.output, self.storage, self.product, 1, 1.0)
+
+        self._run_in_threads(target)
+
+        expected = 1000 - self.threads * (self.moves_per_thread // 2) * 2
+        storage_stock = Stock.objects.get(location=self.storage, product=self.product)
+        output_stock = Stock.objects.get(location=self.output, product=self.product)
+
+        self.assertEqual(storage_stock.quantity, expected)
+        self.assertEqual(output_stock.quantity, 1000 - expected)
+
+
 class TestSignalsApi(TestCase):
     def setUp(self):
         self.product = ProductFactory()
@@ -79,7 +300,8 @@ class TestSignalsApi(TestCase):
 
         quantity = 10
         price = Money(3, bazaar_settings.DEFAULT_CURRENCY)
-        move(self.lostfound, self.supplier, self.product, quantity, price)
+        with run_commit_hooks():
+            move(self.lostfound, self.supplier, self.product, quantity, price)
         lostandfound_stock = Stock.objects.get(location=self.lostfound, product=self.product)
         supplier_stock = Stock.objects.get(location=self.supplier, product=self.product)
 
@@ -113,7 +335,8 @@ class TestSignalsApi(TestCase):
 
         quantity = 20
         price = Money(3, bazaar_settings.DEFAULT_CURRENCY)
-        move(self.supplier, self.storage, self.product, quantity, price)
+        with run_commit_hooks():
+            move(self.supplier, self.storage, self.product, quantity, price)
         supplier_stock = Stock.objects.get(location=self.supplier, product=self.product)
         storage_stock = Stock.objects.get(location=self.storage, product=self.product)
 
@@ -147,7 +370,8 @@ class TestSignalsApi(TestCase):
 
         quantity = 20
         price = Money(3, bazaar_settings.DEFAULT_CURRENCY)
-        move(self.storage, self.output, self.product, quantity, price)
+        with run_commit_hooks():
+            move(self.storage, self.output, self.product, quantity, price)
         storage_stock = Stock.objects.get(location=self.storage, product=self.product)
         output_stock = Stock.objects.get(location=self.output, product=self.product)
 
@@ -182,7 +406,8 @@ class TestSignalsApi(TestCase):
 
         quantity = 20
         price = Money(3, bazaar_settings.DEFAULT_CURRENCY)
-        move(self.output, self.customer, self.product, quantity, price)
+        with run_commit_hooks():
+            move(self.output, self.customer, self.product, quantity, price)
         output_stock = Stock.objects.get(location=self.output, product=self.product)
         customer_stock = Stock.objects.get(location=self.customer, product=self.product)
 
@@ -197,6 +422,119 @@ class TestSignalsApi(TestCase):
 
         self.assertEqual(self.s_customer_sender.unit_price, price)
 
+    def test_composite_move_sends_one_signal_per_product(self):
+        product = ProductFactory()
+        composite = CompositeProductFactory()
+        other_composite = CompositeProductFactory()
+        ProductSetFactory(composite=composite, product=self.product, quantity=1)
+        ProductSetFactory(composite=composite, product=product, quantity=2)
+        ProductSetFactory(composite=other_composite, product=product, quantity=1)
+
+        self.product.move(self.supplier, self.storage, quantity=10)
+        product.move(self.supplier, self.storage, quantity=10)
+
+        self.changed = {}
+
+        @receiver(storage_changed)
+        def storage_listener(sender, product, **kwargs):
+            self.assertNotIn(product, self.changed)
+            self.changed[product] = sender
+
+        with run_commit_hooks():
+            composite.move(self.storage, self.output, quantity=2)
+
+        self.assertEqual(set(self.changed), set([self.product, product, composite.product_ptr,
+                                                 other_composite.product_ptr]))
+
+        # the sender is the final state of the stock
+        stock = Stock.objects.get(location=self.storage, product=product)
+        self.assertEqual(stock.quantity, 6)
+        self.assertEqual(self.changed[product], stock)
+        self.assertEqual(self.changed[product].quantity, 6)
+        self.assertEqual(self.changed[other_composite.product_ptr].quantity, 6)
+        self.assertEqual(self.changed[composite.product_ptr].quantity, 3)
+
+    def test_coalesced_signals_are_discarded_on_error(self):
+        self.changed = []
+
+        @receiver(storage_changed)
+        def storage_listener(sender, product, **kwargs):
+            self.changed.append(sender.quantity)
+
+        with run_commit_hooks():
+            with coalesce_changed_signals():
+                move(self.supplier, self.storage, self.product, 10, 1.0)
+                try:
+                    with coalesce_changed_signals():
+                        move(self.supplier, self.storage, ProductFactory(), 10, 1.0)
+                        raise MovementException()
+                except MovementException:
+                    pass
+                move(self.supplier, self.storage, self.product, 5, 1.0)
+
+                self.assertEqual(self.changed, [])
+
+        self.assertEqual(self.changed, [15])
+
+        with run_commit_hooks():
+            try:
+                with coalesce_changed_signals():
+                    move(self.supplier, self.storage, self.product, 5, 1.0)
+                    raise MovementException()
+            except MovementException:
+                pass
+
+        self.assertEqual(self.changed, [15])
+
+
+class TestSignalsOnCommit(TransactionTestCase):
+    def setUp(self):
+        self.product = ProductFactory()
+        self.storage = StorageFactory()
+        self.supplier = SupplierFactory()
+
+        self.changed = []
+
+        @receiver(storage_changed, weak=False)
+        def storage_listener(sender, product, **kwargs):
+            self.changed.append((sender.quantity, transaction.get_connection().in_atomic_block))
+
+        self.addCleanup(storage_changed.disconnect, storage_listener)
+
+    def test_moves_in_a_transaction_send_one_signal_on_commit(self):
+        with transaction.atomic():
+            move(self.supplier, self.storage, self.product, 10, 1.0)
+            move(self.supplier, self.storage, self.product, 5, 1.0)
+
+            self.assertEqual(self.changed, [])
+
+        self.assertEqual(self.changed, [(15, False)])
+
+    def test_moves_in_a_transaction_rolled_back_send_no_signals(self):
+        try:
+            with transaction.atomic():
+                move(self.supplier, self.storage, self.product, 10, 1.0)
+                move(self.supplier, self.storage, self.product, 5, 1.0)
+                raise ValueError
+        except ValueError:
+            pass
+
+        self.assertEqual(self.changed, [])
+        self.assertFalse(Stock.objects.filter(product=self.product).exists())
+
+        # signals of the rolled back transaction are not sent by the next one
+        move(self.supplier, self.storage, self.product, 1, 1.0)
+        self.assertEqual(self.changed, [(1, False)])
+
+    def test_transaction_in_block_sends_signals_when_the_block_exits(self):
+        with coalesce_changed_signals():
+            move(self.supplier, self.storage, self.product, 10, 1.0)
+            move(self.supplier, self.storage, self.product, 5, 1.0)
+
+            self.assertEqual(self.changed, [])
+
+        self.assertEqual(self.changed, [(15, False)])
+
 
 class TestStock(TestCase):
     def setUp(self):
@@ -327,3 +665,48 @@ class TestStockApi(TestCase):
             price = get_stock_price(product, Location.LOCATION_STORAGE)
 
         self.assertEqual(price, Money(3.0, "EUR"))
+
+
+class TestStockSummaryApi(TestCase):
+    def setUp(self):
+        self.product_a = ProductFactory()
+        self.stock_a = StockFactory(product=self.product_a, unit_price=2.0, quantity=30)
+        self.stock_b = StockFactory(product=self.product_a, unit_price=4.0, quantity=10)
+        self.stock_c = StockFactory(product=self.product_a, unit_price=3.0, quantity=10,
+                                    location=OutputFactory())
+
+        self.product_b = ProductFactory()
+        self.stock_d = StockFactory(product=self.product_b, unit_price=1.0, quantity=0)
+        self.stock_e = StockFactory(product=self.product_b, unit_price=3.0, quantity=0)
+
+        self.product_c = ProductFactory()
+
+    def test_get_stock_summary_runs_a_single_query(self):
+        with self.assertNumQueries(1):
+            summary = get_stock_summary([self.product_a, self.product_b, self.product_c])
+
+        with self.assertNumQueries(0):
+            summary.get_quantity(self.product_a, Location.LOCATION_STORAGE)
+            summary.get_price(self.product_b, Location.LOCATION_STORAGE)
+
+    def test_get_stock_summary_matches_stock_api(self):
+        summary = get_stock_summary([self.product_a, self.product_b, self.product_c])
+
+        location_types = (None, Location.LOCATION_STORAGE, Location.LOCATION_OUTPUT,
+                          [Location.LOCATION_STORAGE, Location.LOCATION_OUTPUT])
+
+        for product in (self.product_a, self.product_b, self.product_c):
+            for location_type in location_types:
+                self.assertEqual(summary.get_quantity(product, location_type),
+                                 get_stock_quantity(product, location_type))
+                self.assertEqual(summary.get_price(product, location_type),
+                                 get_stock_price(product, location_type))
+
+    def test_get_stock_summary_values(self):
+        summary = get_stock_summary([self.product_a.pk, self.product_b.pk], Location.LOCATION_STORAGE)
+
+        self.assertEqual(summary.get_quantity(self.product_a), 40)
+        self.assertEqual(summary.get_price(self.product_a), Money(2.5, "EUR"))
+        self.assertEqual(summary.get_quantity(self.product_b), 0)
+        self.assertEqual(summary.get_price(self.product_b), Money(2, "EUR"))
+        self.assertEqual(summary.get_quantity(self.product_a, Location.LOCATION_OUTPUT), 0)
@@ -0,0 +1,120 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from bazaar.listings.models import Order
+from bazaar.warehouse.api import move
+from bazaar.warehouse.availability import AvailabilityBackend, get_availability_backend, get_available_quantity
+
+from ..base import run_commit_hooks
+from ..factories import (ProductFactory, StorageFactory, SupplierFactory, OutputFactory, ListingFactory,
+                         PublishingFactory, OrderFactory, StockFactory)
+
+
+class TestAvailabilityBackend(TestCase):
+    def setUp(self):
+        cache.clear()
+
+        self.storage = StorageFactory()
+        self.supplier = SupplierFactory()
+        self.output = OutputFactory()
+
+        self.product = ProductFactory()
+        self.other = ProductFactory()
+        move(self.supplier, self.storage, self.product, 10, 1.0)
+        move(self.supplier, self.storage, self.other, 5, 1.0)
+
+        self.publishing = PublishingFactory(listing=ListingFactory(product=self.product))
+        OrderFactory(publishing=self.publishing, quantity=2)
+        OrderFactory(publishing=PublishingFactory(listing=ListingFactory(product=self.product)), quantity=3)
+        OrderFactory(publishing=self.publishing, quantity=4, status=Order.ORDER_COMPLETED)
+
+    def test_default_backend(self):
+        self.assertIsInstance(get_availability_backend(), AvailabilityBackend)
+
+    def test_available(self):
+        stock = self.product.stocks.get(location=self.storage)
+        self.assertEqual(AvailabilityBackend().available(stock), 5)
+
+    def test_available_quantities(self):
+        missing = ProductFactory()
+
+        with self.assertNumQueries(2):
+            quantities = AvailabilityBackend().get_available_quantities([self.product, self.other.pk, missing])
+
+        self.assertEqual(quantities, {self.product.pk: 5, self.other.pk: 5, missing.pk: 0})
+
+    def test_available_quantities_are_cached(self):
+        self.assertEqual(get_available_quantity(self.product), 5)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_available_quantity(self.product), 5)
+
+    def test_cache_is_invalidated_on_order_change(self):
+        self.assertEqual(get_available_quantity(self.product), 5)
+
+        with run_commit_hooks():
+            order = OrderFactory(publishing=self.publishing, quantity=1)
+        self.assertEqual(get_available_quantity(self.product), 4)
+
+        order.status = Order.ORDER_COMPLETED
+        with run_commit_hooks():
+            order.save()
+        self.assertEqual(get_available_quantity(self.product), 5)
+
+        with run_commit_hooks():
+            order.delete()
+            Order.objects.filter(status=Order.ORDER_PENDING).delete()
+        self.assertEqual(get_available_quantity(self.product), 10)
+
+    def test_cache_is_invalidated_when_the_transaction_commits(self):
+        self.assertEqual(get_available_quantity(self.product), 5)
+
+        with run_commit_hooks():
+            OrderFactory(publishing=self.publishing, quantity=1)
+            # until then the committed quantity is still cached
+            self.assertEqual(get_available_quantity(self.product), 5)
+
+        self.assertEqual(get_available_quantity(self.product), 4)
+
+    def test_cache_is_invalidated_when_order_moves_to_another_publishing(self):
+        publishing = PublishingFactory(listing=ListingFactory(product=self.other))
+        with run_commit_hooks():
+            order = OrderFactory(publishing=self.publishing, quantity=1)
+        self.assertEqual(get_available_quantity(self.product), 4)
+        self.assertEqual(get_available_quantity(self.other), 5)
+
+        order.publishing = publishing
+        with run_commit_hooks():
+            order.save()
+        self.assertEqual(get_available_quantity(self.product), 5)
+        self.assertEqual(get_available_quantity(self.other), 4)
+
+    def test_order_move_invalidates_with_one_query(self):
+        publishing = PublishingFactory(listing=ListingFactory(product=self.other))
+        with run_commit_hooks():
+            order = Order.objects.get(pk=OrderFactory(publishing=self.publishing, quantity=1).pk)
+        self.assertEqual(get_available_quantity(self.product), 4)
+
+        order.publishing = publishing
+        # the order UPDATE and the products of both publishings
+        with self.assertNumQueries(2), run_commit_hooks():
+            order.save()
+
+        self.assertEqual(get_available_quantity(self.product), 5)
+        self.assertEqual(get_available_quantity(self.other), 4)
+
+    def test_cache_is_invalidated_on_stock_change(self):
+        self.assertEqual(get_available_quantity(self.other), 5)
+
+        with run_commit_hooks():
+            move(self.storage, self.output, self.other, 2, 1.0)
+        self.assertEqual(get_available_quantity(self.other), 3)
+
+        product = ProductFactory()
+        self.assertEqual(get_available_quantity(product), 0)
+        with run_commit_hooks():
+            StockFactory(product=product, location=self.storage, quantity=7)
+        self.assertEqual(get_available_quantity(product), 7)
@@ -0,0 +1,165 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.dispatch import receiver
+from django.test import TestCase
+import mock
+from moneyed import Money
+
+from bazaar.goods.models import Product
+from bazaar.warehouse.api import (move, get_stock_quantity, get_stock_summary, get_storage_price,
+                                  get_storage_quantity)
+from bazaar.warehouse.backends import (STOCK_VIEW_NAME, TableStockBackend, ViewStockBackend, get_relation_type,
+                                       get_stock_backend)
+from bazaar.warehouse.models import CompositeStock, Location, Movement, Stock
+from bazaar.warehouse.signals import storage_changed
+
+from ..base import run_commit_hooks
+from ..factories import (ProductFactory, StorageFactory, SupplierFactory, OutputFactory, CompositeProductFactory,
+                         ProductSetFactory)
+
+
+class TestStockBackends(TestCase):
+    def setUp(self):
+        self.product = ProductFactory()
+        self.storage = StorageFactory()
+        self.supplier = SupplierFactory()
+        self.output = OutputFactory()
+
+    def test_default_backend(self):
+        self.assertIsInstance(get_stock_backend(), TableStockBackend)
+        self.assertTrue(get_stock_backend().stores_stocks)
+
+    def test_view_matches_table(self):
+        move(self.supplier, self.storage, self.product, 10, 1.0)
+        move(self.supplier, self.storage, self.product, 30, 2.0)
+        move(self.storage, self.output, self.product, 5, 3.0)
+
+        ViewStockBackend().install(name="test_stockview")
+        cursor = connection.cursor()
+        cursor.execute("SELECT location_id, quantity, unit_price, unit_price_currency FROM test_stockview "
+                       "WHERE product_id = %s", [self.product.pk])
+        view = dict((location_id, (Decimal(repr(quantity)), Decimal(repr(unit_price)), currency))
+                    for location_id, quantity, unit_price, currency in cursor.fetchall())
+        cursor.execute("DROP VIEW test_stockview")
+
+        for stock in Stock.objects.filter(product=self.product):
+            self.assertEqual(view[stock.location_id][0], stock.quantity)
+            self.assertEqual(view[stock.location_id][2], "EUR")
+
+        # the view price is the average price of the incoming movements
+        self.assertEqual(view[self.storage.pk][1], Decimal("1.75"))
+        self.assertEqual(view[self.output.pk][1], Decimal("3"))
+
+    @mock.patch("bazaar.warehouse.backends._backend", ViewStockBackend())
+    def test_view_backend_only_writes_movements(self):
+        composite = CompositeProductFactory()
+        ProductSetFactory(composite=composite, product=self.product, quantity=2)
+
+        self.changed = []
+
+        @receiver(storage_changed)
+        def storage_listener(sender, product, **kwargs):
+            self.changed.append(product)
+
+        Stock.objects.all().delete()
+        with run_commit_hooks():
+            self.product.move(self.supplier, self.storage, quantity=10)
+
+        self.assertEqual(Movement.objects.count(), 1)
+        self.assertFalse(Stock.objects.exists())
+        self.assertTrue(CompositeStock.objects.filter(product=composite, location=self.storage).exists())
+        self.assertEqual([product.pk for product in self.changed], [composite.pk])
+
+
+class TestViewStockBackend(TestCase):
+    """
+    Runs the stock api and the products annotations against the installed stock view
+    """
+    def setUp(self):
+        patcher = mock.patch("bazaar.warehouse.backends._backend", ViewStockBackend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.product = ProductFactory()
+        self.storage = StorageFactory()
+        self.supplier = SupplierFactory()
+        self.output = OutputFactory()
+
+        # stocks written while the table backend was in use
+        self.composite = CompositeProductFactory()
+        Stock.objects.create(product=self.composite, location=self.storage, quantity=3, unit_price=4)
+
+        # the view replaces the stock table, until the test transaction is rolled back
+        get_stock_backend().install()
+        self.assertEqual(get_relation_type(STOCK_VIEW_NAME), "VIEW")
+
+        move(self.supplier, self.storage, self.product, 10, 1.0)
+        move(self.supplier, self.storage, self.product, 30, 2.0)
+        move(self.storage, self.output, self.product, 5, 3.0)
+
+    def test_install_replaces_the_stock_table(self):
+        self.assertTrue(CompositeStock.objects.filter(product=self.composite, location=self.storage,
+                                                      quantity=3).exists())
+        self.assertEqual(get_storage_quantity(self.composite), 3)
+
+        # installing again replaces the view
+        get_stock_backend().install()
+        self.assertEqual(get_storage_quantity(self.product), 35)
+
+    def test_quantities(self):
+        self.assertEqual(get_storage_quantity(self.product), 35)
+        self.assertEqual(get_stock_quantity(self.product, [Location.LOCATION_STORAGE, Location.LOCATION_OUTPUT]), 40)
+        self.assertEqual(get_stock_quantity(self.product, Location.LOCATION_SUPPLIER), -40)
+
+        summary = get_stock_summary([self.product, self.composite], Location.LOCATION_STORAGE)
+        self.assertEqual(summary.get_quantity(self.product), 35)
+        self.assertEqual(summary.get_quantity(self.composite), 3)
+        self.assertEqual(summary.get_available(self.product), 35)
+
+        self.assertEqual(Product.objects.with_stock_cache().get(pk=self.product.pk).quantity, 35)
+
+    def test_quantity_annotations(self):
+        product = Product.objects.with_stock_quantity(self.storage.id, self.output.id).get(pk=self.product.pk)
+        self.assertEqual(product.stock_quantity, 40)
+
+        product = Product.objects.with_availability(self.storage.id).get(pk=self.product.pk)
+        self.assertEqual(product.availability, 35)
+
+        products = Product.objects.with_stock_metrics(availability=self.storage.id, stock_quantity=self.output.id)
+        product = products.get(pk=self.product.pk)
+        self.assertEqual((product.availability, product.stock_quantity), (35, 5))
+
+    def test_prices(self):
+        # average price of the incoming movements, not the running average
+        self.assertEqual(get_storage_price(self.product), Money("1.75", "EUR"))
+        summary = get_stock_summary([self.product], Location.LOCATION_STORAGE)
+        self.assertEqual(summary.get_price(self.product), Money("1.75", "EUR"))
+        self.assertEqual(self.product.cost, Money("1.75", "EUR"))
+
+        product = Product.objects.with_stock_price(Location.LOCATION_STORAGE).get(pk=self.product.pk)
+        self.assertEqual(product.stock_price, Decimal("1.75"))
+
+        product = Product.objects.with_total_avr_cost(self.storage.id).get(pk=self.product.pk)
+        self.assertEqual(product.total_avr_cost, Decimal("1.75"))
+
+        product = Product.objects.with_stock_metrics(total_avr_cost=self.storage.id).get(pk=self.product.pk)
+        self.assertEqual(product.total_avr_cost, Decimal("1.75"))
+
+    def test_pages_render(self):
+        ProductSetFactory(composite=self.composite, product=self.product, quantity=2)
+        user = get_user_model().objects.create_user(username="test", email="test@test.it", password="test")
+        self.client.login(username=user.username, password="test")
+
+        for pk in (self.product.pk, self.composite.pk):
+            response = self.client.get(reverse("bazaar:product-detail", kwargs={"pk": pk}))
+            self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(reverse("bazaar:listing-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context_data["listing_list"])
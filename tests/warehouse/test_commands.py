@@ -0,0 +1,429 @@
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q, Sum
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.six import StringIO
+
+import mock
+from moneyed import Money
+
+from bazaar.goods.models import CompositeProduct
+from bazaar.warehouse.api import move, get_stock_price, get_stock_quantity, get_storage_quantity
+from bazaar.warehouse.models import Location, Movement, MovementRollup, Stock, StockSnapshot
+
+from ..factories import (ProductFactory, StorageFactory, SupplierFactory, OutputFactory, CompositeProductFactory,
+                         ProductSetFactory)
+
+
+class TestRebuildStockCommand(TestCase):
+    def setUp(self):
+        self.product = ProductFactory()
+        self.storage = StorageFactory()
+        self.supplier = SupplierFactory()
+        self.output = OutputFactory()
+
+        move(self.supplier, self.storage, self.product, 10, 1.0)
+        move(self.supplier, self.storage, self.product, 10, 0.5)
+        move(self.storage, self.output, self.product, 5, 2.0)
+        move(self.supplier, self.storage, self.product, 20, 0.4)
+
+        composite = CompositeProductFactory()
+        ProductSetFactory(composite=composite, product=self.product, quantity=2)
+
+    def _call(self, *args, **kwargs):
+        out = StringIO()
+        call_command("rebuild_stock", *args, stdout=out, chunk_size=2, **kwargs)
+        return out.getvalue()
+
+    def test_no_drift(self):
+        output = self._call()
+
+        self.assertIn("4 movements replayed", output)
+        self.assertIn("0 stocks differ from movements", output)
+
+    @skipUnless(connection.vendor == "sqlite", "reads the sqlite query plan")
+    def test_movement_chunks_are_index_scans(self):
+        # the query of the chunks after the first one, see `iter_movements`
+        last_id, last_date = Movement.objects.order_by("date", "id").values_list("id", "date")[0]
+        movements = Movement.objects.filter(Q(date__gt=last_date) | Q(date=last_date, id__gt=last_id),
+                                            date__gte=last_date)
+        sql, params = movements.order_by("date", "id").values_list("id", "date")[:2].query.sql_with_params()
+
+        cursor = connection.cursor()
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        plan = " ".join("%s" % row[-1] for row in cursor.fetchall())
+
+        self.assertIn("INDEX", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_drift_is_reported(self):
+        Stock.objects.filter(location=self.storage).update(quantity=3)
+        Stock.objects.filter(location=self.output).delete()
+
+        output = self._call()
+
+        self.assertIn("2 stocks differ from movements", output)
+        self.assertEqual(Stock.objects.get(location=self.storage, product=self.product).quantity, 3)
+
+    def test_drift_is_fixed(self):
+        Stock.objects.filter(location=self.storage).update(quantity=3, unit_price=Money(7, "EUR"))
+        Stock.objects.filter(location=self.output).delete()
+
+        output = self._call(fix=True)
+
+        self.assertIn("2 stocks fixed", output)
+
+        storage_stock = Stock.objects.get(location=self.storage, product=self.product)
+        output_stock = Stock.objects.get(location=self.output, product=self.product)
+
+        self.assertEqual(storage_stock.quantity, 35)
+        self.assertEqual(storage_stock.unit_price, Money("0.55", "EUR"))
+        self.assertEqual(output_stock.quantity, 5)
+        self.assertEqual(output_stock.unit_price, Money(2, "EUR"))
+
+        self.assertIn("0 stocks differ from movements", self._call())
+
+    def test_fix_keeps_movements_done_after_comparing(self):
+        from bazaar.warehouse.management.commands.rebuild_stock import Command
+
+        Stock.objects.filter(location=self.storage).update(quantity=3)
+        compare = Command.compare
+
+        def compare_and_move(command, ledger, chunk_size):
+            drifts = compare(command, ledger, chunk_size)
+            move(self.supplier, self.storage, self.product, 5, 0.4)
+            return drifts
+
+        with mock.patch.object(Command, "compare", compare_and_move):
+            output = self._call(fix=True)
+
+        self.assertIn("1 stocks fixed", output)
+        self.assertEqual(Stock.objects.get(location=self.storage, product=self.product).quantity, 40)
+        self.assertIn("0 stocks differ from movements", self._call())
+
+    def test_fix_updates_composites_and_availability(self):
+        composites = CompositeProduct.objects.all()
+        Stock.objects.filter(location=self.storage, product=self.product).update(quantity=3)
+
+        path = "bazaar.warehouse.management.commands.rebuild_stock.invalidate_availability"
+        with mock.patch(path) as invalidate_availability:
+            self._call(fix=True)
+
+        self.assertEqual(Stock.objects.get(location=self.storage, product__in=composites).quantity, 17)
+        invalidate_availability.assert_called_once_with(set([self.product.pk]))
+
+
+class TestSnapshotStockCommand(TestCase):
+    def setUp(self):
+        self.product = ProductFactory()
+        self.storage = StorageFactory()
+        self.supplier = SupplierFactory()
+        self.output = OutputFactory()
+
+        self.now = timezone.now()
+
+    def _move(self, from_location, to_location, quantity, days_ago):
+        move(from_location, to_location, self.product, quantity, 1.0)
+        Movement.objects.filter(pk=Movement.objects.latest().pk).update(date=self.now - timedelta(days=days_ago))
+
+    def _snapshot(self, days_ago):
+        call_command("snapshot_stock", stdout=StringIO())
+        StockSnapshot.objects.filter(date__gt=self.now).update(date=self.now - timedelta(days=days_ago))
+
+    def test_snapshot_copies_stocks(self):
+        self._move(self.supplier, self.storage, 10, days_ago=3)
+        self._snapshot(days_ago=2)
+
+        snapshot = StockSnapshot.objects.get(product=self.product, location=self.storage)
+
+        self.assertEqual(snapshot.quantity, 10)
+        self.assertEqual(StockSnapshot.objects.count(), 2)
+
+    def test_past_quantities(self):
+        self._move(self.supplier, self.storage, 10, days_ago=10)
+        self._move(self.storage, self.output, 3, days_ago=8)
+        self._snapshot(days_ago=6)
+        self._move(self.supplier, self.storage, 5, days_ago=5)
+        self._snapshot(days_ago=4)
+        self._move(self.storage, self.output, 1, days_ago=2)
+
+        def as_of(days_ago):
+            return self.now - timedelta(days=days_ago)
+
+        self.assertEqual(get_storage_quantity(self.product, as_of=as_of(11)), 0)
+        self.assertEqual(get_storage_quantity(self.product, as_of=as_of(9)), 10)
+        self.assertEqual(get_storage_quantity(self.product, as_of=as_of(7)), 7)
+        self.assertEqual(get_storage_quantity(self.product, as_of=as_of(5)), 12)
+        self.assertEqual(get_storage_quantity(self.product, as_of=as_of(3)), 12)
+        self.assertEqual(get_storage_quantity(self.product, as_of=as_of(1)), 11)
+        self.assertEqual(get_storage_quantity(self.product, as_of=as_of(1)), get_storage_quantity(self.product))
+
+        location_types = [Location.LOCATION_STORAGE, Location.LOCATION_OUTPUT]
+        self.assertEqual(get_stock_quantity(self.product, location_types, as_of=as_of(1)), 15)
+        self.assertEqual(get_stock_quantity(self.product, Location.LOCATION_SUPPLIER, as_of=as_of(7)), -10)
+
+    def test_past_quantities_use_nearest_snapshot(self):
+        self._move(self.supplier, self.storage, 10, days_ago=10)
+        self._snapshot(days_ago=6)
+
+        # movements before the snapshot are not read anymore
+        Movement.objects.all().delete()
+
+        self.assertEqual(get_storage_quantity(self.product, as_of=self.now - timedelta(days=5)), 10)
+
+    def test_snapshot_records_last_movement(self):
+        self._move(self.supplier, self.storage, 10, days_ago=3)
+        self._snapshot(days_ago=2)
+
+        snapshot = StockSnapshot.objects.get(product=self.product, location=self.storage)
+
+        self.assertEqual(snapshot.last_movement_id, Movement.objects.get().pk)
+
+    def test_past_quantities_include_movements_committed_after_snapshot(self):
+        self._move(self.supplier, self.storage, 10, days_ago=10)
+        self._snapshot(days_ago=6)
+        # dated before the snapshot, committed after it
+        self._move(self.supplier, self.storage, 5, days_ago=7)
+
+        self.assertEqual(get_storage_quantity(self.product, as_of=self.now - timedelta(days=5)), 15)
+        self.assertEqual(get_storage_quantity(self.product, as_of=self.now - timedelta(days=8)), 10)
+
+
+class TestArchiveMovementsCommand(TestCase):
+    def setUp(self):
+        self.product = ProductFactory()
+        self.storage = StorageFactory()
+        self.supplier = SupplierFactory()
+        self.output = OutputFactory()
+
+        self.now = timezone.now()
+
+    def _move(self, from_location, to_location, quantity, unit_price, days_ago):
+        move(from_location, to_location, self.product, quantity, unit_price)
+        Movement.objects.filter(pk=Movement.objects.latest().pk).update(date=self.now - timedelta(days=days_ago))
+
+    def _archive(self, days):
+        out = StringIO()
+        call_command("archive_movements", stdout=out, days=days, chunk_size=2)
+        return out.getvalue()
+
+    def test_old_movements_are_archived(self):
+        self._move(self.supplier, self.storage, 10, 1.0, days_ago=40)
+        self._move(self.supplier, self.storage, 10, 0.5, days_ago=40)
+        self._move(self.storage, self.output, 5, 2.0, days_ago=35)
+        self._move(self.supplier, self.storage, 20, 0.4, days_ago=1)
+
+        output = self._archive(days=30)
+
+        self.assertIn("3 movements archived", output)
+        self.assertEqual(Movement.objects.count(), 1)
+
+        rollup = MovementRollup.objects.get(from_location=self.supplier, to_location=self.storage)
+        self.assertEqual(rollup.quantity, 20)
+        self.assertEqual(rollup.value, Money(15, "EUR"))
+        self.assertEqual(rollup.count, 2)
+
+        self.assertEqual(StockSnapshot.objects.filter(archive=True).count(), 3)
+
+        # stocks can still be rebuilt from the remaining movements
+        out = StringIO()
+        call_command("rebuild_stock", stdout=out)
+        self.assertIn("1 movements replayed", out.getvalue())
+        self.assertIn("0 stocks differ from movements", out.getvalue())
+
+        as_of = self.now - timedelta(days=10)
+        self.assertEqual(get_storage_quantity(self.product, as_of=as_of), 15)
+        self.assertEqual(get_storage_quantity(self.product), 35)
+
+    def test_archiving_twice_merges_rollups(self):
+        self._move(self.supplier, self.storage, 10, 1.0, days_ago=40)
+        self._archive(days=40)
+        self._move(self.supplier, self.storage, 10, 1.0, days_ago=39)
+
+        self.assertIn("1 movements archived", self._archive(days=30))
+        self.assertIn("already archived", self._archive(days=31))
+
+        self.assertEqual(Movement.objects.count(), 0)
+        self.assertEqual(MovementRollup.objects.aggregate(Sum("count"))["count__sum"], 2)
+        self.assertEqual(MovementRollup.objects.aggregate(Sum("quantity"))["quantity__sum"], 20)
+
+    def test_archived_movements_are_deleted_in_chunks(self):
+        for days_ago in (45, 44, 43, 42, 41):
+            self._move(self.supplier, self.storage, 1, 1.0, days_ago=days_ago)
+        self._move(self.supplier, self.storage, 1, 1.0, days_ago=1)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIn("5 movements archived", self._archive(days=30))
+
+        # every 2 movements are deleted by their own date range
+        deletes = [query["sql"] for query in queries.captured_queries
+                   if 'DELETE FROM "warehouse_movement"' in query["sql"]]
+        self.assertEqual(len(deletes), 3)
+        self.assertEqual(list(Movement.objects.values_list("quantity", flat=True)), [1])
+
+    def test_interrupted_deletion_is_resumed(self):
+        self._move(self.supplier, self.storage, 10, 1.0, days_ago=40)
+        self._move(self.supplier, self.storage, 10, 1.0, days_ago=1)
+
+        with mock.patch("bazaar.warehouse.management.commands.archive_movements.Command.delete_movements"):
+            self._archive(days=30)
+        self.assertEqual(Movement.objects.count(), 2)
+
+        self.assertIn("already archived", self._archive(days=31))
+        self.assertEqual(Movement.objects.count(), 1)
+
+        out = StringIO()
+        call_command("rebuild_stock", stdout=out)
+        self.assertIn("0 stocks differ from movements", out.getvalue())
+
+    def test_past_quantities_before_the_archive_are_refused(self):
+        self._move(self.supplier, self.storage, 10, 1.0, days_ago=40)
+        self._move(self.supplier, self.storage, 10, 1.0, days_ago=35)
+        self._archive(days=30)
+
+        with self.assertRaises(ValueError):
+            get_storage_quantity(self.product, as_of=self.now - timedelta(days=38))
+
+        # the archive snapshot holds the quantities at the horizon
+        horizon = StockSnapshot.objects.filter(archive=True).latest("date").date
+        self.assertEqual(get_storage_quantity(self.product, as_of=horizon), 20)
+        self.assertEqual(get_storage_quantity(self.product, as_of=self.now - timedelta(days=10)), 20)
+
+        out = StringIO()
+        call_command("rebuild_stock", stdout=out)
+        self.assertIn("0 stocks differ from movements", out.getvalue())
+
+
+class TestImportMovementsCommand(TestCase):
+    def setUp(self):
+        self.product = ProductFactory(ean="8001", code="P1")
+        self.other = ProductFactory(ean="8002", code="P2", price=Money(2, "EUR"))
+        self.storage = StorageFactory()
+        self.supplier = SupplierFactory()
+
+        composite = CompositeProductFactory(ean="9001")
+        ProductSetFactory(composite=composite, product=self.product, quantity=2)
+        self.composite = composite
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def _write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with io.open(path, "w", encoding="utf-8") as stream:
+            stream.write(content)
+        return path
+
+    def _call(self, path, **kwargs):
+        out = StringIO()
+        call_command("import_movements", path, stdout=out, stderr=StringIO(), chunk_size=2, **kwargs)
+        return out.getvalue()
+
+    def test_import_csv(self):
+        path = self._write("movements.csv", "\n".join([
+            "ean,code,from_location,to_location,quantity,unit_price,note",
+            "8001,,%(supplier)s,%(storage)s,10,0.5,first",
+            ",P2,%(supplier)s,%(storage)s,4,,",
+            "8001,,%(supplier)s,%(storage)s,10,1.5,",
+            "",
+        ]) % {"supplier": self.supplier.slug, "storage": self.storage.slug})
+
+        output = self._call(path)
+
+        self.assertIn("3 rows imported, 0 rejected", output)
+        self.assertEqual(get_storage_quantity(self.product), 20)
+        self.assertEqual(get_stock_price(self.product, Location.LOCATION_STORAGE), Money(1, "EUR"))
+        self.assertEqual(get_stock_price(self.other, Location.LOCATION_STORAGE), Money(2, "EUR"))
+        self.assertEqual(Movement.objects.filter(note="first", agent="import").count(), 1)
+
+        # composite stocks follow their components
+        self.assertEqual(get_storage_quantity(self.composite), 10)
+
+    def test_rejected_rows_jsonl(self):
+        rows = [
+            {"ean": "8001", "from_location": self.supplier.slug, "to_location": self.storage.slug, "quantity": 3},
+            {"ean": "0000", "from_location": self.supplier.slug, "to_location": self.storage.slug, "quantity": 3},
+            {"ean": "8002", "from_location": "nowhere", "to_location": self.storage.slug, "quantity": 3},
+            {"ean": "8002", "from_location": self.supplier.slug, "to_location": self.storage.slug, "quantity": 0},
+            {"ean": "9001", "from_location": self.supplier.slug, "to_location": self.storage.slug, "quantity": 1},
+        ]
+        path = self._write("movements.jsonl", "\n".join(json.dumps(row) for row in rows) + "\nnot json\n")
+        rejected_path = os.path.join(self.directory, "rejected.jsonl")
+
+        output = self._call(path, rejected=rejected_path)
+
+        self.assertIn("1 rows imported, 5 rejected", output)
+        self.assertEqual(get_storage_quantity(self.product), 3)
+
+        with io.open(rejected_path, encoding="utf-8") as stream:
+            rejected = [json.loads(line) for line in stream]
+
+        self.assertEqual([row["error"] for row in rejected], [
+            "Unknown product '0000'",
+            "Unknown from_location 'nowhere'",
+            "Quantity must be a positive amount",
+            "Composite products are moved through their components",
+            "Invalid row",
+        ])
+        self.assertEqual(rejected[-1]["row"], "not json")
+
+    def test_rejected_rows_csv(self):
+        path = self._write("movements.csv", "\n".join([
+            "ean,from_location,to_location,quantity",
+            "8001,%(supplier)s,%(storage)s,many",
+            "",
+        ]) % {"supplier": self.supplier.slug, "storage": self.storage.slug})
+        rejected_path = os.path.join(self.directory, "rejected.csv")
+
+        self._call(path, rejected=rejected_path)
+
+        with io.open(rejected_path, encoding="utf-8") as stream:
+            lines = stream.read().splitlines()
+
+        self.assertEqual(lines[0], "ean,from_location,quantity,to_location,error")
+        self.assertTrue(lines[1].endswith(",Invalid quantity 'many'"))
+
+    def test_rejected_decimals(self):
+        rows = [
+            {"ean": "8001", "from_location": self.supplier.slug, "to_location": self.storage.slug, "quantity": "nan"},
+            {"ean": "8001", "from_location": self.supplier.slug, "to_location": self.storage.slug,
+             "quantity": "Infinity"},
+            {"ean": "8001", "from_location": self.supplier.slug, "to_location": self.storage.slug, "quantity": 2,
+             "unit_price": "1e40"},
+            {"ean": "8001", "from_location": self.supplier.slug, "to_location": self.storage.slug, "quantity": 2,
+             "unit_price": "0.001"},
+            {"ean": "8001", "from_location": self.supplier.slug, "to_location": self.storage.slug, "quantity": 2,
+             "currency": "USD"},
+            {"ean": "8001", "from_location": self.supplier.slug, "to_location": self.storage.slug, "quantity": 2,
+             "unit_price": "99999999999999999999999999.99"},
+        ]
+        path = self._write("movements.jsonl", "\n".join(json.dumps(row) for row in rows) + "\n")
+        rejected_path = os.path.join(self.directory, "rejected.jsonl")
+
+        output = self._call(path, rejected=rejected_path)
+
+        self.assertIn("1 rows imported, 5 rejected", output)
+        self.assertEqual(get_storage_quantity(self.product), 2)
+
+        with io.open(rejected_path, encoding="utf-8") as stream:
+            rejected = [json.loads(line) for line in stream]
+
+        self.assertEqual([row["error"] for row in rejected], [
+            "Invalid quantity 'nan'",
+            "Invalid quantity 'Infinity'",
+            "Too large unit_price '1e40'",
+            "Too many decimal places in unit_price '0.001'",
+            "Currency 'USD' given without unit price",
+        ])
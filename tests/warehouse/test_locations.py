@@ -0,0 +1,82 @@
+from __future__ import unicode_literals
+
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+
+from bazaar.settings import bazaar_settings
+from bazaar.warehouse import locations
+from bazaar.warehouse.models import Location
+
+from ..factories import StorageFactory
+
+
+class TestLocationsRegistry(TestCase):
+    def tearDown(self):
+        locations.clear()
+
+    def test_well_known_location_is_created(self):
+        storage = locations.get_storage()
+
+        self.assertEqual(storage.slug, bazaar_settings.STORAGE)
+        self.assertEqual(storage.type, Location.LOCATION_STORAGE)
+
+    def test_warm_caches_all_locations(self):
+        locations.warm()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(locations.get_storage().slug, bazaar_settings.STORAGE)
+            self.assertEqual(locations.get_output().slug, bazaar_settings.OUTPUT)
+            self.assertEqual(locations.get_customer().slug, bazaar_settings.CUSTOMER)
+            self.assertEqual(locations.get_supplier().slug, bazaar_settings.SUPPLIER)
+            self.assertEqual(locations.get_lost_and_found().slug, bazaar_settings.LOST_AND_FOUND)
+
+    def test_locations_are_cached_inside_transactions(self):
+        with transaction.atomic():
+            storage = locations.get_storage()
+
+            with self.assertNumQueries(0):
+                for i in range(3):
+                    self.assertEqual(locations.get_storage(), storage)
+
+    def test_registry_is_invalidated_on_location_save(self):
+        locations.warm()
+        storage = locations.get_storage()
+
+        storage.name = "new name"
+        storage.save()
+
+        self.assertEqual(locations.get_storage().name, "new name")
+
+    def test_registry_is_invalidated_on_location_delete(self):
+        locations.warm()
+        locations.get_storage().delete()
+
+        storage = StorageFactory(slug=bazaar_settings.STORAGE)
+        locations.warm()
+
+        self.assertEqual(locations.get_storage(), storage)
+
+
+class TestLocationsRegistryTransactions(TransactionTestCase):
+    def tearDown(self):
+        locations.clear()
+
+    def test_locations_join_the_registry_on_commit(self):
+        with transaction.atomic():
+            storage = locations.get_storage()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(locations.get_storage(), storage)
+
+    def test_locations_are_forgotten_on_rollback(self):
+        try:
+            with transaction.atomic():
+                storage = locations.get_storage()
+                raise ValueError
+        except ValueError:
+            pass
+
+        self.assertFalse(Location.objects.filter(slug=storage.slug).exists())
+        # the rolled back location is looked up again
+        storage = locations.get_storage()
+        self.assertTrue(Location.objects.filter(pk=storage.pk, slug=storage.slug).exists())
@@ -0,0 +1,238 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import threading
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from bazaar.listings.models import Listing
+from bazaar.warehouse.api import move, move_many, get_stock_summary
+from bazaar.warehouse.availability import get_availability_backend, get_available_quantity
+from bazaar.warehouse.exceptions import ReservationException, InsufficientStockException, ReservedStockException
+from bazaar.warehouse.models import Location, Movement, Reservation, Stock
+from bazaar.warehouse.reservations import reserve, commit, release, release_expired
+
+from ..base import run_commit_hooks
+from ..factories import (ProductFactory, StorageFactory, SupplierFactory, CustomerFactory, CompositeProductFactory,
+                         OutputFactory, ListingFactory, PublishingFactory, OrderFactory)
+
+
+class TestReservations(TestCase):
+    def setUp(self):
+        self.product = ProductFactory()
+        self.storage = StorageFactory()
+        self.supplier = SupplierFactory()
+        self.customer = CustomerFactory()
+        move(self.supplier, self.storage, self.product, 5, 2.0)
+
+    def get_stock(self, location):
+        return Stock.objects.get(product=self.product, location=location)
+
+    def get_reserved(self):
+        return self.get_stock(self.storage).reserved
+
+    def test_reserve(self):
+        reservation = reserve(self.product, 3, location=self.storage, reference="order 1")
+
+        self.assertTrue(reservation.is_pending())
+        self.assertEqual(reservation.reference, "order 1")
+        self.assertEqual(self.get_reserved(), 3)
+
+    def test_reserve_more_than_stock(self):
+        reserve(self.product, 3, location=self.storage)
+
+        with self.assertRaises(InsufficientStockException):
+            reserve(self.product, 3, location=self.storage)
+
+        self.assertEqual(self.get_reserved(), 3)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_reserve_without_stock(self):
+        with self.assertRaises(InsufficientStockException):
+            reserve(ProductFactory(), 1, location=self.storage)
+
+    def test_reserve_invalid_quantity(self):
+        with self.assertRaises(ReservationException):
+            reserve(self.product, 0, location=self.storage)
+
+    def test_reserve_composite(self):
+        with self.assertRaises(ReservationException):
+            reserve(CompositeProductFactory(), 1, location=self.storage)
+
+    def test_commit(self):
+        reservation = reserve(self.product, 2, location=self.storage)
+        commit(reservation, to_location=self.customer)
+
+        self.assertEqual(reservation.status, Reservation.RESERVATION_COMMITTED)
+        self.assertEqual(self.get_reserved(), 0)
+        self.assertEqual(self.get_stock(self.storage).quantity, 3)
+        self.assertEqual(self.get_stock(self.customer).quantity, 2)
+
+        with self.assertRaises(ReservationException):
+            commit(reservation, to_location=self.customer)
+        self.assertEqual(self.get_stock(self.customer).quantity, 2)
+
+    def test_release(self):
+        reservation = reserve(self.product, 2, location=self.storage)
+
+        self.assertTrue(release(reservation))
+        self.assertFalse(release(reservation))
+
+        self.assertEqual(reservation.status, Reservation.RESERVATION_RELEASED)
+        self.assertEqual(self.get_reserved(), 0)
+        self.assertEqual(self.get_stock(self.storage).quantity, 5)
+
+        with self.assertRaises(ReservationException):
+            commit(reservation)
+
+    def test_release_expired(self):
+        expired = reserve(self.product, 2, location=self.storage, timeout=0)
+        pending = reserve(self.product, 1, location=self.storage)
+
+        self.assertEqual(release_expired(now=timezone.now() + timedelta(seconds=1)), 1)
+
+        self.assertEqual(Reservation.objects.get(pk=expired.pk).status, Reservation.RESERVATION_RELEASED)
+        self.assertEqual(Reservation.objects.get(pk=pending.pk).status, Reservation.RESERVATION_PENDING)
+        self.assertEqual(self.get_reserved(), 1)
+
+    def test_reserve_releases_expired_reservations(self):
+        expired = reserve(self.product, 4, location=self.storage, timeout=-1)
+        reserve(self.product, 3, location=self.storage)
+
+        self.assertEqual(Reservation.objects.get(pk=expired.pk).status, Reservation.RESERVATION_RELEASED)
+        self.assertEqual(self.get_reserved(), 3)
+
+    def test_release_reservations_command(self):
+        reserve(self.product, 4, location=self.storage, timeout=-1)
+
+        out = StringIO()
+        call_command("release_reservations", stdout=out)
+
+        self.assertIn("1 expired reservations released", out.getvalue())
+        self.assertEqual(self.get_reserved(), 0)
+
+
+class TestReservedStock(TestCase):
+    def setUp(self):
+        cache.clear()
+
+        self.user = get_user_model().objects.create_user(username='test', email='test@test.it', password='test')
+        self.product = ProductFactory(price=2)
+        self.storage = StorageFactory()
+        self.supplier = SupplierFactory()
+        self.output = OutputFactory()
+        move(self.supplier, self.storage, self.product, 5, 2.0)
+        reserve(self.product, 3, location=self.storage)
+
+    def get_quantity(self):
+        return Stock.objects.get(product=self.product, location=self.storage).quantity
+
+    def test_move_cannot_take_reserved_units(self):
+        with self.assertRaises(ReservedStockException):
+            move(self.storage, self.output, self.product, 3, 2.0)
+        self.assertEqual(self.get_quantity(), 5)
+
+        move(self.storage, self.output, self.product, 2, 2.0)
+        self.assertEqual(self.get_quantity(), 3)
+
+    def test_move_many_cannot_take_reserved_units(self):
+        movements = [Movement(from_location=self.storage, to_location=self.output, product=self.product,
+                              quantity=1, unit_price=2) for i in range(3)]
+        with self.assertRaises(ReservedStockException):
+            move_many(movements)
+        self.assertEqual(self.get_quantity(), 5)
+
+        move_many(movements[:2])
+        self.assertEqual(self.get_quantity(), 3)
+
+    def test_committed_reservation_moves_reserved_units(self):
+        reservation = Reservation.objects.get()
+        commit(reservation, to_location=self.output)
+        self.assertEqual(self.get_quantity(), 2)
+
+    def test_available_quantities_exclude_reserved_units(self):
+        OrderFactory(publishing=PublishingFactory(listing=ListingFactory(product=self.product)), quantity=1)
+
+        self.assertEqual(get_available_quantity(self.product), 1)
+        stock = Stock.objects.get(product=self.product, location=self.storage)
+        self.assertEqual(get_availability_backend().available(stock), 1)
+
+    def test_available_quantities_are_invalidated_by_reservations(self):
+        self.assertEqual(get_available_quantity(self.product), 2)
+
+        with run_commit_hooks():
+            reservation = reserve(self.product, 1, location=self.storage)
+        self.assertEqual(get_available_quantity(self.product), 1)
+
+        with run_commit_hooks():
+            release(reservation)
+        self.assertEqual(get_available_quantity(self.product), 2)
+
+    def test_listing_available_units_exclude_reserved_units(self):
+        listing = ListingFactory(product=self.product)
+        self.assertEqual(listing.available_units, 2)
+
+        listing = Listing.objects.prefetch_stock().get(pk=listing.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(listing.available_units, 2)
+
+    def test_stock_summary_reserved(self):
+        summary = get_stock_summary([self.product], Location.LOCATION_STORAGE)
+
+        self.assertEqual(summary.get_quantity(self.product), 5)
+        self.assertEqual(summary.get_reserved(self.product), 3)
+        self.assertEqual(summary.get_available(self.product), 2)
+
+    def test_movement_view_cannot_take_reserved_units(self):
+        self.client.login(username=self.user.username, password='test')
+        response = self.client.post(reverse("bazaar:movement"), {
+            "product": self.product.pk, "from_location": self.storage.pk, "to_location": self.output.pk,
+            "unit_price_0": 2, "unit_price_1": "EUR", "quantity": 3, "note": ""})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("quantity", response.context_data["form"].errors)
+        self.assertEqual(self.get_quantity(), 5)
+
+
+class TestConcurrentReservations(TransactionTestCase):
+    threads = 8
+    reservations_per_thread = 10
+
+    def setUp(self):
+        self.product = ProductFactory()
+        self.storage = StorageFactory()
+        move(SupplierFactory(), self.storage, self.product, 50, 1.0)
+
+    def test_parallel_reservations_do_not_oversell(self):
+        errors = []
+        reserved = []
+
+        def worker():
+            try:
+                for i in range(self.reservations_per_thread):
+                    try:
+                        reserved.append(reserve(self.product, 1, location=self.storage))
+                    except InsufficientStockException:
+                        pass
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(reserved), 50)
+        self.assertEqual(Stock.objects.get(product=self.product, location=self.storage).reserved, 50)
@@ -0,0 +1,136 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from bazaar.goods.models import Product
+from bazaar.warehouse.api import move, move_many
+from bazaar.warehouse.models import DailySales, Movement
+from bazaar.warehouse.sales import get_sales_day
+
+from ..factories import ProductFactory, StorageFactory, SupplierFactory, CustomerFactory
+
+
+class TestDailySales(TestCase):
+    def setUp(self):
+        self.product = ProductFactory()
+        self.other = ProductFactory()
+        self.storage = StorageFactory()
+        self.supplier = SupplierFactory()
+        self.customer = CustomerFactory()
+
+        self.today = get_sales_day(timezone.now())
+
+        move(self.supplier, self.storage, self.product, 100, 1)
+        move(self.supplier, self.storage, self.other, 100, 1)
+
+    def get_sales(self, product):
+        return dict(DailySales.objects.filter(product=product).values_list("date", "quantity"))
+
+    def sell(self, days_ago, product, quantity):
+        self.move(days_ago, self.storage, self.customer, product, quantity)
+
+    def move(self, days_ago, from_location, to_location, product, quantity):
+        move(from_location, to_location, product, quantity, 1)
+        movement = Movement.objects.latest("pk")
+        movement.date = timezone.now() - timedelta(days=days_ago)
+        movement.save()
+
+    def test_move_records_sales(self):
+        move(self.storage, self.customer, self.product, 2, 1)
+        move(self.storage, self.customer, self.product, 3, 1)
+        move(self.customer, self.storage, self.product, 1, 1)
+
+        self.assertEqual(self.get_sales(self.product), {self.today: 4})
+        self.assertEqual(self.get_sales(self.other), {})
+
+    def test_move_many_subtracts_returns(self):
+        move(self.storage, self.customer, self.product, 5, 1)
+        move_many([
+            Movement(from_location=self.customer, to_location=self.storage, product=self.product, quantity=2,
+                     unit_price=1),
+            Movement(from_location=self.customer, to_location=self.storage, product=self.other, quantity=1,
+                     unit_price=1),
+        ])
+
+        self.assertEqual(self.get_sales(self.product), {self.today: 3})
+        self.assertEqual(self.get_sales(self.other), {self.today: -1})
+
+    def test_move_many_records_sales(self):
+        move(self.storage, self.customer, self.product, 1, 1)
+        move_many([
+            Movement(from_location=self.storage, to_location=self.customer, product=self.product, quantity=2,
+                     unit_price=1),
+            Movement(from_location=self.storage, to_location=self.customer, product=self.other, quantity=4,
+                     unit_price=1),
+            Movement(from_location=self.supplier, to_location=self.storage, product=self.other, quantity=8,
+                     unit_price=1),
+        ])
+
+        self.assertEqual(self.get_sales(self.product), {self.today: 3})
+        self.assertEqual(self.get_sales(self.other), {self.today: 4})
+
+    def test_rebuild_sales_command(self):
+        self.sell(1, self.product, 2)
+        self.sell(1, self.product, 3)
+        self.sell(10, self.other, 4)
+
+        out = StringIO()
+        call_command("rebuild_sales", stdout=out)
+
+        self.assertIn("2 daily sales rebuilt", out.getvalue())
+        self.assertEqual(self.get_sales(self.product), {self.today - timedelta(days=1): 5})
+        self.assertEqual(self.get_sales(self.other), {self.today - timedelta(days=10): 4})
+
+    def test_rebuild_sales_subtracts_returns(self):
+        self.sell(3, self.product, 5)
+        self.move(3, self.customer, self.storage, self.product, 1)
+        self.move(1, self.customer, self.storage, self.product, 2)
+        self.move(2, self.customer, self.customer, self.other, 4)
+
+        call_command("rebuild_sales", stdout=StringIO())
+
+        self.assertEqual(self.get_sales(self.product), {
+            self.today - timedelta(days=3): 4,
+            self.today - timedelta(days=1): -2,
+        })
+        self.assertEqual(self.get_sales(self.other), {})
+
+    def test_recorded_sales_match_rebuilt_sales(self):
+        move(self.storage, self.customer, self.product, 6, 1)
+        move(self.customer, self.storage, self.product, 2, 1)
+        move_many([
+            Movement(from_location=self.storage, to_location=self.customer, product=self.other, quantity=3,
+                     unit_price=1),
+            Movement(from_location=self.customer, to_location=self.storage, product=self.other, quantity=1,
+                     unit_price=1),
+        ])
+        recorded = (self.get_sales(self.product), self.get_sales(self.other))
+
+        call_command("rebuild_sales", stdout=StringIO())
+
+        self.assertEqual((self.get_sales(self.product), self.get_sales(self.other)), recorded)
+        self.assertEqual(recorded, ({self.today: 4}, {self.today: 2}))
+
+    def test_with_sales_velocity(self):
+        self.sell(1, self.product, 7)
+        self.sell(20, self.product, 30)
+        self.sell(3, self.other, 14)
+        call_command("rebuild_sales", stdout=StringIO())
+
+        products = Product.objects.filter(pk__in=[self.product.pk, self.other.pk])
+
+        weekly = products.with_sales_velocity(days=7).order_by("-sales_velocity")
+        self.assertEqual([(p.pk, p.sales_velocity) for p in weekly], [(self.other.pk, 2), (self.product.pk, 1)])
+
+        monthly = list(products.with_sales_velocity(days=30).order_by("-sales_velocity"))
+        self.assertEqual([p.pk for p in monthly], [self.product.pk, self.other.pk])
+        self.assertAlmostEqual(float(monthly[0].sales_velocity), 37 / 30.0, places=3)
+
+        past = products.with_sales_velocity(days=3, present=timezone.now() - timedelta(days=15))
+        self.assertEqual(past.get(pk=self.product.pk).sales_velocity, 0)
@@ -0,0 +1,112 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
+import mock
+
+from bazaar.warehouse.api import move, move_many
+from bazaar.warehouse.backends import ViewStockBackend
+from bazaar.warehouse.locations import get_storage
+from bazaar.warehouse.models import Movement, Stock, StorageSummary
+from bazaar.warehouse.signals import storage_changed
+from bazaar.warehouse.summaries import defer_summary_updates, update_storage_summaries
+
+from ..base import run_commit_hooks
+from ..factories import ProductFactory, SupplierFactory, CustomerFactory, CompositeProductFactory, ProductSetFactory
+
+
+class TestStorageSummaries(TestCase):
+    def setUp(self):
+        self.product = ProductFactory()
+        self.other = ProductFactory()
+        self.storage = get_storage()
+        self.supplier = SupplierFactory()
+        self.customer = CustomerFactory()
+
+    def get_summary(self, product):
+        return StorageSummary.objects.get(product=product)
+
+    def test_move_updates_summary(self):
+        with run_commit_hooks():
+            move(self.supplier, self.storage, self.product, 10, 1.0)
+            move(self.supplier, self.storage, self.product, 10, 3.0)
+            move(self.storage, self.customer, self.product, 5, 2.0)
+
+        summary = self.get_summary(self.product)
+        self.assertEqual(summary.quantity, 15)
+        self.assertEqual(summary.unit_price.amount, 2)
+        self.assertFalse(StorageSummary.objects.filter(product=self.other).exists())
+
+    def test_move_writes_summary_with_one_query(self):
+        with run_commit_hooks():
+            move(self.supplier, self.storage, self.product, 10, 1.0)
+
+        with self.assertNumQueries(16):
+            with CaptureQueriesContext(connection) as queries, run_commit_hooks():
+                move(self.supplier, self.storage, self.product, 10, 3.0)
+
+        # the stock sent with the signal is copied by a single update
+        summary_queries = [query for query in queries.captured_queries if "warehouse_storagesummary" in query["sql"]]
+        self.assertEqual(len(summary_queries), 1)
+        self.assertEqual(self.get_summary(self.product).unit_price.amount, 2)
+
+    def test_move_many_updates_summaries(self):
+        with run_commit_hooks():
+            move_many([
+                Movement(from_location=self.supplier, to_location=self.storage, product=self.product, quantity=2,
+                         unit_price=1),
+                Movement(from_location=self.supplier, to_location=self.storage, product=self.other, quantity=4,
+                         unit_price=1),
+            ])
+
+        self.assertEqual(self.get_summary(self.product).quantity, 2)
+        self.assertEqual(self.get_summary(self.other).quantity, 4)
+
+    def test_composite_summary(self):
+        composite = CompositeProductFactory()
+        ProductSetFactory(composite=composite, product=self.product, quantity=2)
+        with run_commit_hooks():
+            self.product.move(self.supplier, self.storage, quantity=10)
+
+        self.assertEqual(self.get_summary(composite).quantity, 5)
+
+    @mock.patch("bazaar.warehouse.backends._backend", ViewStockBackend())
+    def test_view_backend_summaries_are_updated_by_refresh(self):
+        # a materialized view sends the stock as of its last refresh
+        stock = Stock.objects.create(product=self.product, location=self.storage, quantity=10, unit_price=1)
+        storage_changed.send(sender=stock, product=self.product)
+
+        self.assertFalse(StorageSummary.objects.exists())
+
+    def test_deferred_updates(self):
+        with defer_summary_updates():
+            with run_commit_hooks():
+                move(self.supplier, self.storage, self.product, 10, 1.0)
+            self.assertFalse(StorageSummary.objects.exists())
+
+        self.assertEqual(self.get_summary(self.product).quantity, 10)
+
+    def test_update_storage_summaries(self):
+        move(self.supplier, self.storage, self.product, 10, 1.0)
+        move(self.supplier, self.storage, self.other, 10, 1.0)
+        StorageSummary.objects.filter(product=self.product).update(quantity=1)
+        StorageSummary.objects.filter(product=self.other).delete()
+
+        self.assertEqual(update_storage_summaries(), 2)
+        self.assertEqual(update_storage_summaries(), 0)
+        self.assertEqual(self.get_summary(self.product).quantity, 10)
+        self.assertEqual(self.get_summary(self.other).quantity, 10)
+
+    def test_refresh_stock_command_updates_summaries(self):
+        move(self.supplier, self.storage, self.product, 10, 1.0)
+        StorageSummary.objects.all().delete()
+
+        out = StringIO()
+        call_command("refresh_stock", stdout=out)
+
+        self.assertIn("1 storage summaries updated", out.getvalue())
+        self.assertEqual(self.get_summary(self.product).quantity, 10)
@@ -0,0 +1,108 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from bazaar.warehouse.api import move
+from bazaar.warehouse.models import Movement
+from bazaar.warehouse.valuation import FifoCost, get_product_ranges, value_inventory, value_products
+
+from ..factories import ProductFactory, StorageFactory, SupplierFactory, OutputFactory, CustomerFactory
+
+
+class TestFifoCost(TestCase):
+    def test_outgoing_units_consume_oldest_layers(self):
+        fifo = FifoCost()
+        fifo.add(Decimal(10), Decimal(1))
+        fifo.add(Decimal(10), Decimal(3))
+        fifo.remove(Decimal(15))
+
+        self.assertEqual(fifo.quantity, 5)
+        self.assertEqual(fifo.value, 15)
+
+    def test_deficit_is_covered_by_incoming_units(self):
+        fifo = FifoCost()
+        fifo.add(Decimal(2), Decimal(1))
+        fifo.remove(Decimal(5))
+
+        self.assertEqual(fifo.quantity, -3)
+        self.assertEqual(fifo.value, -3)
+
+        fifo.add(Decimal(4), Decimal(2))
+        self.assertEqual(fifo.quantity, 1)
+        self.assertEqual(fifo.value, 2)
+
+
+class TestValuation(TestCase):
+    def setUp(self):
+        self.product = ProductFactory()
+        self.other = ProductFactory()
+        self.storage = StorageFactory()
+        self.output = OutputFactory()
+        self.supplier = SupplierFactory()
+        self.customer = CustomerFactory()
+
+        self.now = timezone.now()
+
+        self.move(20, self.supplier, self.storage, self.product, 10, 1)
+        self.move(15, self.supplier, self.storage, self.product, 10, 3)
+        # moves between valued locations do not change the inventory
+        self.move(12, self.storage, self.output, self.product, 5, 100)
+        self.move(10, self.output, self.customer, self.product, 15, 100)
+        self.move(5, self.supplier, self.storage, self.product, 10, 5)
+        self.move(1, self.supplier, self.storage, self.other, 2, 7)
+
+    def move(self, days_ago, from_location, to_location, product, quantity, unit_price):
+        move(from_location, to_location, product, quantity, unit_price)
+        movement = Movement.objects.latest("pk")
+        movement.date = self.now - timedelta(days=days_ago)
+        movement.save()
+
+    def test_value_products(self):
+        product, other = value_products(self.product.pk, self.other.pk, end=self.now)
+
+        self.assertEqual(product.product_id, self.product.pk)
+        self.assertEqual(product.quantity, 15)
+        # average cost is 2 after the first two moves, then (5 * 2 + 10 * 5) / 15
+        self.assertEqual(product.average_value, Decimal("60.00"))
+        # 5 units at 3 and 10 at 5 are left
+        self.assertEqual(product.fifo_value, Decimal("65.00"))
+
+        self.assertEqual(other.quantity, 2)
+        self.assertEqual(other.average_value, 14)
+        self.assertEqual(other.fifo_value, 14)
+
+    def test_value_products_in_period(self):
+        product, = value_products(self.product.pk, self.product.pk, end=self.now - timedelta(days=7),
+                                  start=self.now - timedelta(days=18))
+
+        self.assertEqual(product.opening_quantity, 10)
+        self.assertEqual(product.opening_average_value, 10)
+        self.assertEqual(product.opening_fifo_value, 10)
+
+        self.assertEqual(product.quantity, 5)
+        self.assertEqual(product.average_value, 10)
+        self.assertEqual(product.fifo_value, 15)
+
+    def test_value_inventory(self):
+        product = ProductFactory()
+        valuations = list(value_inventory(self.now, range_size=1))
+
+        self.assertEqual([valuation.product_id for valuation in valuations], [self.product.pk, self.other.pk])
+        self.assertEqual(list(get_product_ranges(2)), [(self.product.pk, self.other.pk), (product.pk, product.pk)])
+
+    def test_value_inventory_command(self):
+        out = StringIO()
+        call_command("value_inventory", stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], "product_id,opening_quantity,opening_average_value,opening_fifo_value,"
+                                   "quantity,average_value,fifo_value")
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith("%s," % self.product.pk))
@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.encoding import force_text
+
+from bazaar.warehouse.api import move
+from bazaar.warehouse.models import Movement
+
+from ..factories import ProductFactory, StorageFactory, SupplierFactory, OutputFactory
+
+
+class TestExportViews(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='test', email='test@test.it', password='test')
+        self.client.login(username=self.user.username, password='test')
+
+        self.product = ProductFactory(ean="8001", name="first")
+        self.other = ProductFactory(ean="8002", name="second")
+        self.storage = StorageFactory()
+        self.supplier = SupplierFactory()
+        self.output = OutputFactory()
+
+        move(self.supplier, self.storage, self.product, 10, 1.5)
+        move(self.storage, self.output, self.product, 4, 1.5)
+        move(self.supplier, self.storage, self.other, 3, 2.0)
+
+        old = Movement.objects.get(product=self.other)
+        Movement.objects.filter(pk=old.pk).update(date=timezone.now() - timedelta(days=10))
+
+    def _get(self, name, export_format, **params):
+        response = self.client.get(reverse(name, kwargs={"format": export_format}), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return force_text(b"".join(response.streaming_content)).splitlines()
+
+    def test_movements_csv(self):
+        lines = self._get("bazaar:movement-export", "csv")
+
+        self.assertEqual(lines[0], "id,date,product_id,ean,code,product,from_location,to_location,quantity,"
+                                   "unit_price,currency,agent,note")
+        self.assertEqual(len(lines), 4)
+        # movements are exported in date order
+        self.assertIn(",8002,", lines[1])
+
+    def test_movements_jsonl_filters(self):
+        rows = [json.loads(line) for line in self._get("bazaar:movement-export", "jsonl",
+                                                       location=self.output.slug)]
+
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["from_location"], self.storage.slug)
+        self.assertEqual(rows[0]["to_location"], self.output.slug)
+        self.assertEqual(rows[0]["product"], "first")
+        self.assertEqual(Decimal(rows[0]["quantity"]), 4)
+
+        since = (timezone.now() - timedelta(days=1)).date().isoformat()
+        rows = self._get("bazaar:movement-export", "jsonl", date_from=since, product=self.product.pk)
+        self.assertEqual(len(rows), 2)
+
+    def test_stocks_jsonl(self):
+        rows = [json.loads(line) for line in self._get("bazaar:stock-export", "jsonl", location=self.storage.slug)]
+
+        self.assertEqual(dict((row["ean"], Decimal(row["quantity"])) for row in rows), {"8001": 6, "8002": 3})
+
+    def test_invalid_filter(self):
+        response = self.client.get(reverse("bazaar:movement-export", kwargs={"format": "csv"}), {"date_from": "x"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get(reverse("bazaar:stock-export", kwargs={"format": "csv"}))
+        self.assertEqual(response.status_code, 302)